@@ -1,4 +1,5 @@
-from typing import AsyncGenerator
+import hmac
+from typing import AsyncGenerator, Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwt, JWTError
@@ -8,33 +9,50 @@ from sqlalchemy import select
 
 from app.core.config import settings
 from app.core.security import ALGORITHM
+from app.core.tracing import span
 from app.db.session import get_db
 from app.models.user import User
 from app.schemas.user import TokenPayload
+from app.services.auth_cache import token_cache, user_cache
 
 security = HTTPBearer()
 
 
-async def get_current_user(
-    db: AsyncSession = Depends(get_db),
-    credentials: HTTPAuthorizationCredentials = Depends(security)
-) -> User:
+def _user_id_from_token(token: str) -> int:
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
     try:
-        payload = jwt.decode(
-            credentials.credentials, settings.SECRET_KEY, algorithms=[ALGORITHM]
-        )
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
         token_data = TokenPayload(**payload)
     except (JWTError, ValidationError):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
-    
-    result = await db.execute(select(User).where(User.id == token_data.sub))
+    if token_data.sub is not None and payload.get("exp"):
+        token_cache.put(token, token_data.sub, float(payload["exp"]))
+    return token_data.sub
+
+
+async def get_current_user(
+    db: AsyncSession = Depends(get_db),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> User:
+    with span("jwt"):
+        user_id = _user_id_from_token(credentials.credentials)
+
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+
+    with span("db.user"):
+        result = await db.execute(select(User).where(User.id == user_id))
     user = result.scalar_one_or_none()
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    user_cache.put(user)
     return user
 
 
@@ -43,4 +61,19 @@ async def get_current_active_user(
 ) -> User:
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    return current_user 
\ No newline at end of file
+    return current_user 
+
+
+async def verify_metrics_token(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False))
+) -> None:
+    """Guard for the operational endpoints (see ``METRICS_TOKEN``)."""
+    if not settings.METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if credentials is None or not hmac.compare_digest(
+        credentials.credentials.encode(), settings.METRICS_TOKEN.encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Could not validate credentials",
+        )
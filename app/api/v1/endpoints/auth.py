@@ -2,15 +2,24 @@ from datetime import timedelta
 from typing import Any
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update
 from app.core.config import settings
-from app.core.security import create_access_token, get_password_hash, verify_password
+from app.core.tracing import TracedRoute, span
+from app.core.security import PasswordHasherBusy, create_access_token, password_hasher
 from app.db.session import get_db
 from app.models.user import User
 from app.schemas.user import Token, UserCreate, User as UserSchema
 from app.schemas.auth import LoginRequest
 
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
+
+
+def _hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many concurrent logins, try again shortly",
+        headers={"Retry-After": "1"},
+    )
 
 
 @router.post("/login", response_model=Token)
@@ -22,23 +31,46 @@ async def login(
     """
     Login to get JWT token
     """
-    result = await db.execute(
-        select(User).where(User.email == login_data.email)
-    )
+    with span("db.user"):
+        result = await db.execute(
+            select(User).where(User.email == login_data.email)
+        )
     user = result.scalar_one_or_none()
+    # Hashing takes far longer than any query: don't hold a pooled
+    # connection through it
+    await db.close()
     
-    if not user or not verify_password(login_data.password, user.hashed_password):
+    valid = False
+    if user:
+        try:
+            with span("password"):
+                valid, new_hash = await password_hasher.verify_and_update(
+                    login_data.password, user.hashed_password
+                )
+        except PasswordHasherBusy:
+            raise _hasher_busy()
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    if new_hash:
+        # The stored hash used outdated parameters (e.g. fewer BCRYPT_ROUNDS);
+        # left alone if the password was changed meanwhile
+        await db.execute(
+            update(User)
+            .where(User.id == user.id, User.hashed_password == user.hashed_password)
+            .values(hashed_password=new_hash)
+        )
+        await db.commit()
+
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    with span("jwt"):
+        access_token = create_access_token(user.id, expires_delta=access_token_expires)
     return {
-        "access_token": create_access_token(
-            user.id, expires_delta=access_token_expires
-        ),
+        "access_token": access_token,
         "token_type": "bearer",
     }
 
@@ -59,10 +91,15 @@ async def register(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="The user with this email already exists in the system.",
         )
+    await db.close()
     
+    try:
+        hashed_password = await password_hasher.hash(user_in.password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
     user = User(
         email=user_in.email,
-        hashed_password=get_password_hash(user_in.password),
+        hashed_password=hashed_password,
         is_superuser=False,
     )
     db.add(user)
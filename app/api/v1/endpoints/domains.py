@@ -1,19 +1,66 @@
-from typing import Any, List
-from fastapi import APIRouter, Depends, HTTPException, status
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Response, UploadFile, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, tuple_
 from app.api.deps import get_current_active_user
-from app.db.session import get_db
+from app.core.config import settings
+from app.core.tracing import TracedRoute, span
+from app.db.session import AsyncSessionLocal, get_db
+from app.models.check_history import DomainCheckHistory
 from app.models.domain import Domain
 from app.models.user import User
 from app.schemas.domain import (
     Domain as DomainSchema,
+    DomainBulkCreate,
+    DomainCheckHistory as DomainCheckHistorySchema,
+    DomainCheckHistoryPage,
     DomainCreate,
     DomainCheckResult
 )
+from app.services.bulk_onboarding import (
+    check_and_stream,
+    insert_new_domains,
+    parse_domain_file,
+    parse_domain_names,
+)
+from app.services.check_history import record_history
 from app.services.dns_checker import DNSChecker
+from app.services.scheduler import next_check_at
+from app.services.singleflight import SingleFlight
+
+router = APIRouter(route_class=TracedRoute)
+
+# Concurrent checks of the same (domain, selector, discover) share one DNS check and write
+check_flights = SingleFlight()
 
-router = APIRouter()
+
+async def _check_and_store(
+    domain_id: int,
+    domain_name: str,
+    selector: Optional[str],
+    dkim_selectors: List[str],
+    discover: bool,
+) -> dict:
+    with span("dns_check"):
+        check_result = await DNSChecker.check_all(
+            domain_name, selector=selector, dkim_selectors=dkim_selectors,
+            discover_dkim=discover
+        )
+    with span("db.store"):
+        async with AsyncSessionLocal() as db:
+            # Locked, so a concurrent re-check can't store its result in between
+            domain = await db.get(Domain, domain_id, with_for_update=True)
+            if domain is not None:
+                if domain.result_hash != Domain.result_fingerprint(check_result):
+                    await record_history(db, [(domain_id, check_result)])
+                domain.apply_check_result(check_result)
+                domain.next_check_at = next_check_at(check_result)
+                await db.commit()
+    return check_result
 
 
 @router.post("/", response_model=DomainSchema)
@@ -27,9 +74,10 @@ async def create_domain(
     Create new domain for the current user.
     """
     # Check if domain already exists
-    result = await db.execute(
-        select(Domain).where(Domain.domain_name == domain_in.domain_name)
-    )
+    with span("db.domain"):
+        result = await db.execute(
+            select(Domain).where(Domain.domain_name == domain_in.domain_name)
+        )
     if result.scalar_one_or_none():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -43,35 +91,171 @@ async def create_domain(
     )
     
     # Check DNS records
-    check_result = await DNSChecker.check_all(domain_in.domain_name)
-    domain.dmarc_record = check_result["dmarc_record"]
-    domain.dmarc_status = check_result["dmarc_status"]
-    domain.spf_record = check_result["spf_record"]
-    domain.spf_status = check_result["spf_status"]
-    domain.dkim_record = check_result["dkim_record"]
-    domain.dkim_status = check_result["dkim_status"]
-    domain.set_mx_records(check_result["mx_records"])
-    domain.mx_status = check_result["mx_status"]
-
-    db.add(domain)
-    await db.commit()
-    await db.refresh(domain)
+    with span("dns_check"):
+        check_result = await DNSChecker.check_all(domain_in.domain_name, discover_dkim=True)
+    domain.apply_check_result(check_result)
+    domain.next_check_at = next_check_at(check_result)
+
+    with span("db.store"):
+        db.add(domain)
+        await db.flush()
+        await record_history(db, [(domain.id, check_result)])
+        await db.commit()
+        await db.refresh(domain)
     return domain
 
 
-@router.get("/", response_model=List[DomainSchema])
+async def _bulk_create(db: AsyncSession, user: User, raw_names: List[str]):
+    names, invalid = parse_domain_names(raw_names)
+    if len(names) > settings.BULK_MAX_DOMAINS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.BULK_MAX_DOMAINS} domains per request",
+        )
+
+    created, existing = await insert_new_domains(db, user.id, names)
+    skipped = invalid + [
+        {"domain_name": name, "status": "exists", "detail": "Domain already registered"}
+        for name in existing
+    ]
+    return StreamingResponse(
+        check_and_stream(created, skipped),
+        media_type="application/x-ndjson",
+    )
+
+
+@router.post("/bulk")
+async def bulk_create_domains(
+    *,
+    db: AsyncSession = Depends(get_db),
+    domains_in: DomainBulkCreate,
+    current_user: User = Depends(get_current_active_user),
+) -> Any:
+    """
+    Create many domains for the current user.
+    
+    Names are normalized and deduplicated, names already registered are skipped
+    and the rest are inserted in batches. The response is NDJSON: one line per
+    skipped name, then one line per new domain as its DNS check finishes.
+    """
+    return await _bulk_create(db, current_user, domains_in.domain_names)
+
+
+@router.post("/bulk/upload")
+async def bulk_upload_domains(
+    *,
+    db: AsyncSession = Depends(get_db),
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_active_user),
+) -> Any:
+    """
+    Create many domains from an uploaded file with one domain per line
+    (or a CSV whose first column is the domain). Responds like `POST /bulk`.
+    """
+    return await _bulk_create(db, current_user, parse_domain_file(await file.read()))
+
+
+SORT_COLUMNS = {
+    "id": Domain.id,
+    "domain_name": Domain.domain_name,
+    "created_at": Domain.created_at,
+}
+
+# Page size when paging with only a cursor
+DEFAULT_PAGE_SIZE = 100
+
+# Everything but the record bodies, for ?fields=summary
+SUMMARY_COLUMNS = [
+    column for column in Domain.__table__.columns
+    if not column.name.endswith("_record") and column.name not in ("mx_records", "result_hash")
+]
+
+
+def _encode_cursor(sort: str, row) -> str:
+    value = getattr(row, sort)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, row.id]).encode()).decode()
+
+
+def _decode_cursor(sort: str, cursor: str) -> tuple:
+    try:
+        value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if sort == "created_at":
+            value = datetime.fromisoformat(value)
+        return value, int(last_id)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor",
+        )
+
+
+@router.get("/", response_model=List[DomainSchema], response_model_exclude_unset=True)
 async def read_domains(
+    response: Response,
     db: AsyncSession = Depends(get_db),
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    sort: str = Query("id", pattern="^(id|domain_name|created_at)$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    fields: str = Query("full", pattern="^(full|summary)$"),
+    overall_status: Optional[bool] = None,
+    dmarc_status: Optional[bool] = None,
+    spf_status: Optional[bool] = None,
+    dkim_status: Optional[bool] = None,
+    mx_status: Optional[bool] = None,
     current_user: User = Depends(get_current_active_user),
 ) -> Any:
     """
     Retrieve domains for current user.
+    
+    Filter on any of the status columns (e.g. `overall_status=false`) and sort
+    by `id`, `domain_name` or `created_at`. All matching domains are returned
+    unless `limit` or `cursor` is given: then the response is one page (of
+    `limit` domains, 100 by default) and when there are more results the
+    `X-Next-Cursor` response header holds the `cursor` for the next page.
+    `fields=summary` leaves out the record bodies.
     """
-    result = await db.execute(
-        select(Domain).where(Domain.user_id == current_user.id)
-    )
-    domains = result.scalars().all()
-    return domains
+    sort_column = SORT_COLUMNS[sort]
+    query = select(*SUMMARY_COLUMNS) if fields == "summary" else select(Domain)
+    query = query.where(Domain.user_id == current_user.id)
+
+    filters = {
+        "overall_status": overall_status,
+        "dmarc_status": dmarc_status,
+        "spf_status": spf_status,
+        "dkim_status": dkim_status,
+        "mx_status": mx_status,
+    }
+    for name, value in filters.items():
+        if value is not None:
+            query = query.where(getattr(Domain, name) == value)
+
+    # Ties on the sort column are broken by id
+    keys = (sort_column, Domain.id) if sort != "id" else (Domain.id,)
+    if cursor is not None:
+        value, last_id = _decode_cursor(sort, cursor)
+        after = tuple_(*((value, last_id) if sort != "id" else (last_id,)))
+        query = query.where(
+            tuple_(*keys) > after if order == "asc" else tuple_(*keys) < after
+        )
+    query = query.order_by(*(key.desc() if order == "desc" else key for key in keys))
+
+    if limit is None and cursor is not None:
+        limit = DEFAULT_PAGE_SIZE
+    if limit is not None:
+        query = query.limit(limit + 1)
+    with span("db.domains"):
+        result = await db.execute(query)
+    if fields == "summary":
+        rows = [DomainSchema.model_validate(dict(row._mapping)) for row in result]
+    else:
+        rows = result.scalars().all()
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(sort, rows[-1])
+    return rows
 
 
 @router.get("/{domain_id}", response_model=DomainSchema)
@@ -84,19 +268,74 @@ async def read_domain(
     """
     Get domain by ID.
     """
+    with span("db.domain"):
+        result = await db.execute(
+            select(Domain).where(
+                Domain.id == domain_id,
+                Domain.user_id == current_user.id
+            )
+        )
+    domain = result.scalar_one_or_none()
+    if not domain:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Domain not found",
+        )
+    return domain
+
+
+@router.get("/{domain_id}/history", response_model=DomainCheckHistoryPage)
+async def read_domain_history(
+    *,
+    db: AsyncSession = Depends(get_db),
+    domain_id: int,
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_active_user),
+) -> Any:
+    """
+    Get the change timeline of a domain, newest first.
+    
+    Each entry is a distinct check outcome with the time it was first seen
+    and the time it was last seen (for the current outcome, the latest check;
+    for earlier ones, the check that replaced them). Pass the returned
+    `next_cursor` as `cursor` to fetch the next page.
+    """
     result = await db.execute(
-        select(Domain).where(
+        select(Domain.last_checked_at).where(
             Domain.id == domain_id,
             Domain.user_id == current_user.id
         )
     )
-    domain = result.scalar_one_or_none()
-    if not domain:
+    domain = result.one_or_none()
+    if domain is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Domain not found",
         )
-    return domain
+
+    query = select(DomainCheckHistory).where(DomainCheckHistory.domain_id == domain_id)
+    if cursor is not None:
+        # Starting from the cursor row itself, which ended the page's first entry
+        query = query.where(DomainCheckHistory.id <= cursor)
+    result = await db.execute(
+        query.order_by(DomainCheckHistory.id.desc()).limit(limit + 2)
+    )
+    rows = result.scalars().all()
+    # The current outcome was last seen at the domain's latest check
+    last_seen = domain.last_checked_at if cursor is None else None
+    if cursor is not None and rows and rows[0].id == cursor:
+        last_seen = rows.pop(0).first_seen
+    items = []
+    for row in rows[:limit + 1]:
+        item = DomainCheckHistorySchema.model_validate(row)
+        items.append(item.model_copy(update={"last_seen": last_seen or row.first_seen}))
+        # Each outcome was seen until the next one replaced it
+        last_seen = row.first_seen
+    return {
+        "items": items[:limit],
+        "next_cursor": items[limit - 1].id if len(items) > limit else None,
+    }
 
 
 @router.post("/{domain_id}/check", response_model=DomainCheckResult)
@@ -104,6 +343,8 @@ async def check_domain(
     *,
     db: AsyncSession = Depends(get_db),
     domain_id: int,
+    selector: Optional[str] = None,
+    discover: bool = False,
     current_user: User = Depends(get_current_active_user),
 ) -> Any:
     """
@@ -112,19 +353,25 @@ async def check_domain(
     This endpoint performs a fresh check of all DNS records for the specified domain:
     - DMARC record
     - SPF record
-    - DKIM record
+    - DKIM records (under the given selector, or the selectors found on
+      earlier checks and then the common ones if none of those has a key;
+      for domains with no known selectors, the common ones are only probed
+      on the first check or with `discover=true`)
     - MX records
     
     The results are stored in the database and returned with detailed status information.
+    Concurrent checks of the same domain and selector are coalesced into a single
+    DNS check and database update, and every caller receives the same result.
     """
     try:
         # Get domain
-        result = await db.execute(
-            select(Domain).where(
-                Domain.id == domain_id,
-                Domain.user_id == current_user.id
+        with span("db.domain"):
+            result = await db.execute(
+                select(Domain).where(
+                    Domain.id == domain_id,
+                    Domain.user_id == current_user.id
+                )
             )
-        )
         domain = result.scalar_one_or_none()
         if not domain:
             raise HTTPException(
@@ -132,23 +379,21 @@ async def check_domain(
                 detail="Domain not found",
             )
 
-        # Check DNS records
-        check_result = await DNSChecker.check_all(domain.domain_name)
-        print(check_result)
-        # Update domain with new results
-        domain.dmarc_record = check_result["dmarc_record"]
-        domain.dmarc_status = check_result["dmarc_status"]
-        domain.spf_record = check_result["spf_record"]
-        domain.spf_status = check_result["spf_status"]
-        domain.dkim_record = check_result["dkim_record"]
-        domain.dkim_status = check_result["dkim_status"]
-        domain.set_mx_records(check_result["mx_records"])
-        domain.mx_status = check_result["mx_status"]
+        discover = discover or domain.last_checked_at is None
+        domain_name = domain.domain_name
+        dkim_selectors = domain.get_dkim_selectors()
+        # Give the connection back to the pool: the check stores its results
+        # through its own session, and holding this one while waiting for
+        # that one would exhaust the pool under concurrent checks
+        await db.close()
 
-        await db.commit()
-        await db.refresh(domain)
-        
-        return check_result
+        # Check DNS records and store the results, sharing any in-flight check
+        return await check_flights.do(
+            (domain_name, selector, discover),
+            lambda: _check_and_store(
+                domain_id, domain_name, selector, dkim_selectors, discover
+            ),
+        )
         
     except Exception as e:
         await db.rollback()
@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings
 import secrets
-from typing import List
+from typing import List, Optional
 
 
 class Settings(BaseSettings):
@@ -19,9 +19,34 @@ class Settings(BaseSettings):
     POSTGRES_HOST: str
     POSTGRES_PORT: str
     
+    # Overrides the Postgres URL, e.g. "sqlite+aiosqlite:///./local.db"
+    SQLALCHEMY_DATABASE_URI: Optional[str] = None
+    
     @property
     def DATABASE_URL(self) -> str:
+        if self.SQLALCHEMY_DATABASE_URI:
+            return self.SQLALCHEMY_DATABASE_URI
         return f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
+
+    # Connection pool: DB_POOL_SIZE connections kept open, up to
+    # DB_MAX_OVERFLOW more under load, waiting at most DB_POOL_TIMEOUT seconds
+    # for one. Connections are checked with a round trip before use when
+    # DB_POOL_PRE_PING and replaced after DB_POOL_RECYCLE seconds (-1 never).
+    # DB_POOL_SIZE=0 keeps the driver's default pool (for SQLite files, a new
+    # connection per session). On SQLite, DB_POOL_TIMEOUT is also how long a
+    # write waits for the database lock.
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE: int = 1800
+
+    # Statements slower than DB_SLOW_QUERY_SECONDS (0 disables) are logged
+    # with the shapes of their parameters, DB_SLOW_QUERY_SAMPLE_RATE of them.
+    # DB_ECHO logs every statement, for development only.
+    DB_SLOW_QUERY_SECONDS: float = 0.2
+    DB_SLOW_QUERY_SAMPLE_RATE: float = 1.0
+    DB_ECHO: bool = False
     
     # CORS
     BACKEND_CORS_ORIGINS: List[str] = ["*"]
@@ -35,7 +60,135 @@ class Settings(BaseSettings):
     @property
     def DNS_NAMESERVER_LIST(self) -> List[str]:
         return [ns.strip() for ns in self.DNS_NAMESERVERS.split(",")]
+
+    # Hedged queries: when a nameserver hasn't answered within its own
+    # DNS_HEDGE_PERCENTILE latency (clamped to the min/max delay; the max
+    # until DNS_HEDGE_MIN_SAMPLES answers are seen), the next one is asked
+    # too. Servers whose health score (a rolling success rate recovering with
+    # a DNS_HEALTH_RECOVERY-second half-life) is below DNS_UNHEALTHY_SCORE
+    # are asked last.
+    DNS_HEDGE_ENABLED: bool = True
+    DNS_HEDGE_PERCENTILE: float = 95.0
+    DNS_HEDGE_MIN_DELAY: float = 0.05
+    DNS_HEDGE_MAX_DELAY: float = 1.0
+    DNS_HEDGE_MIN_SAMPLES: int = 20
+    DNS_UNHEALTHY_SCORE: float = 0.5
+    DNS_HEALTH_RECOVERY: float = 30.0
+
+    # Adaptive (AIMD) cap on queries in flight to each nameserver: raised by
+    # one per timely answer, multiplied by DNS_UPSTREAM_BACKOFF on a timeout,
+    # SERVFAIL or REFUSED. DNS_UPSTREAM_MAX_LIMIT is the ceiling.
+    DNS_UPSTREAM_INITIAL_LIMIT: int = 20
+    DNS_UPSTREAM_MIN_LIMIT: int = 2
+    DNS_UPSTREAM_MAX_LIMIT: int = 200
+    DNS_UPSTREAM_BACKOFF: float = 0.5
+    DNS_UPSTREAM_LATENCY_TOLERANCE: float = 2.0
+
+    # Upstream transport. "udp" asks each query over UDP and re-asks truncated
+    # answers (long SPF records, DKIM keys) over a new TCP connection. "tcp"
+    # and "tls" (DNS over TLS, port 853 by default) keep up to DNS_POOL_SIZE
+    # connections open to each nameserver, each pipelining up to
+    # DNS_POOL_MAX_PIPELINE queries, and close those idle for
+    # DNS_POOL_IDLE_TIMEOUT seconds. TLS certificates are checked against
+    # DNS_TLS_SERVER_NAME, or a per-server "ip#name" in DNS_NAMESERVERS
+    # (e.g. "1.1.1.1#cloudflare-dns.com").
+    DNS_TRANSPORT: str = "udp"
+    DNS_POOL_SIZE: int = 2
+    DNS_POOL_MAX_PIPELINE: int = 100
+    DNS_POOL_IDLE_TIMEOUT: float = 30.0
+    DNS_TLS_SERVER_NAME: str = ""
+    DNS_TLS_VERIFY: bool = True
+
+    # DKIM selectors probed when discovering a domain's keys, at most
+    # DKIM_DISCOVERY_CONCURRENCY at a time per domain. Probes still
+    # unanswered after DKIM_DISCOVERY_TIMEOUT seconds are abandoned.
+    DKIM_SELECTORS: str = (
+        "default,google,selector1,selector2,k1,k2,k3,s1,s2,dkim,mail,smtp,"
+        "mx,key1,key2,sig1,mandrill,mailjet,pm,zendesk1,zendesk2,"
+        "everlytickey1,everlytickey2,20230601,20221208,20210112,20161025"
+    )
+    DKIM_DISCOVERY_TIMEOUT: float = 3.0
+    DKIM_DISCOVERY_CONCURRENCY: int = 8
+
+    @property
+    def DKIM_SELECTOR_LIST(self) -> List[str]:
+        return [s.strip() for s in self.DKIM_SELECTORS.split(",") if s.strip()]
+
+    # Per-check timeout budget and overall deadline for DNSChecker.check_all
+    DNS_CHECK_TIMEOUT: float = 5.0
+    DNS_CHECK_DEADLINE: float = 8.0
+
+    # Shared in-process DNS answer cache
+    DNS_CACHE_ENABLED: bool = True
+    DNS_CACHE_MAX_ENTRIES: int = 50000
+    DNS_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    DNS_CACHE_MAX_TTL: int = 86400
+    DNS_CACHE_NEGATIVE_MAX_TTL: int = 900
+
+    # Compiled SPF records (and what their mechanisms resolve to), shared by
+    # every domain that includes them
+    SPF_CACHE_MAX_ENTRIES: int = 10000
+    SPF_CACHE_MAX_TTL: int = 3600
+
+    # Deep MX checks resolve every exchange's A/AAAA records; resolutions are
+    # shared by every domain using the same mail hosts
+    MX_DEEP_CHECK: bool = True
+    MX_HOST_CACHE_MAX_ENTRIES: int = 10000
+    MX_HOST_CACHE_MAX_TTL: int = 3600
+    
+    # Bulk domain onboarding
+    BULK_MAX_DOMAINS: int = 10000
+    BULK_INSERT_BATCH_SIZE: int = 500
+    BULK_WRITE_BATCH_SIZE: int = 100
+    BULK_CHECK_CONCURRENCY: int = 50
+    
+    # Background re-check scheduler. Intervals follow the smallest record TTL
+    # seen in a check, clamped to [MIN, MAX] seconds and jittered by +/- JITTER.
+    RECHECK_ENABLED: bool = True
+    RECHECK_MIN_INTERVAL: int = 900
+    RECHECK_MAX_INTERVAL: int = 86400
+    RECHECK_JITTER: float = 0.1
+    RECHECK_CONCURRENCY: int = 20
+    RECHECK_BATCH_SIZE: int = 200
+    RECHECK_POLL_INTERVAL: float = 30.0
     
+    # Distributed check workers (python -m app.worker). When workers are
+    # deployed, set RECHECK_ENABLED=False on the API replicas.
+    WORKER_BATCH_SIZE: int = 100
+    WORKER_CONCURRENCY: int = 50
+    WORKER_LEASE_SECONDS: int = 120
+    WORKER_POLL_INTERVAL: float = 5.0
+    WORKER_MAX_ATTEMPTS: int = 5
+
+    # In-process caches for request authentication. Users are re-read from the
+    # database at most every USER_CACHE_TTL seconds (0 disables both caches).
+    USER_CACHE_TTL: float = 30.0
+    USER_CACHE_MAX_ENTRIES: int = 10000
+    TOKEN_CACHE_MAX_ENTRIES: int = 10000
+
+    # Password hashing runs on its own thread pool. Requests that would queue
+    # more than PASSWORD_HASH_MAX_PENDING hashes get a 503. Changing
+    # BCRYPT_ROUNDS rehashes each password at the user's next login.
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_PENDING: int = 64
+    BCRYPT_ROUNDS: int = 12
+    
+    # Request tracing. Phases of each request (token decoding, database round
+    # trips, DNS queries, the endpoint and response serialization) are timed
+    # as spans and summed per phase in a Server-Timing response header.
+    # TRACE_SAMPLE_RATE of requests, and every request slower than
+    # TRACE_SLOW_REQUEST_SECONDS (0 disables), are also logged with their span
+    # tree. At most TRACE_MAX_SPANS spans are kept per request.
+    TRACE_SERVER_TIMING: bool = True
+    TRACE_SAMPLE_RATE: float = 0.0
+    TRACE_SLOW_REQUEST_SECONDS: float = 2.0
+    TRACE_MAX_SPANS: int = 500
+
+    # /metrics and /dns/stats answer only requests with an
+    # "Authorization: Bearer <METRICS_TOKEN>" header, and 404 while
+    # METRICS_TOKEN is unset.
+    METRICS_TOKEN: str = ""
+
     # Application Settings
     APP_PORT: int = 8000
     APP_HOST: str = "0.0.0.0"
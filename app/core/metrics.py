@@ -0,0 +1,282 @@
+"""
+In-process metrics, rendered in the Prometheus text format at ``/metrics``.
+
+Recording is meant for hot paths: a labelled child is found with one dict
+lookup, and a histogram observation is a bisect over its bucket bounds and
+two additions. Nothing takes a lock — metrics are updated from the event loop
+thread, and a rare lost increment when another thread records at the same
+moment is an acceptable price. Values that already live elsewhere (cache hit
+counts, resolver statistics) are read by collectors only when ``/metrics``
+is scraped.
+"""
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds; from a cached DNS answer to a check that ran out its deadline
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        pairs = ",".join(f'{key}="{_escape(str(v))}"' for key, v in labels.items())
+        name = f"{name}{{{pairs}}}"
+    return f"{name} {value!r}"
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = bounds
+        # One count per bucket plus +Inf; made cumulative when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        registry.register(self)
+
+    def _new(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            child = self._children.setdefault(values, self._new())
+        return child
+
+    def _labels(self, values: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, values))
+
+    def samples(self) -> Iterable[Sample]:
+        for values, child in list(self._children.items()):
+            yield self.name, self._labels(values), child.value
+
+
+class Counter(Metric):
+    """A count that only goes up."""
+
+    type = "counter"
+
+    def _new(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(Counter):
+    """A value that goes up and down, such as work in flight."""
+
+    type = "gauge"
+
+    def dec(self, amount: float = 1) -> None:
+        self.labels().dec(amount)
+
+
+class Histogram(Metric):
+    """Observations counted into buckets by upper bound, with their sum."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def samples(self) -> Iterable[Sample]:
+        for values, child in list(self._children.items()):
+            labels = self._labels(values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                yield f"{self.name}_bucket", {**labels, "le": le}, cumulative
+            yield f"{self.name}_sum", labels, child.sum
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    """Every metric, plus collectors that produce samples at scrape time.
+
+    A collector returns ``(name, type, documentation, samples)`` tuples.
+    """
+
+    def __init__(self) -> None:
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], Iterable[Tuple[str, str, str, Iterable[Sample]]]]] = []
+
+    def register(self, metric: Metric) -> None:
+        self.metrics.append(metric)
+
+    def collector(self, fn: Callable) -> Callable:
+        self.collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        families = [
+            (metric.name, metric.type, metric.documentation, metric.samples())
+            for metric in self.metrics
+        ]
+        for collect in self.collectors:
+            families.extend(collect())
+        lines = []
+        for name, kind, documentation, samples in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(_format(*sample) for sample in samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time to serve an HTTP request, by route template and status.",
+    ["method", "route", "status"],
+)
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds",
+    "Time to get a database connection from the pool, including any wait "
+    "for one to be returned or opened.",
+)
+DB_STATEMENTS_PER_REQUEST = Histogram(
+    "db_statements_per_request",
+    "Database statements run while serving a request, by route template. "
+    "Counts growing with page size point at N+1 query patterns.",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250),
+)
+
+# Statements run so far for the request being served (a one-item list, so
+# tasks the request spawns add to the same count)
+_statements: ContextVar[Optional[List[int]]] = ContextVar("db_statements", default=None)
+
+
+def count_statement() -> None:
+    """Count a database statement towards the request running it, if any."""
+    counter = _statements.get()
+    if counter is not None:
+        counter[0] += 1
+
+# name -> callable returning the cache's (hits, misses) so far
+_caches: Dict[str, Callable[[], Tuple[int, int]]] = {}
+
+
+def register_cache(name: str, counts: Callable[[], Tuple[int, int]]) -> None:
+    """Report a cache's hits, misses and hit ratio under ``cache="name"``."""
+    _caches[name] = counts
+
+
+@registry.collector
+def _cache_families():
+    counts = {name: stats() for name, stats in _caches.items()}
+    yield "cache_hits_total", "counter", "Lookups answered from the cache.", [
+        ("cache_hits_total", {"cache": name}, hits) for name, (hits, _) in counts.items()
+    ]
+    yield "cache_misses_total", "counter", "Lookups the cache could not answer.", [
+        ("cache_misses_total", {"cache": name}, misses) for name, (_, misses) in counts.items()
+    ]
+    yield "cache_hit_ratio", "gauge", "Hits over all lookups since startup.", [
+        ("cache_hit_ratio", {"cache": name}, hits / (hits + misses) if hits + misses else 0.0)
+        for name, (hits, misses) in counts.items()
+    ]
+
+
+class MetricsMiddleware:
+    """Times every HTTP request (a plain ASGI middleware, so no extra task).
+
+    Requests are labelled with the matched route's path template, not the
+    raw path, so ``/domains/{domain_id}`` is one series however many
+    domains there are.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+        statements = [0]
+        token = _statements.set(statements)
+
+        async def send_status(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            _statements.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(
+                time.perf_counter() - started
+            )
+            DB_STATEMENTS_PER_REQUEST.labels(scope["method"], route).observe(statements[0])
+
+
+def timed_pool_class(base: type) -> type:
+    """The pool class ``base``, timing checkouts."""
+
+    class TimedPool(base):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
@@ -0,0 +1,228 @@
+"""
+Per-request span tracing.
+
+``TracingMiddleware`` opens a trace for each HTTP request and code on the
+request path marks its phases with ``span("name")``: token decoding, each
+database round trip, every upstream DNS query, the endpoint itself and,
+derived from that, response serialization. Spans nest through a context
+variable, so those started in tasks a request spawns (concurrent checks,
+prefetched queries) land under the span that spawned them. Outside a request
+``span`` does nothing.
+
+Each response gets a ``Server-Timing`` header summing the spans of each name
+(spans run concurrently, so their sums can exceed the total). A sample of
+requests, and every slow one, is also logged with its span tree.
+"""
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi.routing import APIRoute
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "end", "children", "trace")
+
+    def __init__(self, name: str, trace: "Trace", attrs: Dict[str, Any]) -> None:
+        self.name = name
+        self.attrs = attrs
+        self.trace = trace
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.children: List["Span"] = []
+
+    def as_dict(self, origin: float) -> dict:
+        tree = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            # Still running when the request finished (shared or background work)
+            "duration_ms": round((self.end - self.start) * 1000, 3) if self.end else None,
+            **self.attrs,
+        }
+        if self.children:
+            tree["children"] = [child.as_dict(origin) for child in self.children]
+        return tree
+
+
+class Trace:
+    def __init__(self) -> None:
+        self.root = Span("request", self, {})
+        self.spans = 0
+        self.dropped = 0
+        self.endpoint: Optional[Span] = None
+
+    def add(self, span: Span) -> None:
+        """Record ``span`` as already finished, directly under the root."""
+        self.root.children.append(span)
+        self.spans += 1
+
+    def server_timing(self, now: float) -> str:
+        totals: Dict[str, List[float]] = {}
+        pending = list(self.root.children)
+        while pending:
+            span = pending.pop()
+            pending.extend(span.children)
+            if span.end is not None:
+                total = totals.setdefault(span.name, [0.0, 0])
+                total[0] += span.end - span.start
+                total[1] += 1
+        entries = [f"total;dur={(now - self.root.start) * 1000:.1f}"]
+        for name, (seconds, count) in sorted(totals.items()):
+            entry = f"{name};dur={seconds * 1000:.1f}"
+            entries.append(entry if count == 1 else f'{entry};desc="x{count}"')
+        return ", ".join(entries)
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+@contextmanager
+def span(name: str, **attrs: Any):
+    """Time the block as a child of the current span. Yields the span (to
+    add attributes to) or ``None`` when not tracing."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    trace = parent.trace
+    if trace.spans >= settings.TRACE_MAX_SPANS:
+        trace.dropped += 1
+        yield None
+        return
+    current = Span(name, trace, attrs)
+    parent.children.append(current)
+    trace.spans += 1
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        current.end = time.perf_counter()
+        _current.reset(token)
+
+
+def record_span(name: str, start: float, end: float, **attrs: Any) -> None:
+    """Add a span timed elsewhere (from ``time.perf_counter``) under the
+    current span."""
+    parent = _current.get()
+    if parent is None:
+        return
+    trace = parent.trace
+    if trace.spans >= settings.TRACE_MAX_SPANS:
+        trace.dropped += 1
+        return
+    finished = Span(name, trace, attrs)
+    finished.start, finished.end = start, end
+    parent.children.append(finished)
+    trace.spans += 1
+
+
+def _traced_endpoint(endpoint: Callable) -> Callable:
+    # include_router builds its routes again, from the already wrapped endpoints
+    if getattr(endpoint, "_traced", False):
+        return endpoint
+    if iscoroutinefunction(endpoint):
+        @wraps(endpoint)
+        async def traced(*args, **kwargs):
+            with span("endpoint") as current:
+                if current is not None:
+                    current.trace.endpoint = current
+                return await endpoint(*args, **kwargs)
+    else:
+        @wraps(endpoint)
+        def traced(*args, **kwargs):
+            with span("endpoint") as current:
+                if current is not None:
+                    current.trace.endpoint = current
+                return endpoint(*args, **kwargs)
+    traced._traced = True
+    return traced
+
+
+class TracedRoute(APIRoute):
+    """An ``APIRoute`` whose endpoint runs in an ``endpoint`` span, so the
+    time from its return to the response (validating and serializing the
+    result) is reported as ``serialize``."""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs: Any) -> None:
+        super().__init__(path, _traced_endpoint(endpoint), **kwargs)
+
+
+def _enabled() -> bool:
+    return bool(
+        settings.TRACE_SERVER_TIMING
+        or settings.TRACE_SAMPLE_RATE > 0
+        or settings.TRACE_SLOW_REQUEST_SECONDS > 0
+    )
+
+
+class TracingMiddleware:
+    """Traces every HTTP request (a plain ASGI middleware, so endpoint code
+    runs in the context the trace is set in)."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not _enabled():
+            await self.app(scope, receive, send)
+            return
+        sampled = random.random() < settings.TRACE_SAMPLE_RATE
+        trace = Trace()
+        status = 500
+
+        async def send_timed(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                now = time.perf_counter()
+                endpoint = trace.endpoint
+                if endpoint is not None and endpoint.end is not None:
+                    serialize = Span("serialize", trace, {})
+                    serialize.start, serialize.end = endpoint.end, now
+                    trace.add(serialize)
+                if settings.TRACE_SERVER_TIMING:
+                    header = trace.server_timing(now).encode("latin-1")
+                    message = {
+                        **message,
+                        "headers": [*message.get("headers", []), (b"server-timing", header)],
+                    }
+            await send(message)
+
+        token = _current.set(trace.root)
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            _current.reset(token)
+            trace.root.end = time.perf_counter()
+            duration = trace.root.end - trace.root.start
+            slow = 0 < settings.TRACE_SLOW_REQUEST_SECONDS <= duration
+            if sampled or slow:
+                self._log(scope, status, trace, slow)
+
+    @staticmethod
+    def _log(scope, status: int, trace: Trace, slow: bool) -> None:
+        route = scope.get("route")
+        record = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": getattr(route, "path", None),
+            "status": status,
+            "slow": slow,
+            "spans_dropped": trace.dropped,
+            **trace.root.as_dict(trace.root.start),
+        }
+        logger.log(
+            logging.WARNING if slow else logging.INFO,
+            "request trace %s", json.dumps(record, default=str),
+            extra={"trace": record},
+        )
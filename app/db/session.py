@@ -1,12 +1,113 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+import logging
+import random
+import re
+import time
+
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
 from app.core.config import settings
+from app.core.metrics import count_statement, timed_pool_class
+from app.core.tracing import record_span
 
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    echo=True,
-    future=True
-)
+logger = logging.getLogger(__name__)
+
+# Longest statement text put in a slow query log line
+MAX_LOGGED_STATEMENT = 1000
+
+
+def engine_options(url: str) -> dict:
+    """``create_async_engine`` arguments for ``url`` from the ``DB_*`` settings."""
+    parsed = make_url(url)
+    pool_class = parsed.get_dialect().get_pool_class(parsed)
+    if pool_class is NullPool and settings.DB_POOL_SIZE > 0:
+        pool_class = AsyncAdaptedQueuePool
+    options = {
+        "echo": settings.DB_ECHO,
+        "future": True,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "poolclass": timed_pool_class(pool_class),
+    }
+    if parsed.get_backend_name() == "sqlite":
+        # Writers queue for SQLite's database lock rather than for a pooled
+        # connection; give them as long
+        options["connect_args"] = {"timeout": settings.DB_POOL_TIMEOUT}
+    if issubclass(pool_class, QueuePool):
+        options.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+        )
+    return options
+
+
+def insert_ignoring_conflicts(db: AsyncSession, model, index_elements: list):
+    """``INSERT ... ON CONFLICT DO NOTHING`` for Postgres or SQLite: rows
+    clashing on the unique ``index_elements`` are skipped, not an error."""
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(model).on_conflict_do_nothing(index_elements=index_elements)
+
+
+def _type_runs(values) -> list:
+    """Type names of ``values``, with runs collapsed (``"int*500"``)."""
+    runs = []
+    for value in values:
+        name = type(value).__name__
+        if runs and runs[-1][0] == name:
+            runs[-1][1] += 1
+        else:
+            runs.append([name, 1])
+    return [name if count == 1 else f"{name}*{count}" for name, count in runs]
+
+
+def parameter_shape(parameters, executemany: bool):
+    """Bind parameter types, never their values, for logging."""
+    if executemany:
+        rows = list(parameters)
+        return {"rows": len(rows), "row": parameter_shape(rows[0], False) if rows else None}
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    return _type_runs(parameters or ())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    count_statement()
+    started = getattr(context, "_query_started", None)
+    if started is None:
+        return
+    now = time.perf_counter()
+    record_span("sql", started, now)
+    elapsed = now - started
+    if (
+        0 < settings.DB_SLOW_QUERY_SECONDS <= elapsed
+        and random.random() < settings.DB_SLOW_QUERY_SAMPLE_RATE
+    ):
+        logger.warning(
+            "Slow query (%.1f ms): %s; parameters: %s",
+            elapsed * 1000,
+            re.sub(r"\s+", " ", statement)[:MAX_LOGGED_STATEMENT],
+            parameter_shape(parameters, executemany),
+        )
+
+
+def instrument(engine: AsyncEngine) -> None:
+    """Time ``engine``'s statements: each is counted towards the request
+    running it, added to its trace and, if slow, logged."""
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+engine = create_async_engine(settings.DATABASE_URL, **engine_options(settings.DATABASE_URL))
+instrument(engine)
 
 AsyncSessionLocal = sessionmaker(
     engine,
@@ -20,4 +121,4 @@ async def get_db() -> AsyncSession:
         try:
             yield session
         finally:
-            await session.close() 
\ No newline at end of file
+            await session.close()
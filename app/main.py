@@ -1,9 +1,17 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from app.api.deps import verify_metrics_token
 from app.api.v1.endpoints import auth, domains
 from app.core.config import settings
+from app.core.metrics import MetricsMiddleware, registry
+from app.core.tracing import TracingMiddleware
 from app.db.session import engine
 from app.models.user import Base
+from app.models import check_history, check_job  # noqa: F401  (register tables)
+from app.services.dns_cache import answer_cache
+from app.services.dns_checker import DNSChecker
+from app.services.scheduler import scheduler
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -21,6 +29,9 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_headers=["*"],
     )
 
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+
 # Include routers
 app.include_router(auth.router, prefix=f"{settings.API_V1_STR}/auth", tags=["auth"])
 app.include_router(
@@ -34,6 +45,14 @@ app.include_router(
 async def startup():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    if settings.RECHECK_ENABLED:
+        scheduler.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await scheduler.stop()
+    DNSChecker.resolver.close()
 
 
 if __name__ == "__main__":
@@ -48,4 +67,25 @@ if __name__ == "__main__":
 
 @app.get("/")
 async def root():
-    return {"message": "Welcome to Email Security Dashboard API"} 
\ No newline at end of file
+    return {"message": "Welcome to Email Security Dashboard API"}
+
+
+@app.get("/dns/stats", dependencies=[Depends(verify_metrics_token)])
+async def dns_stats():
+    """Per-nameserver latency, hedging and health, and answer cache stats."""
+    return {
+        "nameservers": DNSChecker.resolver.stats(),
+        "cache": answer_cache.stats() if settings.DNS_CACHE_ENABLED else None
+    }
+
+
+@app.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    include_in_schema=False,
+    dependencies=[Depends(verify_metrics_token)],
+)
+async def metrics():
+    """Prometheus metrics: DNS lookup, check, request and DB pool latency
+    histograms, cache hit ratios and checks in flight."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,34 @@
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Index
+from datetime import datetime
+from app.models.user import Base
+
+class DomainCheckHistory(Base):
+    """One row per distinct check outcome of a domain.
+
+    A new row is written only when the outcome's fingerprint changes, and
+    rows are never updated, so re-checks that see the same outcome don't write
+    to this table at all. When an outcome was last seen isn't stored: for the
+    latest row it is the domain's ``last_checked_at``, for a superseded row the
+    ``first_seen`` of the row that replaced it.
+    """
+    __tablename__ = "domain_check_history"
+    __table_args__ = (
+        Index("ix_domain_check_history_domain_id_id", "domain_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    domain_id = Column(Integer, ForeignKey("domains.id"), nullable=False)
+    result_hash = Column(String(64), nullable=False)
+    first_seen = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    dmarc_record = Column(String, nullable=True)
+    dmarc_status = Column(Boolean, nullable=True)
+    spf_record = Column(String, nullable=True)
+    spf_status = Column(Boolean, nullable=True)
+    dkim_record = Column(String, nullable=True)
+    dkim_status = Column(Boolean, nullable=True)
+    dkim_selectors = Column(String, nullable=True)  # Stored as JSON string
+    mx_records = Column(String, nullable=True)  # Stored as JSON string
+    mx_status = Column(Boolean, nullable=True)
+    overall_status = Column(Boolean, nullable=True)
+    check_summary = Column(String, nullable=True)  # Stored as JSON string
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from datetime import datetime
+from app.models.user import Base
+
+class CheckJob(Base):
+    """A pending re-check of one domain, claimed by workers under a lease."""
+    __tablename__ = "check_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    domain_id = Column(Integer, ForeignKey("domains.id"), unique=True, nullable=False)
+    run_at = Column(DateTime, default=datetime.utcnow, index=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Lease held by the worker currently running the check
+    locked_by = Column(String, nullable=True)
+    locked_until = Column(DateTime, nullable=True)
+
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(String, nullable=True)
@@ -1,17 +1,29 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
+import hashlib
 import json
+from typing import Optional
 from app.models.user import Base
 
 class Domain(Base):
     __tablename__ = "domains"
+    # GET /domains pages in id order, unfiltered or by overall status; other
+    # sorts and filters scan the user's rows instead
+    __table_args__ = (
+        Index("ix_domains_user_id_id", "user_id", "id"),
+        Index("ix_domains_user_id_overall_status_id", "user_id", "overall_status", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     domain_name = Column(String, unique=True, index=True, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Moves only when check results change (see check_result_values)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    last_checked_at = Column(DateTime, nullable=True)
+    # When the background scheduler should re-check this domain
+    next_check_at = Column(DateTime, nullable=True, index=True)
 
     # Email security check results
     dmarc_record = Column(String, nullable=True)
@@ -20,8 +32,12 @@ class Domain(Base):
     spf_status = Column(Boolean, nullable=True)
     dkim_record = Column(String, nullable=True)
     dkim_status = Column(Boolean, nullable=True)
+    dkim_selectors = Column(String, nullable=True)  # Stored as JSON string
     mx_records = Column(String, nullable=True)  # Stored as JSON string
     mx_status = Column(Boolean, nullable=True)
+    overall_status = Column(Boolean, nullable=True)
+    # Fingerprint of the stored results (see result_fingerprint)
+    result_hash = Column(String(64), nullable=True)
 
     # Relationship
     user = relationship("User", back_populates="domains")
@@ -33,6 +49,75 @@ class Domain(Base):
         else:
             self.mx_records = None
 
+    @staticmethod
+    def result_columns(check_result: dict) -> dict:
+        """Map a DNSChecker.check_all result onto result column values."""
+        mx_records = check_result["mx_records"]
+        dkim_selectors = check_result.get("dkim_selectors")
+        return {
+            "dmarc_record": check_result["dmarc_record"],
+            "dmarc_status": check_result["dmarc_status"],
+            "spf_record": check_result["spf_record"],
+            "spf_status": check_result["spf_status"],
+            "dkim_record": check_result["dkim_record"],
+            "dkim_status": check_result["dkim_status"],
+            "dkim_selectors": json.dumps(dkim_selectors) if dkim_selectors else None,
+            "mx_records": json.dumps(mx_records) if mx_records is not None else None,
+            "mx_status": check_result["mx_status"],
+            "overall_status": check_result["overall_status"],
+        }
+
+    @staticmethod
+    def result_fingerprint(check_result: dict) -> str:
+        """Hash of the DMARC/SPF/DKIM/MX outcome of a check.
+
+        Timestamps, TTLs and messages are left out and MX hosts are sorted, so
+        two checks that saw the same records hash the same.
+        """
+        summary = check_result.get("check_summary") or {}
+        outcome = {
+            **Domain.result_columns(check_result),
+            "mx_records": sorted(check_result["mx_records"] or []),
+            "checks": {name: info.get("status") for name, info in summary.items()},
+        }
+        encoded = json.dumps(outcome, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    @staticmethod
+    def check_result_values(
+        check_result: dict,
+        previous_hash: Optional[str] = None,
+    ) -> dict:
+        """Column values to write for a check result.
+
+        If the result has the same fingerprint as ``previous_hash`` only
+        ``last_checked_at`` is written; the result columns, ``result_hash`` and
+        ``updated_at`` are written only when the outcome changed.
+        """
+        now = datetime.utcnow()
+        result_hash = Domain.result_fingerprint(check_result)
+        if result_hash == previous_hash:
+            return {"last_checked_at": now}
+        return {
+            **Domain.result_columns(check_result),
+            "result_hash": result_hash,
+            "updated_at": now,
+            "last_checked_at": now,
+        }
+
+    def apply_check_result(self, check_result: dict) -> bool:
+        """Store a check result; returns whether the outcome changed."""
+        values = self.check_result_values(check_result, self.result_hash)
+        for column, value in values.items():
+            setattr(self, column, value)
+        return "result_hash" in values
+
+    def get_dkim_selectors(self) -> list:
+        """DKIM selectors found on earlier checks."""
+        if self.dkim_selectors:
+            return json.loads(self.dkim_selectors)
+        return []
+
     def get_mx_records(self) -> list:
         """Get MX records as a list."""
         if self.mx_records:
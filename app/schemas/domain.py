@@ -3,16 +3,20 @@ from typing import Optional, List
 from pydantic import BaseModel, HttpUrl, validator
 
 
+def normalize_domain_name(v: str) -> str:
+    if not v or len(v) < 3:
+        raise ValueError('Domain name must be at least 3 characters long')
+    if ' ' in v:
+        raise ValueError('Domain name cannot contain spaces')
+    return v.lower()
+
+
 class DomainBase(BaseModel):
     domain_name: str
 
     @validator('domain_name')
     def validate_domain_name(cls, v):
-        if not v or len(v) < 3:
-            raise ValueError('Domain name must be at least 3 characters long')
-        if ' ' in v:
-            raise ValueError('Domain name cannot contain spaces')
-        return v.lower()
+        return normalize_domain_name(v)
 
 
 class DomainCreate(DomainBase):
@@ -23,6 +27,10 @@ class DomainUpdate(DomainBase):
     pass
 
 
+class DomainBulkCreate(BaseModel):
+    domain_names: List[str]
+
+
 class DomainInDBBase(DomainBase):
     id: int
     user_id: int
@@ -34,8 +42,12 @@ class DomainInDBBase(DomainBase):
     spf_status: Optional[bool] = None
     dkim_record: Optional[str] = None
     dkim_status: Optional[bool] = None
+    dkim_selectors: Optional[str] = None
     mx_records: Optional[str] = None
     mx_status: Optional[bool] = None
+    overall_status: Optional[bool] = None
+    last_checked_at: Optional[datetime] = None
+    next_check_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -45,6 +57,32 @@ class Domain(DomainInDBBase):
     pass
 
 
+class DomainCheckHistory(BaseModel):
+    id: int
+    domain_id: int
+    first_seen: datetime
+    last_seen: Optional[datetime] = None
+    dmarc_record: Optional[str] = None
+    dmarc_status: Optional[bool] = None
+    spf_record: Optional[str] = None
+    spf_status: Optional[bool] = None
+    dkim_record: Optional[str] = None
+    dkim_status: Optional[bool] = None
+    dkim_selectors: Optional[str] = None
+    mx_records: Optional[str] = None
+    mx_status: Optional[bool] = None
+    overall_status: Optional[bool] = None
+    check_summary: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+class DomainCheckHistoryPage(BaseModel):
+    items: List[DomainCheckHistory]
+    next_cursor: Optional[int] = None
+
+
 class DomainCheckResult(BaseModel):
     domain_name: str
     check_timestamp: datetime
@@ -54,6 +92,7 @@ class DomainCheckResult(BaseModel):
     spf_status: Optional[bool] = None
     dkim_record: Optional[str] = None
     dkim_status: Optional[bool] = None
+    dkim_selectors: Optional[List[str]] = None
     mx_records: Optional[List[str]] = None
     mx_status: Optional[bool] = None
     overall_status: bool
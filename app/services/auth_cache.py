@@ -0,0 +1,94 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from sqlalchemy import event
+
+from app.core.config import settings
+from app.core.metrics import register_cache
+from app.models.user import User
+
+
+class TTLCache:
+    """Size-bounded LRU mapping whose entries expire at a given time.
+
+    Only used from the event loop thread, so there is no locking.
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self.data.get(key)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                del self.data[key]
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any, expires_at: float) -> None:
+        if self.max_entries <= 0:
+            return
+        self.data[key] = (expires_at, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.max_entries:
+            self.data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self.data.pop(key, None)
+
+    def clear(self) -> None:
+        self.data.clear()
+
+
+class UserCache:
+    """Active users by id, for ``get_current_user``.
+
+    Entries hold column values rather than ORM instances, so each request gets
+    its own detached ``User`` and nothing is shared between sessions. Updating
+    or deleting a user through the ORM in this process evicts it; other
+    processes see the change within ``USER_CACHE_TTL`` seconds. Bulk
+    ``update(User)`` statements bypass the ORM events, so callers issuing them
+    should call ``invalidate`` themselves.
+    """
+
+    columns = [column.key for column in User.__table__.columns]
+
+    def __init__(self, ttl: float, max_entries: int) -> None:
+        self.ttl = ttl
+        self.entries = TTLCache(max_entries if ttl > 0 else 0)
+
+    def get(self, user_id: int) -> Optional[User]:
+        values: Optional[Dict[str, Any]] = self.entries.get(user_id)
+        return User(**values) if values is not None else None
+
+    def put(self, user: User) -> None:
+        if user.is_active:
+            values = {column: getattr(user, column) for column in self.columns}
+            self.entries.put(user.id, values, time.time() + self.ttl)
+
+    def invalidate(self, user_id: int) -> None:
+        self.entries.pop(user_id)
+
+
+user_cache = UserCache(settings.USER_CACHE_TTL, settings.USER_CACHE_MAX_ENTRIES)
+
+# Verified JWTs: token -> user id, until the token's own expiry
+token_cache = TTLCache(
+    settings.TOKEN_CACHE_MAX_ENTRIES if settings.USER_CACHE_TTL > 0 else 0
+)
+
+register_cache("user", lambda: (user_cache.entries.hits, user_cache.entries.misses))
+register_cache("token", lambda: (token_cache.hits, token_cache.misses))
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _evict_user(mapper, connection, target: User) -> None:
+    user_cache.invalidate(target.id)
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import AsyncIterator, Iterable, List, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal, insert_ignoring_conflicts
+from app.models.domain import Domain
+from app.schemas.domain import normalize_domain_name
+from app.services.check_engine import CheckRequest
+from app.services.dns_checker import DNSChecker
+from app.services.scheduler import store_results
+
+logger = logging.getLogger(__name__)
+
+def _line(payload: dict) -> str:
+    return json.dumps(jsonable_encoder(payload)) + "\n"
+
+
+def parse_domain_names(raw_names: Iterable[str]) -> Tuple[List[str], List[dict]]:
+    """Normalize and deduplicate names, preserving their first-seen order.
+
+    Returns the valid names and an error entry for each rejected one.
+    """
+    names: dict = {}
+    invalid = []
+    for raw in raw_names:
+        raw = raw.strip()
+        if not raw or raw.startswith("#"):
+            continue
+        try:
+            names.setdefault(normalize_domain_name(raw), None)
+        except ValueError as e:
+            invalid.append({"domain_name": raw, "status": "invalid", "detail": str(e)})
+    return list(names), invalid
+
+
+CSV_HEADERS = {"domain", "domain_name", "domains"}
+
+
+def parse_domain_file(content: bytes) -> List[str]:
+    """One domain per line; CSV rows contribute their first column."""
+    text = content.decode("utf-8-sig", errors="replace")
+    names = [line.split(",", 1)[0].strip().strip('"') for line in text.splitlines()]
+    if names and names[0].lower() in CSV_HEADERS:
+        names = names[1:]
+    return names
+
+
+async def insert_new_domains(
+    db: AsyncSession,
+    user_id: int,
+    names: List[str],
+) -> Tuple[List[Tuple[int, str]], List[str]]:
+    """Insert the names not yet registered, in batches.
+
+    Existing names are found with one set-based query, and names registered
+    concurrently since are skipped by the insert itself; returns the
+    ``(id, domain_name)`` pairs created and the names that already existed.
+    New domains are due for a check straight away, so any whose check in the
+    request doesn't complete are checked by the scheduler or the workers.
+    """
+    result = await db.execute(
+        select(Domain.domain_name).where(Domain.domain_name.in_(names))
+    )
+    existing = set(result.scalars().all())
+    new_names = [name for name in names if name not in existing]
+
+    created: List[Tuple[int, str]] = []
+    batch_size = settings.BULK_INSERT_BATCH_SIZE
+    for start in range(0, len(new_names), batch_size):
+        batch = new_names[start:start + batch_size]
+        inserted = await _insert_batch(db, user_id, batch)
+        await db.commit()
+        created.extend(inserted)
+        # Lost races with concurrent inserts
+        existing.update(set(batch) - {name for _, name in inserted})
+
+    return created, [name for name in names if name in existing]
+
+
+async def _insert_batch(
+    db: AsyncSession, user_id: int, names: List[str]
+) -> List[Tuple[int, str]]:
+    now = datetime.utcnow()
+    result = await db.execute(
+        insert_ignoring_conflicts(db, Domain, ["domain_name"]).returning(
+            Domain.id, Domain.domain_name
+        ),
+        [
+            {"domain_name": name, "user_id": user_id, "next_check_at": now}
+            for name in names
+        ],
+    )
+    return [tuple(row) for row in result.all()]
+
+
+async def _write_results(results: List[Tuple[int, dict]]) -> None:
+    async with AsyncSessionLocal() as db:
+        await store_results(db, results)
+        await db.commit()
+
+
+async def check_and_stream(
+    created: List[Tuple[int, str]],
+    preamble: List[dict],
+) -> AsyncIterator[str]:
+    """Check the created domains and yield one NDJSON line per domain.
+
+    Lines for names that were skipped (``preamble``) come first; checked
+    domains follow in completion order, with an ``"error"`` line for each
+    check that failed. At most ``BULK_CHECK_CONCURRENCY`` checks run at once
+    and results are written back in batches; if the client goes away, the
+    results of checks already run are still written.
+    """
+    for entry in preamble:
+        yield _line(entry)
+
+    checks = DNSChecker.check_many(
+        [CheckRequest(domain_name, discover_dkim=True) for _, domain_name in created],
+        settings.BULK_CHECK_CONCURRENCY,
+    )
+    pending_writes: List[Tuple[int, dict]] = []
+    try:
+        async for index, check_result, error in checks:
+            domain_id, domain_name = created[index]
+            if error is not None:
+                logger.error("Check of %s failed", domain_name, exc_info=error)
+                yield _line({
+                    "id": domain_id,
+                    "domain_name": domain_name,
+                    "status": "error",
+                    "detail": str(error),
+                })
+                continue
+            pending_writes.append((domain_id, check_result))
+            if len(pending_writes) >= settings.BULK_WRITE_BATCH_SIZE:
+                await _write_results(pending_writes)
+                pending_writes = []
+            yield _line({"id": domain_id, "status": "created", **check_result})
+    finally:
+        await checks.aclose()
+        if pending_writes:
+            # Shielded: a disconnect cancels the stream, not the write
+            await asyncio.shield(_write_results(pending_writes))
@@ -0,0 +1,212 @@
+"""
+Check engine.
+
+Each kind of DNS check is a ``Check`` plugin registered with ``register``:
+it declares the records it is sure to need (``queries``), parses them into a
+``(record, status, info)`` outcome (``run``) and says which result fields
+the outcome fills. The engine owns everything else: it runs every registered
+check for a domain concurrently against one ``QueryPlan``, gives each its own
+timeout under an overall deadline, reports failures as ``"error"`` outcomes
+and assembles the result. ``check_many`` runs a batch of domains under a
+concurrency limit. A new check only has to register to get all of it, along
+with the shared answer cache.
+"""
+import abc
+import asyncio
+import time
+from datetime import datetime
+from typing import (
+    Any, AsyncIterator, Dict, List, NamedTuple, Optional, Sequence, Tuple, Type,
+)
+
+from app.core.config import settings
+from app.core.metrics import Gauge, Histogram
+from app.core.tracing import span
+from app.services.dns_resolver import AsyncResolver, resolver as default_resolver
+from app.services.query_plan import Query, QueryPlan
+
+Outcome = Tuple[Any, bool, Dict]
+
+CHECK_SECONDS = Histogram(
+    "dns_check_duration_seconds",
+    "Time to run one check of a domain, by check and outcome status.",
+    ["check", "status"],
+)
+CHECKS_IN_FLIGHT = Gauge("dns_checks_in_flight", "Domain checks currently running.")
+
+
+class CheckRequest(NamedTuple):
+    domain: str
+    # DKIM selector to look up instead of discovering keys
+    selector: Optional[str] = None
+    # DKIM selectors found on an earlier check, probed first
+    dkim_selectors: Sequence[str] = ()
+    # Sweep DKIM_SELECTORS even if no selectors are known yet (otherwise only
+    # "default" is probed); for first checks and when asked for
+    discover_dkim: bool = False
+
+
+class Check(abc.ABC):
+    """Base class of check plugins.
+
+    ``name`` keys the check's info in ``check_summary`` and its timeout;
+    ``label`` is used in messages. The outcome's record and status are stored
+    under ``record_field`` and ``status_field``, and the status counts towards
+    ``overall_status`` when ``required``.
+    """
+    name: str = ""
+    label: str = ""
+    record_field: Optional[str] = None
+    status_field: Optional[str] = None
+    required: bool = True
+
+    def queries(self, request: CheckRequest) -> List[Query]:
+        """Records the check is sure to look up, fetched before it runs."""
+        return []
+
+    @abc.abstractmethod
+    async def run(self, request: CheckRequest, resolver: AsyncResolver) -> Outcome:
+        """Look up and parse the check's records."""
+
+    def result_fields(self, request: CheckRequest, outcome: Outcome) -> Dict[str, Any]:
+        record, status, _ = outcome
+        fields = {}
+        if self.record_field:
+            fields[self.record_field] = record
+        if self.status_field:
+            fields[self.status_field] = status
+        return fields
+
+
+checks: Dict[str, Check] = {}
+
+
+def register(check_class: Type[Check]) -> Type[Check]:
+    """Class decorator adding a check to the registry, replacing any check of
+    the same name."""
+    checks[check_class.name] = check_class()
+    return check_class
+
+
+class CheckEngine:
+    def __init__(self, registry: Optional[Dict[str, Check]] = None) -> None:
+        self.checks = checks if registry is None else registry
+
+    async def run_check(
+        self,
+        check: Check,
+        request: CheckRequest,
+        resolver: Any,
+        timeout: float,
+    ) -> Outcome:
+        """Run one check, turning a timeout or an exception into its outcome."""
+        started = time.perf_counter()
+        try:
+            with span(f"check.{check.name}"):
+                outcome = await asyncio.wait_for(check.run(request, resolver), timeout)
+        except asyncio.TimeoutError:
+            outcome = None, False, {
+                "status": "timeout",
+                "message": f"{check.label} check timed out after {timeout:g}s"
+            }
+        except Exception as e:
+            outcome = None, False, {
+                "status": "error",
+                "message": f"Error checking {check.label}: {str(e)}"
+            }
+        CHECK_SECONDS.labels(check.name, outcome[2].get("status", "unknown")).observe(
+            time.perf_counter() - started
+        )
+        return outcome
+
+    async def check(
+        self,
+        request: CheckRequest,
+        resolver: Optional[AsyncResolver] = None,
+        timeouts: Optional[Dict[str, float]] = None,
+        deadline: Optional[float] = None,
+    ) -> dict:
+        """Run every registered check for one domain.
+
+        Each check gets its own budget (``timeouts`` keyed by check name,
+        defaulting to ``DNS_CHECK_TIMEOUT``) and no check may outlive the
+        overall ``deadline``. The checks share one ``QueryPlan``: the records
+        they declare are fetched up front, concurrently, and no record is
+        queried twice within the check. Queries still outstanding when the
+        check returns are cancelled.
+        """
+        timeouts = timeouts or {}
+        if deadline is None:
+            deadline = settings.DNS_CHECK_DEADLINE
+        plan = QueryPlan(resolver or default_resolver)
+        selected = list(self.checks.values())
+        CHECKS_IN_FLIGHT.inc()
+        try:
+            for check in selected:
+                plan.prefetch(check.queries(request))
+            outcomes = await asyncio.gather(*(
+                self.run_check(
+                    check,
+                    request,
+                    plan,
+                    min(timeouts.get(check.name, settings.DNS_CHECK_TIMEOUT), deadline),
+                )
+                for check in selected
+            ))
+        finally:
+            CHECKS_IN_FLIGHT.dec()
+            # Prefetches no check got to, or abandoned at a timeout
+            plan.close()
+
+        result = {
+            "domain_name": request.domain,
+            "check_timestamp": datetime.utcnow(),
+        }
+        for check, outcome in zip(selected, outcomes):
+            result.update(check.result_fields(request, outcome))
+        ttls = [info["ttl"] for _, _, info in outcomes if "ttl" in info]
+        result.update({
+            "overall_status": all(
+                status for check, (_, status, _) in zip(selected, outcomes)
+                if check.required
+            ),
+            "check_summary": {
+                check.name: info for check, (_, _, info) in zip(selected, outcomes)
+            },
+            "min_ttl": min(ttls, default=None),
+        })
+        return result
+
+    async def check_many(
+        self,
+        requests: Sequence[CheckRequest],
+        concurrency: int,
+        resolver: Optional[AsyncResolver] = None,
+        **options: Any,
+    ) -> AsyncIterator[Tuple[int, Optional[dict], Optional[Exception]]]:
+        """Check a batch of domains, at most ``concurrency`` at a time.
+
+        Yields ``(index, result, error)`` as each check finishes, where
+        ``index`` is the request's position and ``error`` the exception that
+        failed it, if any. Checks still running when the caller stops
+        iterating are cancelled.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(index: int, request: CheckRequest):
+            async with semaphore:
+                try:
+                    return index, await self.check(request, resolver, **options), None
+                except Exception as e:
+                    return index, None, e
+
+        tasks = [
+            asyncio.ensure_future(one(index, request))
+            for index, request in enumerate(requests)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,46 @@
+import json
+from datetime import datetime
+from typing import List, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.check_history import DomainCheckHistory
+from app.models.domain import Domain
+
+
+def _history_values(check_result: dict) -> dict:
+    summary = check_result.get("check_summary") or {}
+    return {
+        **Domain.result_columns(check_result),
+        "check_summary": json.dumps(
+            {name: info.get("status") for name, info in summary.items()}
+        ),
+    }
+
+
+async def record_history(
+    db: AsyncSession,
+    results: List[Tuple[int, dict]],
+) -> int:
+    """Append a history row for each ``(domain_id, check_result)`` given.
+
+    Callers pass only results whose outcome fingerprint differs from the
+    domain's stored ``result_hash``, so re-checks that see the same outcome
+    write nothing here. Rows are only ever inserted; when an outcome was last
+    seen is worked out when the history is read (see ``DomainCheckHistory``).
+    Runs in the caller's transaction. Returns the number of rows inserted.
+    """
+    if not results:
+        return 0
+    now = datetime.utcnow()
+    await db.execute(insert(DomainCheckHistory), [
+        {
+            "domain_id": domain_id,
+            "result_hash": Domain.result_fingerprint(check_result),
+            "first_seen": now,
+            **_history_values(check_result),
+        }
+        for domain_id, check_result in results
+    ])
+    return len(results)
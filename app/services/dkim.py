@@ -0,0 +1,148 @@
+"""
+DKIM selector discovery.
+
+DKIM keys live at ``<selector>._domainkey.<domain>`` and there is no way to
+list a domain's selectors, so they are found by probing the common ones
+(``DKIM_SELECTORS``) concurrently. Selectors found on an earlier check are
+probed first; only if none of them still holds a key is the full list swept.
+"""
+import asyncio
+import base64
+import binascii
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import dns.resolver
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from cryptography.hazmat.primitives.serialization import load_der_public_key
+
+from app.services.dns_resolver import AsyncResolver, answer_ttl
+
+
+class DKIMKey(NamedTuple):
+    selector: str
+    record: str
+    key_type: str
+    key_bits: Optional[int]
+    ttl: int
+
+
+class DKIMDiscovery(NamedTuple):
+    keys: List[DKIMKey]
+    probed: int
+    # Selectors whose lookup failed or was cancelled, rather than found empty
+    unresolved: List[str]
+
+
+def parse_tags(text: str) -> Dict[str, str]:
+    tags = {}
+    for part in text.split(";"):
+        name, sep, value = part.partition("=")
+        if sep:
+            tags[name.strip().lower()] = "".join(value.split())
+    return tags
+
+
+def key_info(tags: Dict[str, str]) -> Optional[Tuple[str, Optional[int]]]:
+    """``(key_type, key_bits)`` of a DKIM key record, or None if it has no
+    usable key (revoked, malformed or not a DKIM record)."""
+    if tags.get("v", "DKIM1") != "DKIM1" or not tags.get("p"):
+        return None
+    key_type = tags.get("k", "rsa").lower()
+    try:
+        der = base64.b64decode(tags["p"], validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if key_type == "ed25519":
+        return (key_type, 256) if len(der) == 32 else None
+    try:
+        key = load_der_public_key(der)
+    except ValueError:
+        return None
+    if isinstance(key, rsa.RSAPublicKey):
+        return "rsa", key.key_size
+    if isinstance(key, ed25519.Ed25519PublicKey):
+        return "ed25519", 256
+    return key_type, None
+
+
+async def probe(resolver: AsyncResolver, domain: str, selector: str) -> Optional[DKIMKey]:
+    """The key published under ``selector``, or None if there is none.
+
+    DNS failures other than NXDOMAIN/NoAnswer propagate.
+    """
+    try:
+        answers = await resolver.resolve(f"{selector}._domainkey.{domain}", "TXT")
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        return None
+    ttl = answer_ttl(answers)
+    for rdata in answers:
+        info = key_info(parse_tags(b"".join(rdata.strings).decode("utf-8", "replace")))
+        if info is not None:
+            return DKIMKey(selector, str(rdata), info[0], info[1], ttl)
+    return None
+
+
+async def _sweep(
+    resolver: AsyncResolver,
+    domain: str,
+    selectors: Sequence[str],
+    timeout: float,
+    concurrency: int,
+) -> DKIMDiscovery:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(selector: str) -> Optional[DKIMKey]:
+        async with semaphore:
+            return await probe(resolver, domain, selector)
+
+    tasks = {asyncio.ensure_future(limited(selector)): selector for selector in selectors}
+    if not tasks:
+        return DKIMDiscovery([], 0, [])
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+    finally:
+        # Selectors still unanswered when the budget runs out are given up on
+        for task in tasks:
+            task.cancel()
+
+    found = {}
+    unresolved = [tasks[task] for task in pending]
+    for task in done:
+        if task.exception() is not None:
+            unresolved.append(tasks[task])
+        elif task.result() is not None:
+            found[tasks[task]] = task.result()
+    keys = [found[selector] for selector in selectors if selector in found]
+    return DKIMDiscovery(keys, len(tasks), unresolved)
+
+
+async def discover(
+    resolver: AsyncResolver,
+    domain: str,
+    selectors: Sequence[str],
+    known: Sequence[str] = (),
+    timeout: float = 3.0,
+    concurrency: int = 8,
+) -> DKIMDiscovery:
+    """Find the DKIM keys of ``domain``.
+
+    The ``known`` selectors are probed first; if any of them still has a key
+    the sweep of ``selectors`` is skipped. Probes are concurrent and any still
+    pending after ``timeout`` seconds are cancelled, so a slow or unresponsive
+    selector doesn't hold up the ones already found. At most ``concurrency``
+    probes are in flight at once, so that checking many domains together
+    doesn't flood the resolver with one burst of queries per selector.
+    """
+    deadline = time.monotonic() + timeout
+    known = list(dict.fromkeys(known))
+    first = await _sweep(resolver, domain, known, timeout, concurrency)
+    if first.keys:
+        return first
+    rest = [selector for selector in dict.fromkeys(selectors) if selector not in known]
+    second = await _sweep(
+        resolver, domain, rest, max(0.0, deadline - time.monotonic()), concurrency
+    )
+    return DKIMDiscovery(
+        second.keys, first.probed + second.probed, first.unresolved + second.unresolved
+    )
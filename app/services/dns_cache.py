@@ -0,0 +1,141 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import dns.rdatatype
+import dns.resolver
+from dns.resolver import Answer, CacheKey
+
+from app.core.config import settings
+from app.core.metrics import register_cache
+
+
+class DNSAnswerCache(dns.resolver.CacheBase):
+    """Thread-safe LRU answer cache shared by every resolver in the process.
+
+    Plugs into dnspython's resolver cache interface, so answers expire with
+    the TTL of the records they carry. NXDOMAIN and NoAnswer responses are
+    cached by dnspython using the SOA minimum from the authority section.
+    Entries are evicted least-recently-used first once either ``max_entries``
+    or the approximate ``max_bytes`` footprint is exceeded.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 50_000,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_ttl: int = 86_400,
+        negative_max_ttl: int = 900,
+    ) -> None:
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+        self.negative_max_ttl = negative_max_ttl
+        self.data: "OrderedDict[CacheKey, Tuple[Answer, int]]" = OrderedDict()
+        self.size_bytes = 0
+        self.evictions = 0
+        self.negative_hits = 0
+
+    @staticmethod
+    def _is_negative(key: CacheKey, answer: Answer) -> bool:
+        return key[1] == dns.rdatatype.ANY or answer.rrset is None
+
+    @staticmethod
+    def _answer_size(answer: Answer) -> int:
+        try:
+            return len(answer.response.to_wire()) + 200
+        except Exception:
+            return 712
+
+    def _remove(self, key: CacheKey) -> None:
+        _, size = self.data.pop(key)
+        self.size_bytes -= size
+
+    def _miss(self, key: CacheKey) -> None:
+        # dnspython probes the exact key and then the NXDOMAIN (ANY) key for
+        # every lookup, so a lookup is only a miss once the ANY probe fails.
+        if key[1] == dns.rdatatype.ANY:
+            self.statistics.misses += 1
+
+    def get(self, key: CacheKey) -> Optional[Answer]:
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                self._miss(key)
+                return None
+            answer = entry[0]
+            if answer.expiration <= time.time():
+                self._remove(key)
+                self._miss(key)
+                return None
+            self.data.move_to_end(key)
+            self.statistics.hits += 1
+            if self._is_negative(key, answer):
+                self.negative_hits += 1
+            return answer
+
+    def put(self, key: CacheKey, value: Answer) -> None:
+        if self._is_negative(key, value):
+            ttl_cap = self.negative_max_ttl
+        else:
+            ttl_cap = self.max_ttl
+        value.expiration = min(value.expiration, time.time() + ttl_cap)
+        size = self._answer_size(value)
+        with self.lock:
+            if key in self.data:
+                self._remove(key)
+            self.data[key] = (value, size)
+            self.size_bytes += size
+            while self.data and (
+                len(self.data) > self.max_entries or self.size_bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self.data)))
+                self.evictions += 1
+
+    def flush(self, key: Optional[CacheKey] = None) -> None:
+        with self.lock:
+            if key is not None:
+                if key in self.data:
+                    self._remove(key)
+            else:
+                self.data.clear()
+                self.size_bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            hits = self.statistics.hits
+            misses = self.statistics.misses
+            return {
+                "hits": hits,
+                "misses": misses,
+                "negative_hits": self.negative_hits,
+                "evictions": self.evictions,
+                "entries": len(self.data),
+                "size_bytes": self.size_bytes,
+                "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+            }
+
+    def reset_statistics(self) -> None:
+        with self.lock:
+            self.statistics.reset()
+            self.evictions = 0
+            self.negative_hits = 0
+
+
+answer_cache = DNSAnswerCache(
+    max_entries=settings.DNS_CACHE_MAX_ENTRIES,
+    max_bytes=settings.DNS_CACHE_MAX_BYTES,
+    max_ttl=settings.DNS_CACHE_MAX_TTL,
+    negative_max_ttl=settings.DNS_CACHE_NEGATIVE_MAX_TTL,
+)
+
+register_cache(
+    "dns_answer",
+    lambda: (answer_cache.statistics.hits, answer_cache.statistics.misses),
+)
+
+
+def get_answer_cache() -> Optional[DNSAnswerCache]:
+    """The shared cache, or ``None`` when ``DNS_CACHE_ENABLED`` is off."""
+    return answer_cache if settings.DNS_CACHE_ENABLED else None
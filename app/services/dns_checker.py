@@ -1,23 +1,46 @@
 import dns.resolver
-from typing import Optional, List, Tuple, Dict
-from datetime import datetime
+from typing import AsyncIterator, Optional, List, Sequence, Tuple, Dict
+
+from app.core.config import settings
+from app.services.check_engine import Check, CheckEngine, CheckRequest, checks, register
+from app.services.dkim import discover
+from app.services.dns_resolver import AsyncResolver, answer_ttl, resolver as default_resolver
+from app.services.mx import check_hosts, mx_hosts
+from app.services.spf import spf_evaluator
+
+# Probed on re-checks of domains with no known DKIM selectors
+DEFAULT_DKIM_SELECTOR = "default"
 
 
 class DNSChecker:
+    """The built-in checks and the entry point for running them.
+
+    The ``check_*`` methods parse one kind of record into a ``(record,
+    status, info)`` outcome; they are registered below as check plugins and
+    run by a ``CheckEngine``, which also handles their timeouts and
+    unexpected errors.
+    """
+    resolver: AsyncResolver = default_resolver
+    engine: CheckEngine
+
     @staticmethod
-    async def check_dmarc(domain: str) -> Tuple[Optional[str], bool, Dict]:
+    async def check_dmarc(
+        domain: str, resolver: Optional[AsyncResolver] = None
+    ) -> Tuple[Optional[str], bool, Dict]:
         try:
             dmarc_domain = f"_dmarc.{domain}"
-            answers = dns.resolver.resolve(dmarc_domain, "TXT")
+            answers = await (resolver or DNSChecker.resolver).resolve(dmarc_domain, "TXT")
             for rdata in answers:
                 if "v=DMARC1" in str(rdata):
                     return str(rdata), True, {
                         "status": "valid",
-                        "message": "DMARC record found"
+                        "message": "DMARC record found",
+                        "ttl": answer_ttl(answers)
                     }
             return None, False, {
                 "status": "invalid",
-                "message": "DMARC record not found or invalid"
+                "message": "DMARC record not found or invalid",
+                "ttl": answer_ttl(answers)
             }
         except dns.resolver.NXDOMAIN:
             return None, False, {
@@ -29,89 +52,178 @@ class DNSChecker:
                 "status": "invalid",
                 "message": "No DMARC record found"
             }
-        except Exception as e:
-            return None, False, {
-                "status": "error",
-                "message": f"Error checking DMARC: {str(e)}"
-            }
 
     @staticmethod
-    async def check_spf(domain: str) -> Tuple[Optional[str], bool, Dict]:
-        try:
-            answers = dns.resolver.resolve(domain, "TXT")
-            for rdata in answers:
-                if "v=spf1" in str(rdata):
-                    return str(rdata), True, {
-                        "status": "valid",
-                        "message": "SPF record found"
-                    }
-            return None, False, {
-                "status": "invalid",
-                "message": "SPF record not found or invalid"
-            }
-        except dns.resolver.NXDOMAIN:
-            return None, False, {
-                "status": "invalid",
-                "message": "Domain does not exist"
-            }
-        except dns.resolver.NoAnswer:
+    async def check_spf(
+        domain: str, resolver: Optional[AsyncResolver] = None
+    ) -> Tuple[Optional[str], bool, Dict]:
+        """Evaluate the SPF policy, following includes and redirects.
+
+        Valid means the record exists and evaluates without error within the
+        10-lookup limit. The info also carries the lookup count and the
+        flattened IP ranges the policy authorizes.
+        """
+        result = await spf_evaluator.evaluate(domain, resolver or DNSChecker.resolver)
+        info = {}
+        if result.ttl is not None:
+            info["ttl"] = result.ttl
+        if result.result == "none":
             return None, False, {
                 "status": "invalid",
-                "message": "No SPF record found"
+                "message": "No SPF record found",
+                **info
             }
-        except Exception as e:
-            return None, False, {
-                "status": "error",
-                "message": f"Error checking SPF: {str(e)}"
+        if result.error:
+            return result.record, False, {
+                "status": "error" if result.result == "temperror" else "invalid",
+                "message": f"SPF {result.result}: {result.error}",
+                "lookups": result.lookups,
+                **info
             }
+        return result.record, True, {
+            "status": "valid",
+            "message": "SPF record found",
+            "all": result.result,
+            "lookups": result.lookups,
+            "void_lookups": result.void_lookups,
+            "ip4": result.ip4,
+            "ip6": result.ip6,
+            "warnings": list(result.warnings),
+            **info
+        }
 
     @staticmethod
     async def check_dkim(
         domain: str,
-        selector: str = "default"
+        selector: Optional[str] = None,
+        known_selectors: Sequence[str] = (),
+        resolver: Optional[AsyncResolver] = None,
+        sweep: bool = False
     ) -> Tuple[Optional[str], bool, Dict]:
-        try:
-            dkim_domain = f"{selector}._domainkey.{domain}"
-            answers = dns.resolver.resolve(dkim_domain, "TXT")
-            for rdata in answers:
-                if "v=DKIM1" in str(rdata):
-                    return str(rdata), True, {
-                        "status": "valid",
-                        "message": "DKIM record found"
+        """Look for DKIM keys under ``selector``, or under the known ones.
+
+        Without a selector, ``known_selectors`` are probed and, if none of
+        them still holds a key (e.g. after a key rotation), the
+        ``DKIM_SELECTORS`` too (see ``app.services.dkim.discover``). With no
+        known selectors only ``"default"`` is probed, unless ``sweep``. The
+        record of the first key found is returned; the info lists every valid
+        selector with its key type and size, and the selectors whose lookup
+        failed or timed out as ``unresolved``.
+        """
+        resolver = resolver or DNSChecker.resolver
+        if selector:
+            selectors, known = [selector], ()
+        elif sweep or known_selectors:
+            selectors, known = settings.DKIM_SELECTOR_LIST, known_selectors or ()
+        else:
+            selectors, known = [DEFAULT_DKIM_SELECTOR], ()
+        discovery = await discover(
+            resolver, domain, selectors,
+            known=known,
+            timeout=settings.DKIM_DISCOVERY_TIMEOUT,
+            concurrency=settings.DKIM_DISCOVERY_CONCURRENCY
+        )
+        unresolved = {"unresolved": discovery.unresolved} if discovery.unresolved else {}
+        if discovery.keys:
+            return discovery.keys[0].record, True, {
+                "status": "valid",
+                "message": "DKIM record found",
+                "selectors": [
+                    {
+                        "selector": key.selector,
+                        "key_type": key.key_type,
+                        "key_bits": key.key_bits
                     }
-            return None, False, {
-                "status": "invalid",
-                "message": "DKIM record not found or invalid"
-            }
-        except dns.resolver.NXDOMAIN:
-            return None, False, {
-                "status": "invalid",
-                "message": "DKIM record does not exist"
+                    for key in discovery.keys
+                ],
+                "ttl": min(key.ttl for key in discovery.keys),
+                **unresolved
             }
-        except dns.resolver.NoAnswer:
-            return None, False, {
-                "status": "invalid",
-                "message": "No DKIM record found"
-            }
-        except Exception as e:
+        if discovery.unresolved and len(discovery.unresolved) == discovery.probed:
             return None, False, {
                 "status": "error",
-                "message": f"Error checking DKIM: {str(e)}"
+                "message": "DKIM lookups failed or timed out"
             }
+        return None, False, {
+            "status": "invalid",
+            "message": f"No DKIM key found under {discovery.probed} selectors",
+            **unresolved
+        }
 
     @staticmethod
-    async def check_mx(domain: str) -> Tuple[Optional[List[str]], bool, Dict]:
+    async def check_mx(
+        domain: str,
+        deep: Optional[bool] = None,
+        resolver: Optional[AsyncResolver] = None
+    ) -> Tuple[Optional[List[str]], bool, Dict]:
+        """List the MX exchanges and, in deep mode, resolve each of them.
+
+        A null MX (RFC 7505) is invalid. In deep mode the domain is valid when
+        at least one exchange has an address; exchanges that are CNAMEs or
+        don't resolve are reported in the info's ``hosts`` and ``warnings``.
+        Deep mode defaults to ``MX_DEEP_CHECK``.
+        """
+        if deep is None:
+            deep = settings.MX_DEEP_CHECK
+        resolver = resolver or DNSChecker.resolver
         try:
-            answers = dns.resolver.resolve(domain, "MX")
+            answers = await resolver.resolve(domain, "MX")
             mx_records = [str(rdata.exchange) for rdata in answers]
-            if mx_records:
+            if not mx_records:
+                return None, False, {
+                    "status": "invalid",
+                    "message": "No MX records found"
+                }
+            ttl = answer_ttl(answers)
+            exchanges = [(rdata.preference, str(rdata.exchange)) for rdata in answers]
+            if len(exchanges) == 1 and exchanges[0][1] == ".":
+                return mx_records, False, {
+                    "status": "invalid",
+                    "message": "Domain accepts no mail (null MX)",
+                    "null_mx": True,
+                    "ttl": ttl
+                }
+            if not deep:
                 return mx_records, True, {
                     "status": "valid",
-                    "message": "MX records found"
+                    "message": "MX records found",
+                    "ttl": ttl
                 }
-            return None, False, {
+
+            result = await check_hosts(exchanges, mx_hosts, resolver)
+            preferences = {}
+            for preference, name in exchanges:
+                preferences.setdefault(name.lower().rstrip("."), preference)
+            info = {
+                "hosts": [
+                    {
+                        "host": host.host,
+                        "preference": preferences.get(host.host),
+                        "addresses": host.addresses,
+                        "cname": host.cname,
+                        "error": host.error
+                    }
+                    for host in result.hosts
+                ],
+                "warnings": result.warnings(),
+                "ttl": min([ttl, *(h.ttl for h in result.hosts if h.ttl is not None)])
+            }
+            if result.usable:
+                return mx_records, True, {
+                    "status": "valid",
+                    "message": "MX records found",
+                    **info
+                }
+            if all(host.temporary for host in result.hosts):
+                return mx_records, False, {
+                    "status": "error",
+                    "message": "Error resolving MX hosts",
+                    **info
+                }
+            return mx_records, False, {
                 "status": "invalid",
-                "message": "No MX records found"
+                "message": "No MX host resolves to an address",
+                **info
             }
         except dns.resolver.NXDOMAIN:
             return None, False, {
@@ -123,46 +235,146 @@ class DNSChecker:
                 "status": "invalid",
                 "message": "No MX records found"
             }
-        except Exception as e:
-            return None, False, {
-                "status": "error",
-                "message": f"Error checking MX: {str(e)}"
-            }
 
     @staticmethod
-    async def check_all(domain: str) -> dict:
-        dmarc_record, dmarc_status, dmarc_info = await DNSChecker.check_dmarc(domain)
-        spf_record, spf_status, spf_info = await DNSChecker.check_spf(domain)
-        dkim_record, dkim_status, dkim_info = await DNSChecker.check_dkim(domain)
-        mx_records, mx_status, mx_info = await DNSChecker.check_mx(domain)
-
-        # Calculate overall status
-        overall_status = all([
-            dmarc_status,
-            spf_status,
-            dkim_status,
-            mx_status
-        ])
-
-        # Create check summary
-        check_summary = {
-            "dmarc": dmarc_info,
-            "spf": spf_info,
-            "dkim": dkim_info,
-            "mx": mx_info
-        }
+    async def run_check(
+        name: str,
+        domain: str,
+        selector: Optional[str] = None,
+        dkim_selectors: Sequence[str] = (),
+        resolver: Optional[AsyncResolver] = None,
+        timeout: Optional[float] = None,
+        discover_dkim: bool = False
+    ) -> Tuple:
+        """Run the single registered check ``name`` for ``domain``."""
+        return await DNSChecker.engine.run_check(
+            checks[name],
+            CheckRequest(domain, selector, dkim_selectors, discover_dkim),
+            resolver or DNSChecker.resolver,
+            timeout if timeout is not None else settings.DNS_CHECK_TIMEOUT
+        )
+
+    @staticmethod
+    async def check_all(
+        domain: str,
+        selector: Optional[str] = None,
+        timeouts: Optional[Dict[str, float]] = None,
+        deadline: Optional[float] = None,
+        dkim_selectors: Sequence[str] = (),
+        discover_dkim: bool = False
+    ) -> dict:
+        """Run every registered check concurrently (see ``CheckEngine.check``).
+
+        DKIM is looked up under ``selector`` if given, otherwise under the
+        domain's previously found ``dkim_selectors``, sweeping the common
+        selectors if none of those holds a key; with no known selectors the
+        sweep only runs with ``discover_dkim``. The
+        result's ``dkim_selectors`` are the selectors to remember for the
+        next check. A check that runs out of time is reported with status
+        ``"timeout"`` instead of failing the whole result.
+        """
+        return await DNSChecker.engine.check(
+            CheckRequest(domain, selector, dkim_selectors, discover_dkim),
+            DNSChecker.resolver,
+            timeouts=timeouts,
+            deadline=deadline
+        )
 
+    @staticmethod
+    def check_many(
+        requests: Sequence[CheckRequest],
+        concurrency: int,
+        **options
+    ) -> AsyncIterator[Tuple[int, Optional[dict], Optional[Exception]]]:
+        """Check a batch of domains (see ``CheckEngine.check_many``)."""
+        return DNSChecker.engine.check_many(
+            requests, concurrency, DNSChecker.resolver, **options
+        )
+
+
+@register
+class DMARCCheck(Check):
+    name = "dmarc"
+    label = "DMARC"
+    record_field = "dmarc_record"
+    status_field = "dmarc_status"
+
+    def queries(self, request: CheckRequest) -> List[Tuple[str, str]]:
+        return [(f"_dmarc.{request.domain}", "TXT")]
+
+    async def run(self, request: CheckRequest, resolver: AsyncResolver) -> Tuple:
+        return await DNSChecker.check_dmarc(request.domain, resolver)
+
+
+@register
+class SPFCheck(Check):
+    name = "spf"
+    label = "SPF"
+    record_field = "spf_record"
+    status_field = "spf_status"
+
+    def queries(self, request: CheckRequest) -> List[Tuple[str, str]]:
+        # Shared with any other check reading the apex TXT RRset
+        return [(request.domain, "TXT")]
+
+    async def run(self, request: CheckRequest, resolver: AsyncResolver) -> Tuple:
+        return await DNSChecker.check_spf(request.domain, resolver)
+
+
+@register
+class DKIMCheck(Check):
+    name = "dkim"
+    label = "DKIM"
+    record_field = "dkim_record"
+    status_field = "dkim_status"
+
+    def queries(self, request: CheckRequest) -> List[Tuple[str, str]]:
+        if request.selector:
+            selectors = [request.selector]
+        elif request.dkim_selectors or request.discover_dkim:
+            selectors = request.dkim_selectors
+        else:
+            selectors = [DEFAULT_DKIM_SELECTOR]
+        return [
+            (f"{selector}._domainkey.{request.domain}", "TXT")
+            for selector in selectors
+        ]
+
+    async def run(self, request: CheckRequest, resolver: AsyncResolver) -> Tuple:
+        return await DNSChecker.check_dkim(
+            request.domain, request.selector, request.dkim_selectors, resolver,
+            sweep=request.discover_dkim
+        )
+
+    def result_fields(self, request: CheckRequest, outcome: Tuple) -> Dict:
+        info = outcome[2]
+        found = [key["selector"] for key in info.get("selectors", [])]
+        known = request.dkim_selectors or ()
+        if request.selector or info["status"] in ("error", "timeout"):
+            # Don't forget known selectors over a one-off probe or a failure
+            found = list(dict.fromkeys([*known, *found]))
+        else:
+            # Known selectors are only dropped on a definitive answer
+            unresolved = info.get("unresolved", ())
+            found += [s for s in known if s in unresolved and s not in found]
         return {
-            "domain_name": domain,
-            "check_timestamp": datetime.utcnow(),
-            "dmarc_record": dmarc_record,
-            "dmarc_status": dmarc_status,
-            "spf_record": spf_record,
-            "spf_status": spf_status,
-            "dkim_record": dkim_record,
-            "dkim_status": dkim_status,
-            "mx_records": mx_records,
-            "mx_status": mx_status,
-            "overall_status": overall_status,
-            "check_summary": check_summary
-        } 
\ No newline at end of file
+            **super().result_fields(request, outcome),
+            "dkim_selectors": found or None
+        }
+
+
+@register
+class MXCheck(Check):
+    name = "mx"
+    label = "MX"
+    record_field = "mx_records"
+    status_field = "mx_status"
+
+    def queries(self, request: CheckRequest) -> List[Tuple[str, str]]:
+        return [(request.domain, "MX")]
+
+    async def run(self, request: CheckRequest, resolver: AsyncResolver) -> Tuple:
+        return await DNSChecker.check_mx(request.domain, resolver=resolver)
+
+
+DNSChecker.engine = CheckEngine()
@@ -0,0 +1,470 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import dns.asyncresolver
+import dns.exception
+import dns.nameserver
+import dns.rdatatype
+import dns.resolver
+
+from app.core.config import settings
+from app.core.metrics import Histogram
+from app.core.tracing import span
+from app.services.dns_cache import get_answer_cache
+from app.services.dns_transport import pooled_nameserver, split_address
+
+# Responses that settle a query: whichever nameserver sends one first wins
+ANSWERED = (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer, dns.resolver.YXDOMAIN)
+# Signs of an overloaded or rate-limiting upstream
+CONGESTED_RCODES = ("SERVFAIL", "REFUSED")
+
+LOOKUP_SECONDS = Histogram(
+    "dns_lookup_duration_seconds",
+    "Time to resolve a record upstream (answer cache misses), including "
+    "retries, by record type and outcome.",
+    ["rdtype", "outcome"],
+)
+
+
+def answer_ttl(answers: dns.resolver.Answer) -> int:
+    """Seconds the answer stays valid, net of time spent in the cache."""
+    return max(0, int(answers.expiration - time.time()))
+
+
+def parse_nameserver(value: str) -> dns.nameserver.Nameserver:
+    """Parse ``ip``, ``ip:port`` or ``[ipv6]:port`` into a UDP nameserver."""
+    host, port, _ = split_address(value)
+    return dns.nameserver.Do53Nameserver(host, port)
+
+
+def make_nameserver(value: str, transport: Optional[str] = None) -> dns.nameserver.Nameserver:
+    """A nameserver for ``value`` over the ``DNS_TRANSPORT`` transport."""
+    transport = transport or settings.DNS_TRANSPORT
+    if transport == "udp":
+        return parse_nameserver(value)
+    return pooled_nameserver(
+        value,
+        transport,
+        size=settings.DNS_POOL_SIZE,
+        max_pipeline=settings.DNS_POOL_MAX_PIPELINE,
+        idle_timeout=settings.DNS_POOL_IDLE_TIMEOUT,
+        server_name=settings.DNS_TLS_SERVER_NAME or None,
+        verify=settings.DNS_TLS_VERIFY,
+    )
+
+
+class _StoreOnlyCache(dns.resolver.CacheBase):
+    """Lets a resolver store answers in a cache without reading from it.
+
+    Lookups are checked against the cache once, before any nameserver is
+    asked, so the nameserver-level resolvers must not count them again.
+    """
+
+    def __init__(self, cache: dns.resolver.CacheBase) -> None:
+        super().__init__()
+        self.cache = cache
+
+    def get(self, key):
+        return None
+
+    def put(self, key, value) -> None:
+        self.cache.put(key, value)
+
+
+class NameserverStats:
+    """Rolling latency and health of one upstream nameserver.
+
+    ``health`` is an exponentially weighted success rate: answers count 1,
+    timeouts, failures and hedges lost to another server count 0. It drifts
+    back towards 1 with a half-life of ``recovery`` seconds, so a demoted
+    server is tried first again once it has had time to recover.
+    """
+
+    def __init__(self, window: int = 200, alpha: float = 0.2, recovery: float = 30.0) -> None:
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.alpha = alpha
+        self.recovery = recovery
+        self.queries = 0
+        self.answers = 0
+        self.failures = 0
+        self.hedges = 0
+        self.hedges_lost = 0
+        self._health = 1.0
+        self._updated = time.monotonic()
+
+    @property
+    def health(self) -> float:
+        elapsed = time.monotonic() - self._updated
+        return 1 - (1 - self._health) * 0.5 ** (elapsed / self.recovery)
+
+    def _score(self, outcome: float) -> None:
+        self._health = self.health + self.alpha * (outcome - self.health)
+        self._updated = time.monotonic()
+
+    def answered(self, latency: float) -> None:
+        self.answers += 1
+        self.latencies.append(latency)
+        self._score(1.0)
+
+    def failed(self) -> None:
+        self.failures += 1
+        self._score(0.0)
+
+    def lost(self) -> None:
+        self.hedges_lost += 1
+        self._score(0.0)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def as_dict(self) -> Dict[str, float]:
+        p50, p95, p99 = (self.percentile(p) for p in (50, 95, 99))
+        return {
+            "queries": self.queries,
+            "answers": self.answers,
+            "failures": self.failures,
+            "hedges": self.hedges,
+            "hedges_lost": self.hedges_lost,
+            "health": round(self.health, 3),
+            "p50_ms": round(p50 * 1000, 2) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 2) if p95 is not None else None,
+            "p99_ms": round(p99 * 1000, 2) if p99 is not None else None,
+        }
+
+
+class AIMDLimiter:
+    """Adaptive cap on the queries in flight to one upstream.
+
+    Additive increase, multiplicative decrease: answers that come back while
+    at least half the window is in use, and no slower than ``tolerance``
+    times the fastest of the last 100 answers, raise the limit by one per
+    window's worth, up to ``maximum``. A timeout or a SERVFAIL/REFUSED multiplies it
+    by ``backoff`` (at most once per window: only queries sent after the last
+    decrease can trigger another), down to ``minimum``. Queries over the
+    limit wait their turn in FIFO order.
+    """
+
+    def __init__(
+        self,
+        initial: int = 20,
+        minimum: int = 2,
+        maximum: int = 200,
+        backoff: float = 0.5,
+        tolerance: float = 2.0,
+    ) -> None:
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.increases = 0
+        self.decreases = 0
+        self._recent: Deque[float] = deque(maxlen=100)
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = float("-inf")
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    async def acquire(self) -> float:
+        """Wait for a slot; returns when the query may be sent."""
+        if self._waiters or self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    # Granted a slot just as we were cancelled: pass it on
+                    self.in_flight -= 1
+                    self._wake()
+                raise
+        else:
+            self.in_flight += 1
+        return time.monotonic()
+
+    def release(self, sent: float, latency: Optional[float], congested: bool) -> None:
+        """Return a slot, given when the query was sent and how it went."""
+        window_used = self.in_flight * 2 >= int(self.limit)
+        self.in_flight -= 1
+        if congested:
+            if sent >= self._last_decrease:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self._last_decrease = time.monotonic()
+                self.decreases += 1
+        elif latency is not None:
+            self._recent.append(latency)
+            if (
+                window_used
+                and self.limit < self.maximum
+                and latency <= self.tolerance * min(self._recent)
+            ):
+                # About one more slot per window's worth of answers
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self.increases += 1
+        self._wake()
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "limit_increases": self.increases,
+            "limit_decreases": self.decreases,
+        }
+
+
+def _congested(error: Exception) -> bool:
+    if isinstance(error, dns.exception.Timeout):
+        return True
+    if isinstance(error, dns.resolver.NoNameservers):
+        return any(
+            str(rcode) in CONGESTED_RCODES for _, _, _, rcode, _ in error.kwargs["errors"]
+        )
+    return False
+
+
+class _Upstream:
+    def __init__(self, address: str, timeout: float, cache, transport: Optional[str]) -> None:
+        self.address = address
+        self.stats = NameserverStats(recovery=settings.DNS_HEALTH_RECOVERY)
+        self.limiter = AIMDLimiter(
+            initial=settings.DNS_UPSTREAM_INITIAL_LIMIT,
+            minimum=settings.DNS_UPSTREAM_MIN_LIMIT,
+            maximum=settings.DNS_UPSTREAM_MAX_LIMIT,
+            backoff=settings.DNS_UPSTREAM_BACKOFF,
+            tolerance=settings.DNS_UPSTREAM_LATENCY_TOLERANCE,
+        )
+        self.resolver = dns.asyncresolver.Resolver(configure=False)
+        self.nameserver = make_nameserver(address, transport)
+        self.resolver.nameservers = [self.nameserver]
+        self.resolver.timeout = timeout
+        self.resolver.lifetime = timeout
+        self.resolver.cache = _StoreOnlyCache(cache) if cache is not None else None
+
+    def hedge_delay(self) -> float:
+        """How long to wait on this server before asking the next one too."""
+        if len(self.stats.latencies) < settings.DNS_HEDGE_MIN_SAMPLES:
+            return settings.DNS_HEDGE_MAX_DELAY
+        delay = self.stats.percentile(settings.DNS_HEDGE_PERCENTILE)
+        return min(max(delay, settings.DNS_HEDGE_MIN_DELAY), settings.DNS_HEDGE_MAX_DELAY)
+
+    async def query(self, qname: str, rdtype: str) -> dns.resolver.Answer:
+        """Ask this server, once the limiter lets the query through.
+
+        A query cancelled with the message ``"lost"`` (another server answered
+        first) or ``"timeout"`` counts against the server's health, but only
+        if it had been sent: time spent queued isn't the server's fault.
+        """
+        sent = await self.limiter.acquire()
+        self.stats.queries += 1
+        latency, congested = None, False
+        try:
+            answer = await self.resolver.resolve(qname, rdtype)
+        except ANSWERED:
+            latency = time.monotonic() - sent
+            self.stats.answered(latency)
+            raise
+        except asyncio.CancelledError as e:
+            if e.args == ("lost",):
+                self.stats.lost()
+            elif e.args == ("timeout",):
+                congested = True
+                self.stats.failed()
+            raise
+        except Exception as e:
+            congested = _congested(e)
+            self.stats.failed()
+            raise
+        else:
+            latency = time.monotonic() - sent
+            self.stats.answered(latency)
+            return answer
+        finally:
+            self.limiter.release(sent, latency, congested)
+
+    def transport_stats(self) -> Dict[str, int]:
+        pool = getattr(self.nameserver, "pool", None)
+        return pool.as_dict() if pool is not None else {}
+
+    def close(self) -> None:
+        pool = getattr(self.nameserver, "pool", None)
+        if pool is not None:
+            pool.close()
+
+
+class AsyncResolver:
+    """Non-blocking DNS resolver configured from the ``DNS_*`` settings.
+
+    ``timeout`` bounds a single query to one nameserver, ``lifetime`` bounds
+    one pass of the query across all nameservers, and ``tries`` is how many
+    passes are made before a timeout is reported to the caller. Answers are
+    served from the shared answer cache unless another ``cache`` is given.
+
+    Nameservers are asked in order of health: the configured order, with
+    servers whose health score is below ``DNS_UNHEALTHY_SCORE`` moved to the
+    back. If a server fails, the next one is asked at once; if it is merely
+    slow — no answer within its own ``DNS_HEDGE_PERCENTILE`` latency — the
+    next one is asked as well (a hedged query, unless ``DNS_HEDGE_ENABLED``
+    is off) and the first answer wins.
+
+    ``transport`` (default ``DNS_TRANSPORT``) is ``"udp"``, with truncated
+    answers asked again over a new TCP connection, or ``"tcp"``/``"tls"``
+    to send every query over a pool of pipelined connections to each server
+    (see ``app.services.dns_transport``).
+    """
+
+    def __init__(
+        self,
+        nameservers: Optional[List[str]] = None,
+        timeout: Optional[float] = None,
+        lifetime: Optional[float] = None,
+        tries: Optional[int] = None,
+        cache: Optional[dns.resolver.CacheBase] = None,
+        transport: Optional[str] = None,
+    ):
+        self.nameservers = nameservers or settings.DNS_NAMESERVER_LIST
+        self.timeout = timeout if timeout is not None else settings.DNS_TIMEOUT
+        self.lifetime = lifetime if lifetime is not None else settings.DNS_LIFETIME
+        self.tries = max(1, tries if tries is not None else settings.DNS_TRIES)
+        self.hedge = settings.DNS_HEDGE_ENABLED
+        self.transport = transport or settings.DNS_TRANSPORT
+
+        cache = cache if cache is not None else get_answer_cache()
+        # Answers the query from the cache or raises NoNameservers
+        self._cached = dns.asyncresolver.Resolver(configure=False)
+        self._cached.nameservers = []
+        self._cached.cache = cache
+        self.upstreams = [
+            _Upstream(address, self.timeout, cache, self.transport)
+            for address in self.nameservers
+        ]
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Latency, error, concurrency-window and connection statistics per
+        nameserver."""
+        return {
+            upstream.address: {
+                **upstream.stats.as_dict(),
+                **upstream.limiter.as_dict(),
+                **upstream.transport_stats(),
+            }
+            for upstream in self.upstreams
+        }
+
+    def close(self) -> None:
+        """Close pooled upstream connections; they reopen on the next query."""
+        for upstream in self.upstreams:
+            upstream.close()
+
+    def _ordered(self) -> List[_Upstream]:
+        healthy = [u for u in self.upstreams if u.stats.health >= settings.DNS_UNHEALTHY_SCORE]
+        demoted = sorted(
+            (u for u in self.upstreams if u.stats.health < settings.DNS_UNHEALTHY_SCORE),
+            key=lambda u: -u.stats.health,
+        )
+        return healthy + demoted
+
+    async def _race(self, qname: str, rdtype: str) -> dns.resolver.Answer:
+        """One pass over the nameservers; the first to answer wins."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.lifetime
+        order = self._ordered()
+        running: Dict[asyncio.Future, _Upstream] = {}
+        errors: List[Exception] = []
+        answered = False
+
+        def ask() -> _Upstream:
+            upstream = order.pop(0)
+            running[asyncio.ensure_future(upstream.query(qname, rdtype))] = upstream
+            return upstream
+
+        latest = ask()
+        try:
+            while running:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                hedging = self.hedge and order
+                wait = min(remaining, latest.hedge_delay()) if hedging else remaining
+                done, _ = await asyncio.wait(
+                    running, timeout=wait, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    if hedging:
+                        latest.stats.hedges += 1
+                        latest = ask()
+                    continue
+                for task in done:
+                    running.pop(task)
+                    error = task.exception()
+                    if error is None or isinstance(error, ANSWERED):
+                        answered = True
+                        return task.result()
+                    errors.append(error)
+                if not running and order:
+                    latest = ask()
+        finally:
+            for task in running:
+                # Beaten by a hedged query to another server, or out of time
+                task.cancel("lost" if answered else "timeout")
+        if errors and not isinstance(errors[-1], dns.exception.Timeout):
+            raise errors[-1]
+        raise dns.resolver.LifetimeTimeout(timeout=self.lifetime, errors=[])
+
+    async def resolve(self, qname: str, rdtype: str) -> dns.resolver.Answer:
+        if self._cached.cache is not None:
+            try:
+                return await self._cached.resolve(qname, rdtype)
+            except dns.resolver.NoNameservers:
+                pass
+        if not isinstance(rdtype, str):
+            rdtype = dns.rdatatype.to_text(rdtype)
+        rdtype = rdtype.upper()
+        started = time.perf_counter()
+        outcome = "error"
+        with span("dns", qname=str(qname), rdtype=rdtype) as current:
+            try:
+                for attempt in range(self.tries):
+                    try:
+                        answer = await self._race(qname, rdtype)
+                        outcome = "answer"
+                        return answer
+                    except (dns.resolver.LifetimeTimeout, dns.resolver.NoNameservers):
+                        if attempt + 1 >= self.tries:
+                            raise
+            except dns.resolver.NXDOMAIN:
+                outcome = "nxdomain"
+                raise
+            except dns.resolver.NoAnswer:
+                outcome = "no_answer"
+                raise
+            except dns.exception.Timeout:
+                outcome = "timeout"
+                raise
+            except asyncio.CancelledError:
+                outcome = "cancelled"
+                raise
+            finally:
+                LOOKUP_SECONDS.labels(rdtype, outcome).observe(time.perf_counter() - started)
+                if current is not None:
+                    current.attrs["outcome"] = outcome
+
+
+resolver = AsyncResolver()
@@ -0,0 +1,354 @@
+"""
+Pooled, pipelined TCP and DNS-over-TLS upstream connections.
+
+Over UDP every query that doesn't fit in 512 bytes — long SPF records, DKIM
+keys — comes back truncated and is asked again over a TCP connection opened
+(and, for DoT, TLS-negotiated) for that one query. A ``ConnectionPool``
+instead keeps a few connections to a nameserver open and pipelines many
+queries over each (RFC 7766): queries are written as they are asked and
+responses are matched back by message ID in whatever order they arrive.
+``PooledNameserver`` plugs a pool into dnspython's resolver, so answers,
+negative answers and caching work exactly as they do over UDP.
+"""
+import asyncio
+import ssl
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+import dns.entropy
+import dns.exception
+import dns.message
+import dns.nameserver
+import dns.query
+
+DEFAULT_PORTS = {"udp": 53, "tcp": 53, "tls": 853}
+
+
+def split_address(value: str, default_port: int = 53) -> Tuple[str, int, Optional[str]]:
+    """Split ``ip``, ``ip:port`` or ``[ipv6]:port``, optionally followed by
+    ``#name`` (the name a DoT server's certificate is checked against)."""
+    value, _, server_name = value.strip().partition("#")
+    port = default_port
+    if value.startswith("["):
+        host, _, rest = value[1:].partition("]")
+        if rest.startswith(":"):
+            port = int(rest[1:])
+    elif value.count(":") == 1:
+        host, _, port_text = value.partition(":")
+        port = int(port_text)
+    else:
+        host = value
+    return host, port, server_name or None
+
+
+class PipelinedConnection:
+    """One connection carrying any number of queries at once.
+
+    Each query is sent under a message ID unique on the connection and the
+    caller's ID is put back on the response. If the connection breaks, every
+    query waiting on it fails with the error.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.last_used = time.monotonic()
+        self.queries = 0
+        self.error: Optional[Exception] = None
+        self._reading = asyncio.ensure_future(self._read())
+
+    @classmethod
+    async def open(
+        cls,
+        host: str,
+        port: int,
+        ssl_context: Optional[ssl.SSLContext],
+        server_name: Optional[str],
+        timeout: float,
+    ) -> "PipelinedConnection":
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    host, port, ssl=ssl_context,
+                    server_hostname=(server_name or host) if ssl_context else None,
+                ),
+                timeout,
+            )
+        except asyncio.TimeoutError:
+            raise dns.exception.Timeout(timeout=timeout) from None
+        return cls(reader, writer)
+
+    @property
+    def closed(self) -> bool:
+        return self.error is not None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.pending)
+
+    def idle_for(self, now: float) -> float:
+        return 0.0 if self.pending else now - self.last_used
+
+    async def _read(self) -> None:
+        error: Exception = EOFError("connection closed by nameserver")
+        try:
+            while True:
+                header = await self.reader.readexactly(2)
+                wire = await self.reader.readexactly(struct.unpack("!H", header)[0])
+                self.last_used = time.monotonic()
+                if len(wire) < 2:
+                    continue
+                # Late answers to queries that timed out are dropped
+                waiter = self.pending.pop(struct.unpack("!H", wire[:2])[0], None)
+                if waiter is not None and not waiter.done():
+                    waiter.set_result(wire)
+        except asyncio.IncompleteReadError:
+            pass
+        except OSError as e:
+            error = e
+        except asyncio.CancelledError:
+            error = EOFError("connection closed")
+        finally:
+            self._fail(error)
+
+    def _fail(self, error: Exception) -> None:
+        if self.error is None:
+            self.error = error
+        pending, self.pending = self.pending, {}
+        for waiter in pending.values():
+            if not waiter.done():
+                waiter.set_exception(error)
+        self.writer.close()
+
+    def _next_id(self) -> int:
+        while True:
+            query_id = dns.entropy.random_16()
+            if query_id not in self.pending:
+                return query_id
+
+    async def query(self, wire: bytes, timeout: float) -> bytes:
+        if self.error is not None:
+            raise self.error
+        query_id = self._next_id()
+        waiter = asyncio.get_running_loop().create_future()
+        self.pending[query_id] = waiter
+        self.queries += 1
+        self.last_used = time.monotonic()
+
+        async def exchange() -> bytes:
+            self.writer.write(struct.pack("!HH", len(wire), query_id) + wire[2:])
+            await self.writer.drain()
+            return await waiter
+
+        try:
+            response = await asyncio.wait_for(exchange(), timeout)
+        except asyncio.TimeoutError:
+            raise dns.exception.Timeout(timeout=timeout) from None
+        except ConnectionError as e:
+            self._fail(e)
+            raise
+        finally:
+            if self.pending.get(query_id) is waiter:
+                del self.pending[query_id]
+        return wire[:2] + response[2:]
+
+    def close(self) -> None:
+        self._reading.cancel()
+
+
+class ConnectionPool:
+    """Up to ``size`` long-lived connections to one nameserver.
+
+    A query goes to the least busy open connection; another connection is
+    opened only when every open one has ``max_pipeline`` queries in flight
+    (beyond ``size`` connections, they share the least busy). Connections
+    the server closed are replaced on demand, and a query that failed
+    because its connection broke is retried once on a fresh one. Connections
+    with nothing in flight for ``idle_timeout`` seconds are closed.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        server_name: Optional[str] = None,
+        size: int = 2,
+        max_pipeline: int = 100,
+        idle_timeout: float = 30.0,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.server_name = server_name
+        self.size = max(1, size)
+        self.max_pipeline = max(1, max_pipeline)
+        self.idle_timeout = idle_timeout
+        self.connections: List[PipelinedConnection] = []
+        self.connects = 0
+        self.reconnects = 0
+        self.reaped = 0
+        self._opening: Optional[asyncio.Future] = None
+        self._reaper: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _bind(self) -> None:
+        # Connections belong to the event loop that opened them
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self.connections = []
+            self._opening = None
+            self._reaper = None
+
+    def _reap(self) -> None:
+        now = time.monotonic()
+        keep = []
+        for connection in self.connections:
+            if connection.closed:
+                continue
+            if connection.idle_for(now) >= self.idle_timeout:
+                connection.close()
+                self.reaped += 1
+                continue
+            keep.append(connection)
+        self.connections = keep
+        self._reaper = None
+        if keep:
+            self._reaper = self._loop.call_later(self.idle_timeout, self._reap)
+
+    async def _open(self, timeout: float) -> PipelinedConnection:
+        """Open one more connection, sharing an attempt already under way."""
+        if self._opening is None:
+            async def connect() -> PipelinedConnection:
+                try:
+                    connection = await PipelinedConnection.open(
+                        self.host, self.port, self.ssl_context, self.server_name, timeout
+                    )
+                finally:
+                    self._opening = None
+                self.connects += 1
+                self.connections.append(connection)
+                if self._reaper is None:
+                    self._reaper = self._loop.call_later(self.idle_timeout, self._reap)
+                return connection
+
+            self._opening = asyncio.ensure_future(connect())
+            # Raised to the waiters; don't also log it as never retrieved
+            self._opening.add_done_callback(
+                lambda task: task.cancelled() or task.exception()
+            )
+        # A query cancelled mid-connect mustn't abort it for the others
+        return await asyncio.shield(self._opening)
+
+    async def _connection(self, timeout: float) -> PipelinedConnection:
+        self.connections = [c for c in self.connections if not c.closed]
+        best = min(self.connections, key=lambda c: c.in_flight, default=None)
+        if best is None or (
+            best.in_flight >= self.max_pipeline and len(self.connections) < self.size
+        ):
+            return await self._open(timeout)
+        return best
+
+    async def query(self, wire: bytes, timeout: float) -> bytes:
+        """Send a query in wire format and return the response's wire format."""
+        self._bind()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        connection = await self._connection(timeout)
+        try:
+            return await connection.query(wire, max(0.0, deadline - loop.time()))
+        except (EOFError, ConnectionError):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise
+        # Servers close connections they consider idle; that can race a query
+        self.reconnects += 1
+        connection = await self._connection(remaining)
+        return await connection.query(wire, max(0.0, deadline - loop.time()))
+
+    def close(self) -> None:
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "connections": sum(not c.closed for c in self.connections),
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "connections_reaped": self.reaped,
+            "pipelined": sum(c.in_flight for c in self.connections),
+        }
+
+
+class PooledNameserver(dns.nameserver.AddressAndPortNameserver):
+    """A nameserver reached through a ``ConnectionPool`` (async only)."""
+
+    def __init__(self, address: str, port: int, pool: ConnectionPool) -> None:
+        super().__init__(address, port)
+        self.pool = pool
+
+    def kind(self) -> str:
+        return "DoT" if self.pool.ssl_context is not None else "TCP"
+
+    def is_always_max_size(self) -> bool:
+        return True
+
+    def query(self, *args, **kwargs) -> dns.message.Message:
+        raise NotImplementedError("pooled nameservers only support async queries")
+
+    async def async_query(
+        self,
+        request: dns.message.QueryMessage,
+        timeout: float,
+        source: Optional[str],
+        source_port: int,
+        max_size: bool,
+        backend=None,
+        one_rr_per_rrset: bool = False,
+        ignore_trailing: bool = False,
+    ) -> dns.message.Message:
+        wire = await self.pool.query(request.to_wire(), timeout)
+        response = dns.message.from_wire(
+            wire,
+            keyring=request.keyring,
+            request_mac=request.mac,
+            one_rr_per_rrset=one_rr_per_rrset,
+            ignore_trailing=ignore_trailing,
+        )
+        if not request.is_response(response):
+            raise dns.query.BadResponse
+        return response
+
+
+def pooled_nameserver(
+    address: str,
+    transport: str,
+    size: int = 2,
+    max_pipeline: int = 100,
+    idle_timeout: float = 30.0,
+    server_name: Optional[str] = None,
+    verify: bool = True,
+) -> PooledNameserver:
+    """A pooled ``"tcp"`` or ``"tls"`` nameserver for ``address``; see
+    ``split_address`` for the format."""
+    if transport not in ("tcp", "tls"):
+        raise ValueError(f"Unknown pooled DNS transport: {transport!r}")
+    host, port, name = split_address(address, DEFAULT_PORTS[transport])
+    ssl_context = None
+    if transport == "tls":
+        ssl_context = ssl.create_default_context()
+        if not verify:
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+    pool = ConnectionPool(
+        host, port, ssl_context, name or server_name,
+        size=size, max_pipeline=max_pipeline, idle_timeout=idle_timeout,
+    )
+    return PooledNameserver(host, port, pool)
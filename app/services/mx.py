@@ -0,0 +1,154 @@
+"""
+Deep MX validation.
+
+Resolves the A/AAAA records of every MX exchange and flags null MX
+(RFC 7505), exchanges that are CNAME aliases (RFC 2181 10.3) and exchanges
+that don't resolve. Many domains share the same mail hosts, so host
+resolutions are cached process-wide for their TTL and concurrent lookups of
+one host are coalesced: a batch of domains does about one lookup per
+distinct MX host.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+import dns.exception
+import dns.name
+import dns.resolver
+
+from app.core.config import settings
+from app.core.metrics import register_cache
+from app.services.dns_resolver import AsyncResolver, answer_ttl, resolver as default_resolver
+from app.services.singleflight import SingleFlight
+
+
+class MXHost(NamedTuple):
+    """Addresses of one exchange; ``cname`` is set when it is an alias."""
+    host: str
+    addresses: List[str]
+    cname: Optional[str]
+    error: Optional[str]
+    ttl: Optional[int]
+    temporary: bool = False
+
+
+class MXHostResolver:
+    """Resolves exchange names, sharing the results between domains.
+
+    Resolutions are kept for their TTL (at most ``max_ttl``) in an LRU of
+    ``max_entries`` hosts. Hosts whose lookup failed temporarily are not
+    cached.
+    """
+
+    def __init__(
+        self,
+        resolver: Optional[AsyncResolver] = None,
+        max_entries: int = 10_000,
+        max_ttl: int = 3600,
+    ) -> None:
+        self.resolver = resolver or default_resolver
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.hosts: "OrderedDict[str, Tuple[float, MXHost]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._flights = SingleFlight()
+
+    async def resolve(self, host: str, resolver: Optional[AsyncResolver] = None) -> MXHost:
+        host = host.lower().rstrip(".")
+        entry = self.hosts.get(host)
+        if entry is not None and entry[0] > time.time():
+            self.hosts.move_to_end(host)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return await self._flights.do(
+            host, lambda: self._resolve(host, resolver or self.resolver)
+        )
+
+    async def _resolve(self, host: str, resolver: AsyncResolver) -> MXHost:
+        result = await _resolve_host(host, resolver)
+        if not result.temporary:
+            ttl = min(
+                result.ttl if result.ttl is not None
+                else settings.DNS_CACHE_NEGATIVE_MAX_TTL,
+                self.max_ttl,
+            )
+            self.hosts[host] = (time.time() + ttl, result)
+            self.hosts.move_to_end(host)
+            while len(self.hosts) > self.max_entries:
+                self.hosts.popitem(last=False)
+        return result
+
+
+async def _lookup(
+    resolver: AsyncResolver, host: str, rdtype: str
+) -> Optional[dns.resolver.Answer]:
+    try:
+        return await resolver.resolve(host, rdtype)
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        return None
+
+
+async def _resolve_host(host: str, resolver: AsyncResolver) -> MXHost:
+    results = await asyncio.gather(
+        _lookup(resolver, host, "A"), _lookup(resolver, host, "AAAA"),
+        return_exceptions=True,
+    )
+    errors = [r for r in results if isinstance(r, BaseException)]
+    answers = [r for r in results if isinstance(r, dns.resolver.Answer)]
+    if errors and not answers:
+        temporary = isinstance(errors[0], (dns.exception.Timeout, dns.resolver.NoNameservers))
+        return MXHost(host, [], None, f"Lookup failed: {errors[0]}", None, temporary)
+    if not answers:
+        return MXHost(host, [], None, "Host does not resolve", None)
+
+    addresses = [rdata.address for answer in answers for rdata in answer]
+    ttl = min(answer_ttl(answer) for answer in answers)
+    cname = None
+    canonical = answers[0].canonical_name
+    if canonical != dns.name.from_text(host):
+        cname = canonical.to_text().rstrip(".")
+    return MXHost(host, addresses, cname, None, ttl)
+
+
+class MXCheck(NamedTuple):
+    exchanges: List[Tuple[int, str]]
+    hosts: List[MXHost]
+    null_mx: bool
+
+    @property
+    def usable(self) -> List[MXHost]:
+        return [host for host in self.hosts if host.addresses]
+
+    def warnings(self) -> List[str]:
+        warnings = []
+        for host in self.hosts:
+            if host.cname:
+                warnings.append(f"{host.host} is a CNAME for {host.cname}")
+            if host.error:
+                warnings.append(f"{host.host}: {host.error}")
+        return warnings
+
+
+async def check_hosts(
+    exchanges: List[Tuple[int, str]],
+    hosts: MXHostResolver,
+    resolver: Optional[AsyncResolver] = None,
+) -> MXCheck:
+    """Resolve every exchange of an MX RRset given as ``(preference, name)``."""
+    names = [name.lower().rstrip(".") for _, name in exchanges]
+    if len(exchanges) == 1 and names[0] == "":
+        return MXCheck(exchanges, [], True)
+    resolved = await asyncio.gather(*(
+        hosts.resolve(name, resolver) for name in dict.fromkeys(names) if name
+    ))
+    return MXCheck(exchanges, list(resolved), False)
+
+
+mx_hosts = MXHostResolver(
+    max_entries=settings.MX_HOST_CACHE_MAX_ENTRIES,
+    max_ttl=settings.MX_HOST_CACHE_MAX_TTL,
+)
+register_cache("mx_host", lambda: (mx_hosts.hits, mx_hosts.misses))
@@ -0,0 +1,67 @@
+"""
+Per-check DNS query plan.
+
+The checks of one domain ask for overlapping records: SPF and any other
+apex TXT check read the same TXT RRset, SPF's ``mx`` and ``a`` mechanisms
+at the apex read the records the MX check resolves. A ``QueryPlan`` stands in
+for the resolver during one check: the pairs the checks are known to need
+are started up front, concurrently, and every ``(name, rdtype)`` is queried
+at most once however many checks ask for it.
+"""
+import asyncio
+from typing import Dict, Iterable, Optional, Tuple
+
+import dns.resolver
+
+from app.services.dns_resolver import AsyncResolver, resolver as default_resolver
+
+Query = Tuple[str, str]
+
+
+class QueryPlan:
+    """Resolver for one check that shares each answer between its consumers.
+
+    Answers and exceptions (NXDOMAIN, NoAnswer, timeouts) are kept for the
+    life of the plan and handed to every caller asking for the same pair.
+    A caller that goes away doesn't cancel a query others may still need;
+    queries still outstanding when the check is done are cancelled by
+    ``close``.
+    """
+
+    def __init__(self, resolver: Optional[AsyncResolver] = None) -> None:
+        self.resolver = resolver or default_resolver
+        self.requests = 0
+        self._queries: Dict[Query, asyncio.Task] = {}
+
+    @property
+    def queries(self) -> int:
+        """Distinct pairs actually sent to the resolver."""
+        return len(self._queries)
+
+    @staticmethod
+    def _key(name: str, rdtype: str) -> Query:
+        return name.lower().rstrip("."), rdtype.upper()
+
+    def add(self, name: str, rdtype: str) -> asyncio.Task:
+        key = self._key(name, rdtype)
+        task = self._queries.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.resolver.resolve(*key))
+            # Mark the exception retrieved even if nobody ends up asking
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._queries[key] = task
+        return task
+
+    def prefetch(self, queries: Iterable[Query]) -> None:
+        """Start the given pairs now, concurrently."""
+        for name, rdtype in queries:
+            self.add(name, rdtype)
+
+    async def resolve(self, qname: str, rdtype: str) -> dns.resolver.Answer:
+        self.requests += 1
+        return await asyncio.shield(self.add(qname, rdtype))
+
+    def close(self) -> None:
+        """Cancel the queries no caller is waiting on any more."""
+        for task in self._queries.values():
+            task.cancel()
@@ -0,0 +1,199 @@
+import asyncio
+import json
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.domain import Domain
+from app.services.check_engine import CheckRequest
+from app.services.check_history import record_history
+from app.services.dns_checker import DNSChecker
+
+logger = logging.getLogger(__name__)
+
+
+def next_check_at(check_result: dict, now: Optional[datetime] = None) -> datetime:
+    """When a domain should next be checked, given its latest check result.
+
+    The interval is the smallest TTL observed in the check, clamped to
+    ``RECHECK_MIN_INTERVAL``/``RECHECK_MAX_INTERVAL`` and jittered so domains
+    checked together don't come due together.
+    """
+    interval = check_result.get("min_ttl") or settings.RECHECK_MAX_INTERVAL
+    interval = min(
+        max(interval, settings.RECHECK_MIN_INTERVAL), settings.RECHECK_MAX_INTERVAL
+    )
+    jitter = settings.RECHECK_JITTER
+    interval *= random.uniform(1 - jitter, 1 + jitter)
+    return (now or datetime.utcnow()) + timedelta(seconds=interval)
+
+
+def result_row(
+    domain_id: int,
+    check_result: dict,
+    previous_hash: Optional[str] = None,
+) -> dict:
+    """Parameters for a bulk ``update(Domain)`` storing one check result."""
+    return {
+        "id": domain_id,
+        "next_check_at": next_check_at(check_result),
+        **Domain.check_result_values(check_result, previous_hash),
+    }
+
+
+async def store_results(
+    db: AsyncSession,
+    results: List[Tuple[int, dict]],
+) -> None:
+    """Write ``(domain_id, check_result)`` results in bulk.
+
+    Each result is compared with the domain's ``result_hash`` as read (and,
+    on Postgres, locked) in this transaction, so a result stored by another
+    check since the domain was picked up is neither overwritten with
+    timestamps only nor added to the history twice. Unchanged results only
+    write the check timestamps, so rows are grouped by the columns they write
+    and each group is one executemany UPDATE. Changed outcomes are added to
+    the history first, in the same transaction. Domains deleted meanwhile are
+    skipped.
+    """
+    if not results:
+        return
+    result = await db.execute(
+        select(Domain.id, Domain.result_hash)
+        .where(Domain.id.in_([domain_id for domain_id, _ in results]))
+        .order_by(Domain.id)
+        .with_for_update()
+    )
+    stored = dict(result.all())
+    groups: Dict[FrozenSet[str], List[dict]] = {}
+    changed: List[Tuple[int, dict]] = []
+    for domain_id, check_result in results:
+        if domain_id not in stored:
+            continue
+        row = result_row(domain_id, check_result, stored[domain_id])
+        groups.setdefault(frozenset(row), []).append(row)
+        if "result_hash" in row:
+            changed.append((domain_id, check_result))
+    await record_history(db, changed)
+    for rows in groups.values():
+        await db.execute(update(Domain), rows)
+
+
+class RecheckScheduler:
+    """Re-checks due domains in the background for the app's lifetime.
+
+    Due domains are read through the ``next_check_at`` index in batches of
+    ``RECHECK_BATCH_SIZE``; at most ``RECHECK_CONCURRENCY`` checks run at once
+    and each batch's results are written back with one bulk UPDATE.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        # Spread out replicas/workers that were started at the same moment
+        await asyncio.sleep(random.uniform(0, settings.RECHECK_POLL_INTERVAL))
+        scheduled = False
+        while True:
+            try:
+                if not scheduled:
+                    # Retried on the next round if the database isn't reachable yet
+                    await self.schedule_unscheduled()
+                    scheduled = True
+                checked = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Scheduled re-check batch failed")
+                checked = 0
+            if checked < settings.RECHECK_BATCH_SIZE:
+                await asyncio.sleep(settings.RECHECK_POLL_INTERVAL)
+
+    async def schedule_unscheduled(self) -> None:
+        """Make domains that have never been scheduled due now."""
+        async with self.session_factory() as db:
+            await db.execute(
+                update(Domain)
+                .where(Domain.next_check_at.is_(None))
+                .values(next_check_at=datetime.utcnow(), updated_at=Domain.updated_at)
+            )
+            await db.commit()
+
+    async def due_domains(self, limit: int) -> List[Tuple[int, str, CheckRequest]]:
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(
+                    Domain.id,
+                    Domain.domain_name,
+                    Domain.dkim_selectors,
+                    Domain.last_checked_at,
+                )
+                .where(Domain.next_check_at <= datetime.utcnow())
+                .order_by(Domain.next_check_at)
+                .limit(limit)
+            )
+            # Only domains never checked before sweep for DKIM selectors
+            return [
+                (domain_id, name, CheckRequest(
+                    name,
+                    dkim_selectors=json.loads(selectors or "[]"),
+                    discover_dkim=last_checked_at is None,
+                ))
+                for domain_id, name, selectors, last_checked_at in result.all()
+            ]
+
+    async def run_once(self) -> int:
+        """Check one batch of due domains; returns how many were checked."""
+        due = await self.due_domains(settings.RECHECK_BATCH_SIZE)
+        if not due:
+            return 0
+        checks: List[Optional[dict]] = [None] * len(due)
+        async for index, check_result, error in DNSChecker.check_many(
+            [request for _, _, request in due],
+            settings.RECHECK_CONCURRENCY,
+        ):
+            if error is not None:
+                logger.error(
+                    "Scheduled check of %s failed", due[index][1], exc_info=error
+                )
+            checks[index] = check_result
+        results = [
+            (domain_id, check_result)
+            for (domain_id, _, _), check_result in zip(due, checks)
+            if check_result is not None
+        ]
+        retry_at = datetime.utcnow() + timedelta(seconds=settings.RECHECK_MIN_INTERVAL)
+        failed = [
+            {"id": domain_id, "next_check_at": retry_at}
+            for (domain_id, _, _), check_result in zip(due, checks)
+            if check_result is None
+        ]
+        async with self.session_factory() as db:
+            await store_results(db, results)
+            if failed:
+                await db.execute(update(Domain), failed)
+            await db.commit()
+        return len(due)
+
+
+scheduler = RecheckScheduler()
@@ -0,0 +1,522 @@
+"""
+Asynchronous SPF (RFC 7208) evaluation.
+
+Each name's SPF record is compiled once into an ``SPFNode``: the parsed terms
+plus everything its own ``a``/``mx``/``exists`` mechanisms within the lookup
+limit resolve to. Nodes
+are memoized across domains for the TTL of the answers they were built from,
+so the include trees of large providers (``_spf.google.com``,
+``spf.protection.outlook.com``, ...) are fetched once per TTL rather than
+once per customer domain. Evaluating a domain walks the cached nodes,
+counting DNS-querying terms against the 10-lookup limit.
+"""
+import asyncio
+import ipaddress
+import time
+from collections import OrderedDict
+from typing import Awaitable, Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple, Union
+
+import dns.exception
+import dns.resolver
+
+from app.core.config import settings
+from app.core.metrics import register_cache
+from app.services.dns_resolver import AsyncResolver, answer_ttl, resolver as default_resolver
+from app.services.singleflight import SingleFlight
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+LOOKUP_LIMIT = 10
+VOID_LOOKUP_LIMIT = 2
+MX_LIMIT = 10
+
+QUALIFIERS = {"+": "pass", "-": "fail", "~": "softfail", "?": "neutral"}
+# Mechanisms and modifiers that cost one DNS lookup each (RFC 7208 4.6.4)
+LOOKUP_TERMS = {"include", "a", "mx", "ptr", "exists", "redirect"}
+
+
+class SPFError(Exception):
+    """An SPF ``permerror`` (``temporary=False``) or ``temperror``."""
+
+    def __init__(self, message: str, temporary: bool = False) -> None:
+        super().__init__(message)
+        self.temporary = temporary
+
+    @property
+    def result(self) -> str:
+        return "temperror" if self.temporary else "permerror"
+
+
+class Term(NamedTuple):
+    qualifier: str
+    mechanism: str
+    domain: Optional[str] = None
+    cidr4: int = 32
+    cidr6: int = 128
+    network: Optional[Network] = None
+
+
+class SPFRecord(NamedTuple):
+    text: str
+    terms: Tuple[Term, ...]
+    redirect: Optional[str] = None
+    exp: Optional[str] = None
+
+
+def _split_cidr(value: str) -> Tuple[str, int, int]:
+    """Split ``domain/cidr4//cidr6`` (both lengths optional)."""
+    cidr4, cidr6 = 32, 128
+    if "//" in value:
+        value, v6 = value.split("//", 1)
+        cidr6 = int(v6)
+    if "/" in value:
+        value, v4 = value.split("/", 1)
+        cidr4 = int(v4)
+    if not 0 <= cidr4 <= 32 or not 0 <= cidr6 <= 128:
+        raise ValueError("CIDR length out of range")
+    return value, cidr4, cidr6
+
+
+def parse_record(text: str) -> SPFRecord:
+    """Compile an SPF record; raises ``SPFError`` (permerror) if malformed."""
+    parts = text.split()
+    if not parts or parts[0].lower() != "v=spf1":
+        raise SPFError("Not an SPF record")
+    terms: List[Term] = []
+    modifiers: Dict[str, str] = {}
+    for part in parts[1:]:
+        name, sep, value = part.partition("=")
+        if sep and name and name[0].isalpha() and ":" not in name and "/" not in name:
+            name = name.lower()
+            if name in modifiers and name in ("redirect", "exp"):
+                raise SPFError(f"Duplicate {name}= modifier")
+            # Unknown modifiers are ignored
+            modifiers[name] = value
+            continue
+
+        qualifier = "+"
+        if part[0] in QUALIFIERS:
+            qualifier, part = part[0], part[1:]
+        mechanism, _, value = part.partition(":")
+        mechanism = mechanism.lower()
+        try:
+            if mechanism in ("ip4", "ip6") and value:
+                network = ipaddress.ip_network(value, strict=False)
+                if (network.version == 4) != (mechanism == "ip4"):
+                    raise ValueError(f"{value} is not an {mechanism} network")
+                terms.append(Term(qualifier, mechanism, network=network))
+            elif "/" in mechanism and mechanism.split("/", 1)[0] in ("a", "mx"):
+                # "a/24" or "mx//64": CIDR lengths without a domain
+                mechanism, cidr4, cidr6 = _split_cidr(mechanism)
+                terms.append(Term(qualifier, mechanism, None, cidr4, cidr6))
+            elif mechanism in ("a", "mx"):
+                domain, cidr4, cidr6 = _split_cidr(value) if value else (None, 32, 128)
+                terms.append(Term(qualifier, mechanism, domain or None, cidr4, cidr6))
+            elif mechanism in ("include", "exists") and value:
+                terms.append(Term(qualifier, mechanism, value))
+            elif mechanism == "ptr":
+                terms.append(Term(qualifier, mechanism, value or None))
+            elif mechanism == "all" and not value:
+                terms.append(Term(qualifier, mechanism))
+            else:
+                raise ValueError(f"Unknown or incomplete mechanism {part!r}")
+        except ValueError as e:
+            raise SPFError(str(e))
+    return SPFRecord(text, tuple(terms), modifiers.get("redirect"), modifiers.get("exp"))
+
+
+def _has_macro(domain: Optional[str]) -> bool:
+    return domain is not None and "%" in domain
+
+
+class SPFNode(NamedTuple):
+    """The compiled SPF record of one name and its resolved mechanisms.
+
+    ``networks``, ``exists`` and ``voids`` (terms whose lookup found nothing)
+    refer to terms by index; ``lookups`` counts the node's own DNS-querying
+    terms, not those of the records it includes.
+    """
+    name: str
+    record: Optional[SPFRecord] = None
+    presentation: Optional[str] = None
+    networks: Dict[int, List[Network]] = {}
+    exists: Dict[int, bool] = {}
+    voids: FrozenSet[int] = frozenset()
+    lookups: int = 0
+    ttl: int = 0
+    error: Optional[SPFError] = None
+
+
+class SPFResult(NamedTuple):
+    """Outcome of evaluating a domain's SPF policy.
+
+    ``result`` is ``"none"`` when the domain has no SPF record, ``"permerror"``
+    or ``"temperror"`` when evaluation fails and otherwise the qualifier of
+    the policy's final ``all`` (``"neutral"`` if there is none). ``ip4`` and
+    ``ip6`` are the flattened, collapsed ranges of every ``pass`` mechanism
+    reachable through includes and redirects, regardless of term order.
+    """
+    domain: str
+    record: Optional[str]
+    result: str
+    lookups: int
+    void_lookups: int
+    ip4: List[str]
+    ip6: List[str]
+    ttl: Optional[int]
+    error: Optional[str] = None
+    warnings: Tuple[str, ...] = ()
+
+
+class _Walk:
+    """Lookup counters shared by every node visited in one evaluation."""
+
+    def __init__(self) -> None:
+        self.lookups = 0
+        self.void_lookups = 0
+        self.ttl: Optional[int] = None
+        self.warnings: List[str] = []
+
+    def add(self, lookups: int = 0, void_lookups: int = 0, ttl: Optional[int] = None) -> None:
+        self.lookups += lookups
+        self.void_lookups += void_lookups
+        if ttl is not None:
+            self.ttl = ttl if self.ttl is None else min(self.ttl, ttl)
+        if self.lookups > LOOKUP_LIMIT:
+            raise SPFError(f"More than {LOOKUP_LIMIT} DNS lookups")
+        if self.void_lookups > VOID_LOOKUP_LIMIT:
+            raise SPFError(f"More than {VOID_LOOKUP_LIMIT} void DNS lookups")
+
+
+class SPFEvaluator:
+    """Evaluates SPF policies, sharing compiled nodes between domains.
+
+    At most ``max_entries`` nodes are kept, each for the smallest TTL of the
+    answers it was built from, capped at ``max_ttl``. Temporary failures are
+    not cached.
+    """
+
+    def __init__(
+        self,
+        resolver: Optional[AsyncResolver] = None,
+        max_entries: int = 10_000,
+        max_ttl: int = 3600,
+    ) -> None:
+        self.resolver = resolver or default_resolver
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.nodes: "OrderedDict[str, Tuple[float, SPFNode]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._flights = SingleFlight()
+
+    async def node(self, name: str, resolver: Optional[AsyncResolver] = None) -> SPFNode:
+        """The compiled node for ``name``, from the cache when still fresh."""
+        name = name.lower().rstrip(".")
+        entry = self.nodes.get(name)
+        if entry is not None and entry[0] > time.time():
+            self.nodes.move_to_end(name)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return await self._flights.do(
+            name, lambda: self._build(name, resolver or self.resolver)
+        )
+
+    async def _build(self, name: str, resolver: AsyncResolver) -> SPFNode:
+        node = await _build_node(name, resolver, self.max_ttl)
+        if node.error is None or not node.error.temporary:
+            self.nodes[name] = (time.time() + node.ttl, node)
+            self.nodes.move_to_end(name)
+            while len(self.nodes) > self.max_entries:
+                self.nodes.popitem(last=False)
+        return node
+
+    async def evaluate(
+        self, domain: str, resolver: Optional[AsyncResolver] = None
+    ) -> SPFResult:
+        """Evaluate ``domain``'s policy and flatten its authorized ranges."""
+        walk = _Walk()
+        ranges: List[Network] = []
+        record = None
+        try:
+            node = await self.node(domain, resolver)
+            record = node.presentation
+            if node.record is None and node.error is None:
+                result = "none"
+            else:
+                result = await self._expand(node, resolver, walk, ranges, set())
+        except SPFError as e:
+            return self._result(domain, record, e.result, walk, [], str(e))
+        return self._result(domain, record, result, walk, ranges)
+
+    async def _expand(
+        self,
+        node: SPFNode,
+        resolver: Optional[AsyncResolver],
+        walk: _Walk,
+        ranges: List[Network],
+        path: Set[str],
+    ) -> str:
+        """Collect ``node``'s pass ranges; returns its final ``all`` result.
+
+        Every DNS-querying term counts towards the lookup limit, whether or
+        not an evaluation for a particular sender would reach it.
+        """
+        path = self._enter(node, walk, path)
+        walk.add(node.lookups, len(node.voids))
+
+        final = None
+        for index, term in enumerate(node.record.terms):
+            if term.mechanism == "include":
+                if _has_macro(term.domain):
+                    walk.warnings.append(f"include:{term.domain} uses macros, not expanded")
+                    continue
+                child: List[Network] = []
+                await self._expand(
+                    await self.node(term.domain, resolver), resolver, walk, child, path
+                )
+                if term.qualifier == "+":
+                    ranges.extend(child)
+            elif term.mechanism == "all":
+                final = QUALIFIERS[term.qualifier]
+            elif term.mechanism == "ptr":
+                walk.warnings.append("ptr mechanism is deprecated and not expanded")
+            elif term.qualifier == "+":
+                ranges.extend(node.networks.get(index, []))
+
+        redirect = node.record.redirect
+        if final is None and redirect:
+            if _has_macro(redirect):
+                walk.warnings.append(f"redirect={redirect} uses macros, not expanded")
+            else:
+                return await self._expand(
+                    await self.node(redirect, resolver), resolver, walk, ranges, path
+                )
+        return final or "neutral"
+
+    async def check_host(
+        self,
+        ip: str,
+        domain: str,
+        resolver: Optional[AsyncResolver] = None,
+    ) -> str:
+        """The SPF result for mail from ``domain`` sent by ``ip``.
+
+        Mechanisms whose domain uses macros and ``ptr`` never match.
+        """
+        address = ipaddress.ip_address(ip)
+        walk = _Walk()
+        try:
+            node = await self.node(domain, resolver)
+            if node.record is None and node.error is None:
+                return "none"
+            return await self._check(address, node, resolver, walk, set())
+        except SPFError as e:
+            return e.result
+
+    async def _check(
+        self,
+        address: Union[ipaddress.IPv4Address, ipaddress.IPv6Address],
+        node: SPFNode,
+        resolver: Optional[AsyncResolver],
+        walk: _Walk,
+        path: Set[str],
+    ) -> str:
+        path = self._enter(node, walk, path)
+        for index, term in enumerate(node.record.terms):
+            # Lookups count as they are reached, as in RFC 7208 4.6.4
+            if term.mechanism in LOOKUP_TERMS:
+                walk.add(1, index in node.voids)
+            if term.mechanism == "all":
+                matched = True
+            elif term.mechanism == "include":
+                matched = not _has_macro(term.domain) and await self._check(
+                    address, await self.node(term.domain, resolver), resolver, walk, path
+                ) == "pass"
+            elif term.mechanism == "exists":
+                matched = node.exists.get(index, False)
+            else:
+                matched = any(address in net for net in node.networks.get(index, []))
+            if matched:
+                return QUALIFIERS[term.qualifier]
+
+        redirect = node.record.redirect
+        if redirect and not _has_macro(redirect):
+            walk.add(1)
+            return await self._check(
+                address, await self.node(redirect, resolver), resolver, walk, path
+            )
+        return "neutral"
+
+    @staticmethod
+    def _enter(node: SPFNode, walk: _Walk, path: Set[str]) -> Set[str]:
+        if node.error is not None:
+            raise node.error
+        if node.record is None:
+            raise SPFError(f"{node.name} has no SPF record")
+        if node.name in path:
+            raise SPFError(f"Include loop through {node.name}")
+        walk.add(ttl=node.ttl)
+        return path | {node.name}
+
+    @staticmethod
+    def _result(
+        domain: str,
+        record: Optional[str],
+        result: str,
+        walk: _Walk,
+        ranges: List[Network],
+        error: Optional[str] = None,
+    ) -> SPFResult:
+        v4 = ipaddress.collapse_addresses(n for n in ranges if n.version == 4)
+        v6 = ipaddress.collapse_addresses(n for n in ranges if n.version == 6)
+        return SPFResult(
+            domain=domain,
+            record=record,
+            result=result,
+            lookups=walk.lookups,
+            void_lookups=walk.void_lookups,
+            ip4=[str(n) for n in v4],
+            ip6=[str(n) for n in v6],
+            ttl=walk.ttl,
+            error=error,
+            warnings=tuple(dict.fromkeys(walk.warnings)),
+        )
+
+
+async def _gather(*aws: Awaitable) -> list:
+    """``asyncio.gather`` that lets every lookup finish before re-raising."""
+    results = await asyncio.gather(*aws, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def _resolve(
+    resolver: AsyncResolver, name: str, rdtype: str
+) -> Tuple[Optional[dns.resolver.Answer], bool]:
+    """Answers for a lookup and whether it was void (NXDOMAIN or no answer)."""
+    try:
+        return await resolver.resolve(name, rdtype), False
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        return None, True
+    except (dns.exception.Timeout, dns.resolver.NoNameservers) as e:
+        raise SPFError(f"DNS lookup of {name} {rdtype} failed: {e}", temporary=True)
+    except dns.exception.DNSException as e:
+        raise SPFError(f"DNS lookup of {name} {rdtype} failed: {e}")
+
+
+async def _addresses(
+    resolver: AsyncResolver, name: str, cidr4: int, cidr6: int, ttls: List[int]
+) -> Tuple[List[Network], bool]:
+    (a, void_a), (aaaa, void_aaaa) = await _gather(
+        _resolve(resolver, name, "A"), _resolve(resolver, name, "AAAA")
+    )
+    networks: List[Network] = []
+    for answers, cidr in ((a, cidr4), (aaaa, cidr6)):
+        if answers is not None:
+            ttls.append(answer_ttl(answers))
+            networks.extend(
+                ipaddress.ip_network(f"{rdata.address}/{cidr}", strict=False)
+                for rdata in answers
+            )
+    return networks, void_a and void_aaaa
+
+
+def _spf_texts(answers: dns.resolver.Answer) -> List[Tuple[str, str]]:
+    """``(text, presentation)`` of each TXT record that is an SPF record."""
+    found = []
+    for rdata in answers:
+        text = b"".join(rdata.strings)
+        if text[:6].lower() == b"v=spf1" and text[6:7] in (b"", b" "):
+            found.append((text.decode("utf-8", "replace"), str(rdata)))
+    return found
+
+
+async def _build_node(name: str, resolver: AsyncResolver, max_ttl: int) -> SPFNode:
+    try:
+        answers, _ = await _resolve(resolver, name, "TXT")
+    except SPFError as e:
+        return SPFNode(name, error=e)
+    if answers is None:
+        return SPFNode(name, ttl=min(max_ttl, settings.DNS_CACHE_NEGATIVE_MAX_TTL))
+
+    ttls = [answer_ttl(answers)]
+    found = _spf_texts(answers)
+    if not found:
+        return SPFNode(name, ttl=min(ttls[0], max_ttl))
+    presentation = found[0][1]
+    if len(found) > 1:
+        error = SPFError(f"{name} has more than one SPF record")
+        return SPFNode(name, presentation=presentation, ttl=min(ttls[0], max_ttl), error=error)
+    try:
+        record = parse_record(found[0][0])
+    except SPFError as e:
+        return SPFNode(name, presentation=presentation, ttl=min(ttls[0], max_ttl), error=e)
+
+    networks: Dict[int, List[Network]] = {}
+    exists: Dict[int, bool] = {}
+    voids: Set[int] = set()
+
+    async def resolve_term(index: int, term: Term) -> None:
+        target = term.domain or name
+        if term.mechanism in ("ip4", "ip6"):
+            networks[index] = [term.network]
+        elif _has_macro(target):
+            return
+        elif term.mechanism == "a":
+            networks[index], void = await _addresses(
+                resolver, target, term.cidr4, term.cidr6, ttls
+            )
+            if void:
+                voids.add(index)
+        elif term.mechanism == "mx":
+            answers, void = await _resolve(resolver, target, "MX")
+            if answers is None:
+                networks[index] = []
+                voids.add(index)
+                return
+            ttls.append(answer_ttl(answers))
+            hosts = [str(rdata.exchange) for rdata in answers if str(rdata.exchange) != "."]
+            if len(hosts) > MX_LIMIT:
+                raise SPFError(f"{target} has more than {MX_LIMIT} MX hosts")
+            found = await _gather(*(
+                _addresses(resolver, host, term.cidr4, term.cidr6, ttls) for host in hosts
+            ))
+            networks[index] = [net for host_networks, _ in found for net in host_networks]
+        elif term.mechanism == "exists":
+            answers, void = await _resolve(resolver, target, "A")
+            exists[index] = answers is not None
+            if void:
+                voids.add(index)
+            else:
+                ttls.append(answer_ttl(answers))
+
+    querying = [i for i, term in enumerate(record.terms) if term.mechanism in LOOKUP_TERMS]
+    # A walk fails on reaching the first term past the lookup limit, so
+    # neither it nor anything after it is ever evaluated
+    reachable = record.terms
+    if len(querying) > LOOKUP_LIMIT:
+        reachable = record.terms[:querying[LOOKUP_LIMIT]]
+    lookups = len(querying)
+    # redirect= is ignored when there is an "all" mechanism (RFC 7208 6.1)
+    if record.redirect is not None and not any(t.mechanism == "all" for t in record.terms):
+        lookups += 1
+    ttl = min(min(ttls), max_ttl)
+    try:
+        await _gather(*(resolve_term(index, term) for index, term in enumerate(reachable)))
+    except SPFError as e:
+        return SPFNode(name, record, presentation, lookups=lookups, ttl=ttl, error=e)
+    return SPFNode(
+        name, record, presentation, networks, exists, frozenset(voids), lookups,
+        min(min(ttls), max_ttl),
+    )
+
+
+spf_evaluator = SPFEvaluator(
+    max_entries=settings.SPF_CACHE_MAX_ENTRIES,
+    max_ttl=settings.SPF_CACHE_MAX_TTL,
+)
+register_cache("spf", lambda: (spf_evaluator.hits, spf_evaluator.misses))
@@ -0,0 +1,246 @@
+"""
+Distributed check worker.
+
+    python -m app.worker [--concurrency N] [--batch-size N] [--once]
+
+Any number of workers, on any number of nodes, share the ``check_jobs``
+table. Each worker enqueues jobs for domains whose ``next_check_at`` has
+passed, claims a batch of jobs with ``SELECT ... FOR UPDATE SKIP LOCKED``
+and a time-limited lease, runs the checks with ``DNSChecker`` and writes the
+results back in bulk. Workers never wait on each other's rows, so throughput
+grows with the number of workers.
+
+On SQLite (aiosqlite), which has no row locks, the claim falls back on the
+conditional lease UPDATE: writes are serialized, so a job can only be leased
+by one worker at a time.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import delete, exists, or_, select, update
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal, engine, insert_ignoring_conflicts
+from app.models.check_job import CheckJob
+from app.models.domain import Domain
+from app.models.user import Base
+from app.services.check_engine import CheckRequest
+from app.services.dns_checker import DNSChecker
+from app.services.scheduler import store_results
+
+logger = logging.getLogger(__name__)
+
+class Job(NamedTuple):
+    id: int
+    domain_id: int
+    domain_name: str
+    dkim_selectors: Optional[str]
+    last_checked_at: Optional[datetime]
+    attempts: int
+
+
+class CheckWorker:
+    def __init__(
+        self,
+        worker_id: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        session_factory=AsyncSessionLocal,
+    ):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.batch_size = batch_size or settings.WORKER_BATCH_SIZE
+        self.session_factory = session_factory
+        self.concurrency = concurrency or settings.WORKER_CONCURRENCY
+
+    async def enqueue_due(self) -> int:
+        """Create jobs for due domains that don't have one yet.
+
+        Domains another worker enqueued in the meantime are skipped, so the
+        rest are still enqueued when workers race.
+        """
+        now = datetime.utcnow()
+        due = (
+            select(Domain.id, Domain.next_check_at)
+            .where(
+                Domain.next_check_at <= now,
+                ~exists().where(CheckJob.domain_id == Domain.id),
+            )
+            .order_by(Domain.next_check_at)
+            .limit(self.batch_size * 10)
+        )
+        async with self.session_factory() as db:
+            result = await db.execute(
+                insert_ignoring_conflicts(db, CheckJob, ["domain_id"])
+                .from_select(["domain_id", "run_at"], due)
+            )
+            await db.commit()
+        return max(result.rowcount or 0, 0)
+
+    async def claim(self) -> List[Job]:
+        """Lease up to ``batch_size`` runnable jobs to this worker."""
+        now = datetime.utcnow()
+        claimable = or_(CheckJob.locked_until.is_(None), CheckJob.locked_until < now)
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(
+                    CheckJob.id,
+                    CheckJob.domain_id,
+                    Domain.domain_name,
+                    Domain.dkim_selectors,
+                    Domain.last_checked_at,
+                )
+                .join(Domain, Domain.id == CheckJob.domain_id)
+                .where(CheckJob.run_at <= now, claimable)
+                .order_by(CheckJob.run_at)
+                .limit(self.batch_size)
+                .with_for_update(of=CheckJob, skip_locked=True)
+            )
+            candidates = {row[0]: tuple(row) for row in result.all()}
+            if not candidates:
+                await db.rollback()
+                return []
+            # The lease condition is repeated so that, without row locks, only
+            # one of several workers racing for a job gets it
+            result = await db.execute(
+                update(CheckJob)
+                .where(CheckJob.id.in_(candidates), claimable)
+                .values(
+                    locked_by=self.worker_id,
+                    locked_until=now + timedelta(seconds=settings.WORKER_LEASE_SECONDS),
+                    attempts=CheckJob.attempts + 1,
+                )
+                .returning(CheckJob.id, CheckJob.attempts)
+            )
+            claimed = [
+                Job(*candidates[job_id], attempts) for job_id, attempts in result.all()
+            ]
+            await db.commit()
+        return claimed
+
+    async def _check_all(
+        self, jobs: List[Job]
+    ) -> List[Tuple[Job, Optional[dict], Optional[str]]]:
+        outcomes = [(job, None, None) for job in jobs]
+        requests = [
+            CheckRequest(
+                job.domain_name,
+                dkim_selectors=json.loads(job.dkim_selectors or "[]"),
+                # Only domains never checked before sweep for DKIM selectors
+                discover_dkim=job.last_checked_at is None,
+            )
+            for job in jobs
+        ]
+        async for index, check_result, error in DNSChecker.check_many(
+            requests, self.concurrency
+        ):
+            job = jobs[index]
+            if error is not None:
+                logger.error("Check of %s failed", job.domain_name, exc_info=error)
+                outcomes[index] = (job, None, str(error))
+            else:
+                outcomes[index] = (job, check_result, None)
+        return outcomes
+
+    async def process(self, jobs: List[Job]) -> None:
+        """Run the checks for claimed jobs and write all results back at once."""
+        outcomes = await self._check_all(jobs)
+
+        results = [
+            (job.domain_id, result)
+            for job, result, _ in outcomes if result
+        ]
+        done = [job.id for job, result, _ in outcomes if result]
+        failed = [(job, error) for job, result, error in outcomes if not result]
+
+        now = datetime.utcnow()
+        retry = [
+            (job, error) for job, error in failed
+            if job.attempts < settings.WORKER_MAX_ATTEMPTS
+        ]
+        given_up = [
+            job for job, _ in failed if job.attempts >= settings.WORKER_MAX_ATTEMPTS
+        ]
+        async with self.session_factory() as db:
+            if results:
+                await store_results(db, results)
+            if done or given_up:
+                # Jobs that keep failing are dropped until the domain is next due
+                await db.execute(
+                    delete(CheckJob).where(
+                        CheckJob.id.in_(done + [job.id for job in given_up]),
+                        CheckJob.locked_by == self.worker_id,
+                    )
+                )
+            if given_up:
+                retry_at = now + timedelta(seconds=settings.RECHECK_MIN_INTERVAL)
+                await db.execute(update(Domain), [
+                    {"id": job.domain_id, "next_check_at": retry_at} for job in given_up
+                ])
+            for job, error in retry:
+                # Back off linearly with the number of attempts so far
+                backoff = timedelta(seconds=settings.WORKER_POLL_INTERVAL * job.attempts)
+                await db.execute(
+                    update(CheckJob)
+                    .where(CheckJob.id == job.id, CheckJob.locked_by == self.worker_id)
+                    .values(
+                        locked_by=None,
+                        locked_until=None,
+                        last_error=error,
+                        run_at=now + backoff,
+                    )
+                )
+            await db.commit()
+
+    async def run_once(self) -> int:
+        await self.enqueue_due()
+        jobs = await self.claim()
+        if jobs:
+            await self.process(jobs)
+        return len(jobs)
+
+    async def run(self, stop: asyncio.Event) -> None:
+        logger.info("Check worker %s started", self.worker_id)
+        while not stop.is_set():
+            try:
+                claimed = await self.run_once()
+            except Exception:
+                logger.exception("Worker iteration failed")
+                claimed = 0
+            if claimed < self.batch_size:
+                try:
+                    await asyncio.wait_for(stop.wait(), settings.WORKER_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        logger.info("Check worker %s stopped", self.worker_id)
+
+
+async def main(args: argparse.Namespace) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    worker = CheckWorker(batch_size=args.batch_size, concurrency=args.concurrency)
+    if args.once:
+        await worker.run_once()
+        return
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await worker.run(stop)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a DNS check worker")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, default=None)
+    parser.add_argument("--once", action="store_true", help="process one batch and exit")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,247 @@
+"""
+End-to-end API load test: mixed traffic against the app, in process.
+
+Seeds a throwaway SQLite database (through aiosqlite) with ``--users``
+users owning ``--domains-per-user`` checked domains each, and serves the
+app from ``app.main`` over an in-process ASGI client, with DNS answered by a
+local stub server loaded with the same synthetic zones as
+``benchmarks.check_throughput``. ``--concurrency`` virtual users then each
+log in and, for ``--duration`` seconds, pick requests by the ``--mix``
+weights:
+
+- ``login``: ``POST /api/v1/auth/login``
+- ``list``: ``GET /api/v1/domains/``
+- ``get``: ``GET /api/v1/domains/{id}``
+- ``check``: ``POST /api/v1/domains/{id}/check``
+
+The JSON report has, per endpoint, requests/sec, error count, latency
+percentiles and database statements per request, plus event-loop lag
+percentiles measured by a ticker during the run.
+
+    python -m benchmarks.api_load --users 20 --concurrency 50 --duration 20
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "api_load.db")
+os.environ.setdefault("POSTGRES_USER", "bench")
+os.environ.setdefault("POSTGRES_PASSWORD", "bench")
+os.environ.setdefault("POSTGRES_DB", "bench")
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite+aiosqlite:///{DB_PATH}"
+
+import httpx  # noqa: E402
+from sqlalchemy import event, insert, select  # noqa: E402
+
+from app.core.security import pwd_context  # noqa: E402
+from app.db.session import AsyncSessionLocal, engine  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models.domain import Domain  # noqa: E402
+from app.models.user import Base, User  # noqa: E402
+from app.services import dns_checker  # noqa: E402
+from app.services.dns_checker import DNSChecker  # noqa: E402
+from app.services.dns_resolver import AsyncResolver  # noqa: E402
+from app.services.mx import MXHostResolver  # noqa: E402
+from app.services.scheduler import store_results  # noqa: E402
+from app.services.spf import SPFEvaluator  # noqa: E402
+from benchmarks.hedged_queries import summarize  # noqa: E402
+from benchmarks.stub_dns import StubDNSProcess, synthetic_zones  # noqa: E402
+
+PASSWORD = "correct horse battery staple"
+ENDPOINTS = ["login", "list", "get", "check"]
+# The endpoint whose request is running, for attributing SQL statements
+current_endpoint = contextvars.ContextVar("current_endpoint", default=None)
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}")
+        mix[name] = float(weight)
+    return mix
+
+
+def seeded_result(name: str) -> dict:
+    """A plausible stored check, so reads return full rows."""
+    return {
+        "domain_name": name,
+        "check_timestamp": datetime.utcnow(),
+        "dmarc_record": "v=DMARC1; p=reject",
+        "dmarc_status": True,
+        "spf_record": "v=spf1 include:_spf.mailhost-a.test ~all",
+        "spf_status": True,
+        "dkim_record": None,
+        "dkim_status": False,
+        "mx_records": ["aspmx.mailhost-a.test."],
+        "mx_status": True,
+        "overall_status": False,
+        "check_summary": {
+            check: {"status": "valid", "message": "ok"} for check in ("dmarc", "spf", "mx")
+        },
+        "min_ttl": 3600,
+    }
+
+
+async def seed(users: int, domains_per_user: int) -> dict:
+    """Users (sharing one password hash) and their domains; returns
+    ``{email: [domain ids]}``."""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    hashed = pwd_context.hash(PASSWORD)
+    owned = {}
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(
+            insert(User).returning(User.id, User.email),
+            [{"email": f"user{i}@example.com", "hashed_password": hashed} for i in range(users)],
+        )
+        for n, (user_id, email) in enumerate(rows.all()):
+            start = n * domains_per_user
+            result = await db.execute(
+                insert(Domain).returning(Domain.id, Domain.domain_name),
+                [
+                    {"domain_name": f"customer{i}.test", "user_id": user_id}
+                    for i in range(start, start + domains_per_user)
+                ],
+            )
+            domains = [tuple(row) for row in result.all()]
+            await store_results(db, [(i, seeded_result(name)) for i, name in domains])
+            owned[email] = [domain_id for domain_id, _ in domains]
+        await db.commit()
+    return owned
+
+
+async def ticker(interval: float, lags: list, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def run(args) -> dict:
+    owned = await seed(args.users, args.domains_per_user)
+    emails = list(owned)
+    statements = Counter()
+    latencies = defaultdict(list)
+    errors = Counter()
+    rng = random.Random(args.seed)
+    names, weights = zip(*args.mix.items())
+
+    def count_statement(*_) -> None:
+        statements[current_endpoint.get()] += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load") as client:
+
+        async def call(endpoint: str, method: str, url: str, **kwargs) -> httpx.Response:
+            current_endpoint.set(endpoint)
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies[endpoint].append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors[endpoint, response.status_code] += 1
+            return response
+
+        async def login(email: str) -> dict:
+            response = await call(
+                "login", "POST", "/api/v1/auth/login",
+                json={"email": email, "password": PASSWORD},
+            )
+            if response.status_code != 200:
+                return {}
+            return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        async def virtual_user(n: int, deadline: float) -> None:
+            email = emails[n % len(emails)]
+            headers = await login(email)
+            while time.perf_counter() < deadline:
+                endpoint = rng.choices(names, weights)[0]
+                domain_id = rng.choice(owned[email])
+                if endpoint == "login" or not headers:
+                    headers = await login(email) or headers
+                elif endpoint == "list":
+                    await call("list", "GET", "/api/v1/domains/", headers=headers)
+                elif endpoint == "get":
+                    await call("get", "GET", f"/api/v1/domains/{domain_id}", headers=headers)
+                else:
+                    await call(
+                        "check", "POST", f"/api/v1/domains/{domain_id}/check", headers=headers
+                    )
+
+        event.listen(engine.sync_engine, "after_cursor_execute", count_statement)
+        lags: list = []
+        stop = asyncio.Event()
+        tick = asyncio.create_task(ticker(0.01, lags, stop))
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(virtual_user(n, deadline) for n in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await tick
+        event.remove(engine.sync_engine, "after_cursor_execute", count_statement)
+
+    lags.sort()
+    endpoints = {}
+    for endpoint in ENDPOINTS:
+        if not latencies[endpoint]:
+            continue
+        requests = len(latencies[endpoint])
+        endpoints[endpoint] = {
+            "requests": requests,
+            "requests_per_s": round(requests / elapsed, 1),
+            "errors": {
+                str(code): n for (name, code), n in errors.items() if name == endpoint
+            },
+            **summarize(latencies[endpoint]),
+            "statements_per_request": round(statements[endpoint] / requests, 2),
+        }
+    total = sum(len(values) for values in latencies.values())
+    return {
+        "users": args.users,
+        "domains": args.users * args.domains_per_user,
+        "concurrency": args.concurrency,
+        "mix": args.mix,
+        "elapsed_s": round(elapsed, 2),
+        "requests_per_s": round(total / elapsed, 1),
+        "endpoints": endpoints,
+        "loop_lag_ms": {
+            "p50": round(lags[len(lags) // 2] * 1000, 2),
+            "p99": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000, 2),
+            "max": round(lags[-1] * 1000, 2),
+        },
+    }
+
+
+def main(args) -> None:
+    zones = synthetic_zones(args.users * args.domains_per_user, seed=args.seed)
+    with StubDNSProcess(zones, delay=args.dns_latency) as server:
+        DNSChecker.resolver = AsyncResolver([server.address])
+        dns_checker.spf_evaluator = SPFEvaluator(DNSChecker.resolver)
+        dns_checker.mx_hosts = MXHostResolver(DNSChecker.resolver)
+        report = asyncio.run(run(args))
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--domains-per-user", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=50,
+                        help="virtual users sending requests back to back")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--mix", type=parse_mix, default="login=1,list=20,get=20,check=5",
+                        help="endpoint=weight, comma-separated")
+    parser.add_argument("--dns-latency", type=float, default=0.005)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
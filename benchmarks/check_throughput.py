@@ -0,0 +1,225 @@
+"""
+Offline check throughput through every entry point, against stub zones.
+
+A local stub server (UDP and TCP, in its own process) is loaded with ``--domains`` synthetic
+customer zones (``benchmarks.stub_dns.synthetic_zones``: DMARC, SPF with
+provider includes, DKIM under discovered selectors, MX hosts, and the usual
+gaps) and answers after ``--latency`` seconds, dropping ``--loss`` of UDP
+queries and truncating ``--truncate`` of UDP answers on top of those too
+long for UDP. Every domain is then checked through each ``--target`` at
+each ``--concurrency`` level, with cold caches:
+
+- ``check_all``: ``DNSChecker.check_all``, as a domain's first check runs it
+- ``src``: ``src.utils.dns_checker.check_domain``, one thread per concurrent check
+- ``http``: ``POST /api/v1/domains/{id}/check`` over a throwaway SQLite database
+
+Each run prints one JSON line (checks/sec, latency percentiles, DNS queries
+per check, failed checks) tagged with the git commit; ``--output`` appends
+the lines to a file, so runs on two commits can be compared.
+
+    python -m benchmarks.check_throughput --domains 300 --concurrency 1,10,50 --output bench.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "check_throughput.db")
+os.environ.setdefault("POSTGRES_USER", "bench")
+os.environ.setdefault("POSTGRES_PASSWORD", "bench")
+os.environ.setdefault("POSTGRES_DB", "bench")
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["DNS_CACHE_ENABLED"] = "false"
+
+import httpx  # noqa: E402
+from sqlalchemy import insert, select, update  # noqa: E402
+
+from app.db.session import AsyncSessionLocal, engine  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models.domain import Domain  # noqa: E402
+from app.models.user import Base, User  # noqa: E402
+from app.services import dns_checker  # noqa: E402
+from app.services.dns_checker import DNSChecker  # noqa: E402
+from app.services.dns_resolver import AsyncResolver  # noqa: E402
+from app.services.mx import MXHostResolver  # noqa: E402
+from app.services.spf import SPFEvaluator  # noqa: E402
+from benchmarks.hedged_queries import summarize  # noqa: E402
+from benchmarks.stub_dns import StubDNSProcess, synthetic_zones  # noqa: E402
+from src.utils.dns_checker import check_domain  # noqa: E402
+
+TARGETS = ["check_all", "src", "http"]
+EMAIL = "bench@example.com"
+PASSWORD = "correct horse battery staple"
+
+
+def failed(result: dict) -> bool:
+    if "check_summary" not in result:
+        return True
+    return any(
+        info["status"] in ("error", "timeout") for info in result["check_summary"].values()
+    )
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def reset(server: StubDNSProcess) -> None:
+    """Cold caches and fresh nameserver statistics for the next run."""
+    DNSChecker.resolver = AsyncResolver([server.address])
+    dns_checker.spf_evaluator = SPFEvaluator(DNSChecker.resolver)
+    dns_checker.mx_hosts = MXHostResolver(DNSChecker.resolver)
+
+
+async def run_check_all(names, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def check(name: str):
+        async with semaphore:
+            started = time.perf_counter()
+            result = await DNSChecker.check_all(name, discover_dkim=True)
+            return time.perf_counter() - started, failed(result)
+
+    return await asyncio.gather(*(check(name) for name in names))
+
+
+def run_src(names, concurrency: int):
+    def check(name: str):
+        started = time.perf_counter()
+        result = check_domain(name)
+        return time.perf_counter() - started, failed(result)
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(check, names))
+
+
+async def seed(names) -> None:
+    """The benchmark user and one domain row per name, reset to never
+    checked so that every run's checks are first checks, sweeping for DKIM
+    selectors, and store their full results."""
+    async with AsyncSessionLocal() as db:
+        user_id = await db.scalar(select(User.id).where(User.email == EMAIL))
+        if await db.scalar(select(Domain.id).limit(1)) is None:
+            await db.execute(insert(Domain), [
+                {"domain_name": name, "user_id": user_id} for name in names
+            ])
+        await db.execute(update(Domain).values(
+            dkim_selectors=None, last_checked_at=None, result_hash=None
+        ))
+        await db.commit()
+
+
+async def run_http(names, concurrency: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        credentials = {"email": EMAIL, "password": PASSWORD}
+        await client.post("/api/v1/auth/register", json=credentials)
+        response = await client.post("/api/v1/auth/login", json=credentials)
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        await seed(names)
+        async with AsyncSessionLocal() as db:
+            ids = (await db.scalars(select(Domain.id).order_by(Domain.id))).all()
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def check(domain_id: int):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(
+                    f"/api/v1/domains/{domain_id}/check", headers=headers
+                )
+                elapsed = time.perf_counter() - started
+                return elapsed, response.status_code != 200 or failed(response.json())
+
+        try:
+            return await asyncio.gather(*(check(domain_id) for domain_id in ids))
+        finally:
+            await engine.dispose()
+
+
+def run(target: str, concurrency: int, server: StubDNSProcess, names, args) -> dict:
+    reset(server)
+    before = server.stats()
+    started = time.perf_counter()
+    if target == "check_all":
+        outcomes = asyncio.run(run_check_all(names, concurrency))
+    elif target == "src":
+        outcomes = run_src(names, concurrency)
+    else:
+        outcomes = asyncio.run(run_http(names, concurrency))
+    elapsed = time.perf_counter() - started
+    after = server.stats()
+    checks = len(outcomes)
+    return {
+        "commit": args.commit,
+        "target": target,
+        "concurrency": concurrency,
+        "domains": checks,
+        "latency_s": args.latency,
+        "loss": args.loss,
+        "truncate": args.truncate,
+        "elapsed_s": round(elapsed, 2),
+        "checks_per_s": round(checks / elapsed, 1),
+        **summarize([latency for latency, _ in outcomes]),
+        "checks_failed": sum(failure for _, failure in outcomes),
+        "queries_per_check": round((after["queries"] - before["queries"]) / checks, 2),
+        "tcp_queries_per_check": round(
+            (after["tcp_queries"] - before["tcp_queries"]) / checks, 2
+        ),
+        "truncated": after["truncated"] - before["truncated"],
+    }
+
+
+def main(args) -> None:
+    args.commit = commit()
+    names = [f"customer{i}.test" for i in range(args.domains)]
+    server = StubDNSProcess(
+        synthetic_zones(args.domains, seed=args.seed, large_key_rate=args.large_keys),
+        delay=args.latency,
+        loss=args.loss,
+        truncate_rate=args.truncate,
+    ).start()
+    try:
+        for target in args.target:
+            for concurrency in args.concurrency:
+                line = json.dumps(run(target, concurrency, server, names, args))
+                print(line, flush=True)
+                if args.output:
+                    with open(args.output, "a") as output:
+                        output.write(line + "\n")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--domains", type=int, default=300)
+    parser.add_argument("--concurrency", type=lambda v: [int(c) for c in v.split(",")],
+                        default=[1, 10, 50], help="comma-separated checks in flight")
+    parser.add_argument("--target", type=lambda v: v.split(","), default=TARGETS,
+                        help=f"comma-separated, of {','.join(TARGETS)}")
+    parser.add_argument("--latency", type=float, default=0.005,
+                        help="seconds before the stub answers each query")
+    parser.add_argument("--loss", type=float, default=0.0,
+                        help="fraction of UDP queries dropped")
+    parser.add_argument("--truncate", type=float, default=0.0,
+                        help="fraction of UDP answers truncated regardless of size")
+    parser.add_argument("--large-keys", type=float, default=0.1,
+                        help="fraction of DKIM keys that are 4096-bit")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="append the JSON lines to this file")
+    main(parser.parse_args())
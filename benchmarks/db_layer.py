@@ -0,0 +1,167 @@
+"""
+Database-bound request throughput: the old engine setup against the tuned one.
+
+Seeds a throwaway SQLite database (through aiosqlite) with ``--domains``
+checked domains for one user, then serves ``GET /api/v1/domains/`` (a page
+of ``--page`` domains) and ``GET /api/v1/domains/{id}`` in process,
+``--concurrency`` requests at a time for ``--duration`` seconds, with the
+app's sessions bound to each engine in turn (``--repeat`` interleaved
+rounds, best kept):
+
+- ``echo``: ``echo=True`` and the driver's default pool, as the app used to
+  (a new connection per session for SQLite files). The echo output goes to
+  /dev/null, so the cost of shipping the log lines is not counted.
+- ``tuned``: ``engine_options()`` from the ``DB_*`` settings (echo off, a
+  queue pool with pre-ping) and the statement hooks (statement counts,
+  trace spans, slow query logging).
+
+SQLite stands in for Postgres, so the pool gains here are opening an
+aiosqlite connection (and its thread) per session, not a network handshake.
+
+    python -m benchmarks.db_layer --concurrency 20 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "db_layer.db")
+os.environ.setdefault("POSTGRES_USER", "bench")
+os.environ.setdefault("POSTGRES_PASSWORD", "bench")
+os.environ.setdefault("POSTGRES_DB", "bench")
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite+aiosqlite:///{DB_PATH}"
+
+import httpx  # noqa: E402
+from sqlalchemy import event, insert  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.db.session import AsyncSessionLocal, engine, engine_options, instrument  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models.domain import Domain  # noqa: E402
+from app.models.user import Base  # noqa: E402
+from benchmarks.hedged_queries import summarize  # noqa: E402
+
+EMAIL = "bench@example.com"
+PASSWORD = "correct horse battery staple"
+MODES = ["echo", "tuned"]
+
+
+def make_engine(mode: str):
+    url = settings.DATABASE_URL
+    if mode == "echo":
+        echo_engine = create_async_engine(url, echo=True, future=True)
+        devnull = open(os.devnull, "w")
+        for handler in logging.getLogger("sqlalchemy.engine.Engine").handlers:
+            handler.setStream(devnull)
+        return echo_engine
+    tuned = create_async_engine(url, **engine_options(url))
+    instrument(tuned)
+    return tuned
+
+
+async def seed(client: httpx.AsyncClient, domains: int) -> tuple:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    credentials = {"email": EMAIL, "password": PASSWORD}
+    user = (await client.post("/api/v1/auth/register", json=credentials)).json()
+    token = (await client.post("/api/v1/auth/login", json=credentials)).json()["access_token"]
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(insert(Domain).returning(Domain.id), [
+            {
+                "domain_name": f"customer{i}.test",
+                "user_id": user["id"],
+                "last_checked_at": datetime.utcnow(),
+                "dmarc_record": "v=DMARC1; p=reject",
+                "dmarc_status": True,
+                "spf_record": "v=spf1 include:_spf.mailhost-a.test ~all",
+                "spf_status": True,
+                "mx_records": json.dumps(["aspmx.mailhost-a.test."]),
+                "mx_status": True,
+            }
+            for i in range(domains)
+        ])
+        ids = rows.scalars().all()
+        await db.commit()
+    return {"Authorization": f"Bearer {token}"}, ids
+
+
+async def run_mode(mode: str, client, headers, ids, args) -> dict:
+    bound = make_engine(mode)
+    AsyncSessionLocal.configure(bind=bound)
+    statements = [0]
+
+    def count(*_) -> None:
+        statements[0] += 1
+
+    event.listen(bound.sync_engine, "after_cursor_execute", count)
+    latencies = []
+    errors = 0
+
+    async def worker(n: int, deadline: float) -> None:
+        nonlocal errors
+        i = n
+        while time.perf_counter() < deadline:
+            if i % 2:
+                url = f"/api/v1/domains/{ids[i % len(ids)]}"
+            else:
+                url = f"/api/v1/domains/?limit={args.page}"
+            started = time.perf_counter()
+            response = await client.get(url, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            errors += response.status_code != 200
+            i += 1
+
+    try:
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(worker(n, deadline) for n in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+    finally:
+        AsyncSessionLocal.configure(bind=engine)
+        await bound.dispose()
+    return {
+        "mode": mode,
+        "requests": len(latencies),
+        "requests_per_s": round(len(latencies) / elapsed, 1),
+        "errors": errors,
+        **summarize(latencies),
+        "statements_per_request": round(statements[0] / len(latencies), 2),
+    }
+
+
+async def main(args) -> None:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        headers, ids = await seed(client, args.domains)
+        best = {}
+        for _ in range(args.repeat):
+            for mode in MODES:
+                result = await run_mode(mode, client, headers, ids, args)
+                if mode not in best or result["requests_per_s"] > best[mode]["requests_per_s"]:
+                    best[mode] = result
+    await engine.dispose()
+    print(json.dumps({
+        "domains": args.domains,
+        "page": args.page,
+        "concurrency": args.concurrency,
+        "modes": best,
+        "speedup": round(best["tuned"]["requests_per_s"] / best["echo"]["requests_per_s"], 2),
+    }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--domains", type=int, default=1000)
+    parser.add_argument("--page", type=int, default=50, help="domains per list request")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per round")
+    parser.add_argument("--repeat", type=int, default=2)
+    asyncio.run(main(parser.parse_args()))
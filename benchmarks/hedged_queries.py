@@ -0,0 +1,139 @@
+"""
+Lookup latency with a slow, lossy primary nameserver.
+
+Two local stub servers stand in for ``8.8.8.8,8.8.4.4``: the primary drops
+``--loss`` of its UDP queries and answers ``--slow-rate`` of them only after
+``--slow-delay`` seconds; the secondary is clean. ``rotate`` is the previous
+resolver, a dnspython resolver rotating over both servers, which waits out the
+full timeout on every lost query. ``failover`` asks the next server only when
+one fails; ``hedged`` also asks it when the first is slower than its own p95.
+The answer cache is off so every lookup goes upstream.
+
+    python -m benchmarks.hedged_queries --queries 1000 --loss 0.02 --slow-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+os.environ.setdefault("POSTGRES_USER", "bench")
+os.environ.setdefault("POSTGRES_PASSWORD", "bench")
+os.environ.setdefault("POSTGRES_DB", "bench")
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+os.environ["DNS_CACHE_ENABLED"] = "false"
+
+import dns.asyncresolver  # noqa: E402
+import dns.resolver  # noqa: E402
+
+from app.services.dns_resolver import AsyncResolver, parse_nameserver  # noqa: E402
+from benchmarks.stub_dns import StubDNSServer  # noqa: E402
+
+
+class RotatingResolver:
+    """The previous resolver: dnspython rotating over all nameservers."""
+
+    def __init__(self, nameservers, timeout: float, tries: int):
+        self._resolver = dns.asyncresolver.Resolver(configure=False)
+        self._resolver.nameservers = [parse_nameserver(ns) for ns in nameservers]
+        self._resolver.timeout = timeout
+        self._resolver.lifetime = timeout
+        self._resolver.rotate = True
+        self.tries = tries
+
+    async def resolve(self, qname, rdtype):
+        for attempt in range(self.tries):
+            try:
+                return await self._resolver.resolve(qname, rdtype)
+            except (dns.resolver.LifetimeTimeout, dns.resolver.NoNameservers):
+                if attempt + 1 >= self.tries:
+                    raise
+
+    def stats(self) -> dict:
+        return {}
+
+
+def summarize(latencies: list) -> dict:
+    latencies = sorted(latencies)
+
+    def pct(p: float) -> float:
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1)
+
+    return {
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": round(latencies[-1] * 1000, 1),
+    }
+
+
+async def run(mode: str, args) -> dict:
+    names = [f"host{i}.test" for i in range(args.queries)]
+    records = {name: {"A": ["192.0.2.1"]} for name in names}
+    primary = StubDNSServer(
+        records, delay=args.delay, loss=args.loss,
+        slow_rate=args.slow_rate, slow_delay=args.slow_delay,
+    )
+    secondary = StubDNSServer(records, delay=args.delay)
+
+    async with primary, secondary:
+        nameservers = [primary.address, secondary.address]
+        if mode == "rotate":
+            resolver = RotatingResolver(nameservers, args.timeout, tries=3)
+        else:
+            resolver = AsyncResolver(
+                nameservers, timeout=args.timeout, lifetime=args.timeout * 2, tries=3
+            )
+            resolver.hedge = mode == "hedged"
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, failures = [], 0
+
+        async def lookup(name: str) -> None:
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    await resolver.resolve(name, "A")
+                except dns.exception.DNSException:
+                    failures += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(lookup(name) for name in names))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "mode": mode,
+        "queries": args.queries,
+        "elapsed_s": round(elapsed, 2),
+        "failures": failures,
+        **summarize(latencies),
+        "sent": {"primary": primary.queries, "secondary": secondary.queries},
+        "nameservers": resolver.stats(),
+    }
+
+
+async def main(args) -> None:
+    modes = ["rotate", "failover", "hedged"] if args.mode == "all" else [args.mode]
+    for mode in modes:
+        print(json.dumps(await run(mode, args)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.002,
+                        help="normal answer latency of both servers")
+    parser.add_argument("--loss", type=float, default=0.02,
+                        help="fraction of queries the primary drops")
+    parser.add_argument("--slow-rate", type=float, default=0.05,
+                        help="fraction of queries the primary answers late")
+    parser.add_argument("--slow-delay", type=float, default=1.5)
+    parser.add_argument("--timeout", type=float, default=2.0,
+                        help="per-nameserver query timeout")
+    parser.add_argument("--mode", choices=["rotate", "failover", "hedged", "all"],
+                        default="all")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,128 @@
+"""
+Domain-read latency during a login storm.
+
+Serves the app in-process over a throwaway SQLite database and measures
+``GET /api/v1/domains/`` latency first on an idle server, then while a burst
+of concurrent logins runs. Password hashes run on the bounded hashing pool,
+so read latency stays flat and logins beyond ``PASSWORD_HASH_MAX_PENDING``
+are shed with 503s; ``--inline`` hashes on the event loop instead, as
+before, for comparison.
+
+    python -m benchmarks.login_storm --logins 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import Counter
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "login_storm.db")
+os.environ.setdefault("POSTGRES_USER", "bench")
+os.environ.setdefault("POSTGRES_PASSWORD", "bench")
+os.environ.setdefault("POSTGRES_DB", "bench")
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite+aiosqlite:///{DB_PATH}"
+
+import httpx  # noqa: E402
+
+from app.core.security import password_hasher, pwd_context  # noqa: E402
+from app.db.session import engine  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models.user import Base  # noqa: E402
+
+EMAIL = "storm@example.com"
+PASSWORD = "correct horse battery staple"
+
+
+async def run_inline(fn, *args):
+    """The previous behaviour: bcrypt called directly on the event loop."""
+    return fn(*args)
+
+
+def summarize(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+
+async def read_domains(client, headers, stop: asyncio.Event, interval: float) -> list:
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.get("/api/v1/domains/", headers=headers)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def main(args) -> None:
+    if args.inline:
+        password_hasher._run = run_inline
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        credentials = {"email": EMAIL, "password": PASSWORD}
+        (await client.post("/api/v1/auth/register", json=credentials)).raise_for_status()
+        response = await client.post("/api/v1/auth/login", json=credentials)
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        stop = asyncio.Event()
+        reader = asyncio.create_task(read_domains(client, headers, stop, args.interval))
+        await asyncio.sleep(args.idle)
+        stop.set()
+        idle = await reader
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+        outcomes = Counter()
+
+        async def login():
+            async with semaphore:
+                response = await client.post("/api/v1/auth/login", json=credentials)
+                outcomes[response.status_code] += 1
+
+        stop = asyncio.Event()
+        reader = asyncio.create_task(read_domains(client, headers, stop, args.interval))
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(args.logins)))
+        storm_seconds = time.perf_counter() - started
+        stop.set()
+        storm = await reader
+
+    print(json.dumps({
+        "mode": "inline" if args.inline else "pool",
+        "bcrypt_rounds": pwd_context.to_dict()["bcrypt__rounds"],
+        "hash_workers": password_hasher.executor._max_workers,
+        "max_pending": password_hasher.max_pending,
+        "logins": args.logins,
+        "login_status_codes": dict(outcomes),
+        "storm_seconds": round(storm_seconds, 2),
+        "idle_reads": summarize(idle),
+        "storm_reads": summarize(storm),
+    }))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50,
+                        help="logins in flight at once")
+    parser.add_argument("--idle", type=float, default=1.0,
+                        help="seconds of idle reads before the storm")
+    parser.add_argument("--interval", type=float, default=0.01,
+                        help="pause between domain reads")
+    parser.add_argument("--inline", action="store_true",
+                        help="hash on the event loop, as before")
+    asyncio.run(main(parser.parse_args()))
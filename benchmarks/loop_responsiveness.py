@@ -0,0 +1,98 @@
+"""
+Event-loop responsiveness while slow DNS lookups are in flight.
+
+Runs ``DNSChecker.check_all`` for a batch of domains against a local stub
+server that delays every answer, while a ticker measures how late the event
+loop wakes it up. With the async resolver the worst-case lag stays in the
+low milliseconds; ``--blocking`` runs the same lookups through the
+synchronous resolver for comparison.
+
+    python -m benchmarks.loop_responsiveness --domains 20 --delay 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("POSTGRES_USER", "bench")
+os.environ.setdefault("POSTGRES_PASSWORD", "bench")
+os.environ.setdefault("POSTGRES_DB", "bench")
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+
+import dns.resolver  # noqa: E402
+
+from app.services.dns_checker import DNSChecker  # noqa: E402
+from app.services.dns_resolver import AsyncResolver, parse_nameserver  # noqa: E402
+from benchmarks.stub_dns import StubDNSServer, email_records  # noqa: E402
+
+
+class BlockingResolver:
+    """The pre-async behaviour: a synchronous resolver called from the loop."""
+
+    def __init__(self, nameserver: str):
+        self._resolver = dns.resolver.Resolver(configure=False)
+        self._resolver.nameservers = [parse_nameserver(nameserver)]
+        self._resolver.lifetime = 5.0
+
+    async def resolve(self, qname, rdtype):
+        return self._resolver.resolve(qname, rdtype)
+
+
+async def ticker(interval: float, lags: list, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def run(domains: int, delay: float, blocking: bool) -> dict:
+    names = [f"domain{i}.test" for i in range(domains)]
+    server = StubDNSServer(delay=delay)
+    for name in names:
+        for owner, rrsets in email_records(name).items():
+            server.add(owner, rrsets)
+
+    server.start_in_thread()
+    try:
+        if blocking:
+            DNSChecker.resolver = BlockingResolver(server.address)
+        else:
+            DNSChecker.resolver = AsyncResolver(
+                nameservers=[server.address], timeout=5.0, lifetime=5.0, tries=1
+            )
+
+        lags: list = []
+        stop = asyncio.Event()
+        tick = asyncio.create_task(ticker(0.01, lags, stop))
+        started = time.perf_counter()
+        results = await asyncio.gather(*(DNSChecker.check_all(n) for n in names))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await tick
+    finally:
+        server.stop_thread()
+
+    return {
+        "mode": "blocking" if blocking else "async",
+        "domains": domains,
+        "delay_s": delay,
+        "elapsed_s": round(elapsed, 4),
+        "max_loop_lag_ms": round(max(lags, default=0.0) * 1000, 2),
+        "valid": sum(1 for r in results if r["overall_status"]),
+        "queries": server.queries,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--domains", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.2)
+    parser.add_argument("--blocking", action="store_true")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.domains, args.delay, args.blocking))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Per-request and per-lookup cost of recording metrics.
+
+Times the recording primitives on their own (a labelled histogram
+observation, as done once per DNS lookup, check and request), then serves
+``GET /`` in process ``--requests`` times with and without
+``MetricsMiddleware`` and reports the difference per request (best of
+``--repeat`` rounds each, interleaved). Also times rendering ``/metrics``
+after the requests, the only place series are walked.
+
+    python -m benchmarks.metrics_overhead --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import timeit
+
+os.environ.setdefault("POSTGRES_USER", "bench")
+os.environ.setdefault("POSTGRES_PASSWORD", "bench")
+os.environ.setdefault("POSTGRES_DB", "bench")
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+
+import httpx  # noqa: E402
+from starlette.middleware import Middleware  # noqa: E402
+
+from app.core.metrics import Histogram, MetricsMiddleware, registry  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+def per_call_ns(statement, number: int = 200_000) -> float:
+    return round(min(timeit.repeat(statement, number=number, repeat=5)) / number * 1e9, 1)
+
+
+def primitives() -> dict:
+    histogram = Histogram("bench_seconds", "Benchmark only.", ["rdtype", "outcome"])
+    child = histogram.labels("TXT", "answer")
+    return {
+        "observe_ns": per_call_ns(lambda: child.observe(0.012)),
+        "labels_observe_ns": per_call_ns(
+            lambda: histogram.labels("TXT", "answer").observe(0.012)
+        ),
+        "perf_counter_pair_ns": per_call_ns(lambda: time.perf_counter() - time.perf_counter()),
+    }
+
+
+def set_middleware(enabled: bool) -> None:
+    app.user_middleware = [m for m in app.user_middleware if m.cls is not MetricsMiddleware]
+    if enabled:
+        app.user_middleware.insert(0, Middleware(MetricsMiddleware))
+    app.middleware_stack = None
+
+
+async def serve(requests: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.get("/")
+        started = time.perf_counter()
+        for _ in range(requests):
+            await client.get("/")
+        return (time.perf_counter() - started) / requests
+
+
+async def main(args) -> None:
+    report = {"requests": args.requests, **primitives()}
+    best = {True: float("inf"), False: float("inf")}
+    for _ in range(args.repeat):
+        for enabled in (False, True):
+            set_middleware(enabled)
+            best[enabled] = min(best[enabled], await serve(args.requests))
+    set_middleware(True)
+
+    started = time.perf_counter()
+    body = registry.render()
+    render = time.perf_counter() - started
+    report.update({
+        "request_us_without_metrics": round(best[False] * 1e6, 1),
+        "request_us_with_metrics": round(best[True] * 1e6, 1),
+        "overhead_us_per_request": round((best[True] - best[False]) * 1e6, 1),
+        "overhead_pct": round((best[True] / best[False] - 1) * 100, 2),
+        "render_ms": round(render * 1000, 3),
+        "render_bytes": len(body),
+    })
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
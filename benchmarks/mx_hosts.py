@@ -0,0 +1,104 @@
+"""
+Cost of deep MX checks when many domains share the same mail hosts.
+
+Every customer domain's MX points at the two exchanges of one of a few
+providers, like real customers using Google Workspace or Microsoft 365. The
+stub server counts the A/AAAA queries each mode sends. ``shared`` uses one
+``MXHostResolver`` for every domain, so each exchange is resolved once;
+``per-domain`` uses a fresh one per domain, resolving the exchanges again for
+every domain. The DNS answer cache is off in both modes so only host sharing
+differs.
+
+    python -m benchmarks.mx_hosts --domains 1000 --providers 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+
+os.environ.setdefault("POSTGRES_USER", "bench")
+os.environ.setdefault("POSTGRES_PASSWORD", "bench")
+os.environ.setdefault("POSTGRES_DB", "bench")
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+os.environ["DNS_CACHE_ENABLED"] = "false"
+
+import dns.message  # noqa: E402
+import dns.rdatatype  # noqa: E402
+
+from app.services import dns_checker  # noqa: E402
+from app.services.dns_checker import DNSChecker  # noqa: E402
+from app.services.dns_resolver import AsyncResolver  # noqa: E402
+from app.services.mx import MXHostResolver  # noqa: E402
+from benchmarks.stub_dns import StubDNSServer  # noqa: E402
+
+
+class CountingServer(StubDNSServer):
+    """Counts queries per record type."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.by_type = Counter()
+
+    async def _respond(self, wire: bytes):
+        question = dns.message.from_wire(wire).question[0]
+        self.by_type[dns.rdatatype.to_text(question.rdtype)] += 1
+        return await super()._respond(wire)
+
+
+async def run(mode: str, domains: int, providers: int, concurrency: int) -> dict:
+    server = CountingServer()
+    provider_names = [f"provider{p}.test" for p in range(providers)]
+    for p, provider in enumerate(provider_names):
+        server.add(f"mx1.{provider}", {"A": [f"198.51.100.{p + 1}"],
+                                       "AAAA": [f"2001:db8:{p + 1}::1"]})
+        server.add(f"mx2.{provider}", {"A": [f"198.51.100.{p + 101}"]})
+    names = [f"customer{i}.test" for i in range(domains)]
+    for i, name in enumerate(names):
+        provider = provider_names[i % providers]
+        server.add(name, {"MX": [f"10 mx1.{provider}.", f"20 mx2.{provider}."]})
+
+    async with server:
+        DNSChecker.resolver = AsyncResolver([server.address])
+        dns_checker.mx_hosts = MXHostResolver(DNSChecker.resolver)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def check(name: str):
+            async with semaphore:
+                if mode == "per-domain":
+                    # Each domain gets its own host cache, as if unshared
+                    dns_checker.mx_hosts = MXHostResolver(DNSChecker.resolver)
+                return await DNSChecker.check_mx(name, deep=True)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(check(name) for name in names))
+        elapsed = time.perf_counter() - started
+
+    host_queries = server.by_type["A"] + server.by_type["AAAA"]
+    return {
+        "mode": mode,
+        "domains": domains,
+        "distinct_mx_hosts": 2 * providers,
+        "elapsed_s": round(elapsed, 3),
+        "mx_queries": server.by_type["MX"],
+        "host_queries": host_queries,
+        "host_queries_per_distinct_host": round(host_queries / (2 * providers), 2),
+        "statuses": dict(Counter(info["status"] for _, _, info in results)),
+    }
+
+
+async def main(args) -> None:
+    modes = ["per-domain", "shared"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        print(json.dumps(await run(mode, args.domains, args.providers, args.concurrency)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--domains", type=int, default=1000)
+    parser.add_argument("--providers", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--mode", choices=["per-domain", "shared", "both"], default="both")
+    asyncio.run(main(parser.parse_args()))
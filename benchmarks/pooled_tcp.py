@@ -0,0 +1,100 @@
+"""
+Large TXT lookups over UDP with TCP fallback vs pooled, pipelined TCP.
+
+Each of ``--domains`` names publishes an SPF record and a 4096-bit DKIM key,
+both too long for a 512-byte UDP answer. A local stub server answers after
+``--rtt`` seconds and holds every new TCP connection for another ``--rtt``
+(the handshake with a remote server). ``udp`` is the previous transport:
+each lookup is truncated over UDP, then asked again over a TCP connection
+opened for it. ``tcp`` sends every lookup over ``DNS_POOL_SIZE`` long-lived
+connections, pipelining up to ``DNS_POOL_MAX_PIPELINE`` queries on each. The
+answer cache is off so every lookup goes upstream.
+
+    python -m benchmarks.pooled_tcp --domains 1000 --rtt 0.02
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("POSTGRES_USER", "bench")
+os.environ.setdefault("POSTGRES_PASSWORD", "bench")
+os.environ.setdefault("POSTGRES_DB", "bench")
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+os.environ["DNS_CACHE_ENABLED"] = "false"
+
+import dns.exception  # noqa: E402
+
+from app.services.dns_resolver import AsyncResolver  # noqa: E402
+from benchmarks.hedged_queries import summarize  # noqa: E402
+from benchmarks.stub_dns import DKIM_4096_KEY, StubDNSServer  # noqa: E402
+
+SPF = "v=spf1 " + " ".join(f"ip4:198.51.100.{i}" for i in range(40)) + " -all"
+
+
+def txt(value: str) -> str:
+    # TXT strings are limited to 255 bytes
+    return " ".join(f'"{value[i:i + 255]}"' for i in range(0, len(value), 255))
+
+
+async def run(mode: str, args) -> dict:
+    server = StubDNSServer(delay=args.rtt, handshake_delay=args.rtt)
+    names = []
+    for i in range(args.domains):
+        domain = f"customer{i}.test"
+        server.add(domain, {"TXT": [txt(SPF)]})
+        server.add(f"s1._domainkey.{domain}", {"TXT": [txt(f"v=DKIM1; k=rsa; p={DKIM_4096_KEY}")]})
+        names += [domain, f"s1._domainkey.{domain}"]
+
+    async with server:
+        resolver = AsyncResolver([server.address], transport=mode)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, failures = [], 0
+
+        async def lookup(name: str) -> None:
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    await resolver.resolve(name, "TXT")
+                except dns.exception.DNSException:
+                    failures += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(lookup(name) for name in names))
+        elapsed = time.perf_counter() - started
+        stats = resolver.stats()[server.address]
+        resolver.close()
+
+    return {
+        "mode": mode,
+        "lookups": len(names),
+        "elapsed_s": round(elapsed, 2),
+        "lookups_per_s": round(len(names) / elapsed),
+        "failures": failures,
+        **summarize(latencies),
+        "queries_sent": server.queries,
+        "truncated": server.truncated,
+        "tcp_connections": server.tcp_connections,
+        "connects": stats.get("connects"),
+        "reconnects": stats.get("reconnects"),
+    }
+
+
+async def main(args) -> None:
+    modes = ["udp", "tcp"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        print(json.dumps(await run(mode, args)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--domains", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rtt", type=float, default=0.02,
+                        help="simulated round trip to the nameserver")
+    parser.add_argument("--mode", choices=["udp", "tcp", "both"], default="both")
+    asyncio.run(main(parser.parse_args()))
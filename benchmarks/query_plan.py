@@ -0,0 +1,122 @@
+"""
+DNS queries sent per full domain check, with and without the query plan.
+
+Each domain publishes DMARC, a DKIM key under a selector remembered from an
+earlier check, two MX hosts, a site verification token next to its SPF
+record, and an SPF policy using ``a`` and ``mx`` — so SPF reads the same apex
+TXT, A and MX records and MX hosts the other checks do. The stub server
+counts the queries ``DNSChecker.check_all`` sends. ``unplanned`` lets every
+check query for itself, as before; ``planned`` shares one ``QueryPlan`` per
+check. The DNS answer cache is off in both modes so only the plan differs.
+
+    python -m benchmarks.query_plan --domains 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+
+os.environ.setdefault("POSTGRES_USER", "bench")
+os.environ.setdefault("POSTGRES_PASSWORD", "bench")
+os.environ.setdefault("POSTGRES_DB", "bench")
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+os.environ["DNS_CACHE_ENABLED"] = "false"
+
+import dns.message  # noqa: E402
+import dns.rdatatype  # noqa: E402
+
+from app.services import check_engine, dns_checker  # noqa: E402
+from app.services.dns_checker import DNSChecker  # noqa: E402
+from app.services.dns_resolver import AsyncResolver  # noqa: E402
+from app.services.mx import MXHostResolver  # noqa: E402
+from app.services.query_plan import QueryPlan  # noqa: E402
+from app.services.spf import SPFEvaluator  # noqa: E402
+from benchmarks.stub_dns import StubDNSServer, email_records  # noqa: E402
+
+
+class Unplanned:
+    """The previous behaviour: every check queries the resolver itself."""
+
+    def __init__(self, resolver):
+        self.resolver = resolver
+
+    def prefetch(self, queries) -> None:
+        pass
+
+    async def resolve(self, qname: str, rdtype: str):
+        return await self.resolver.resolve(qname, rdtype)
+
+
+class CountingServer(StubDNSServer):
+    """Counts queries per record type."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.by_type = Counter()
+
+    async def _respond(self, wire: bytes):
+        question = dns.message.from_wire(wire).question[0]
+        self.by_type[dns.rdatatype.to_text(question.rdtype)] += 1
+        return await super()._respond(wire)
+
+
+async def run(mode: str, domains: int, concurrency: int) -> dict:
+    server = CountingServer()
+    names = [f"customer{i}.test" for i in range(domains)]
+    for name in names:
+        records = email_records(name)
+        records[name]["TXT"] = [
+            '"v=spf1 a mx ip4:192.0.2.0/24 -all"',
+            '"google-site-verification=0123456789abcdef"',
+        ]
+        records[name]["A"] = ["192.0.2.80"]
+        for rrsets in records.values():
+            if "A" in rrsets:
+                rrsets.setdefault("AAAA", ["2001:db8::80"])
+        for record, rrsets in records.items():
+            server.add(record, rrsets)
+
+    check_engine.QueryPlan = QueryPlan if mode == "planned" else Unplanned
+    async with server:
+        DNSChecker.resolver = AsyncResolver([server.address])
+        dns_checker.spf_evaluator = SPFEvaluator(DNSChecker.resolver)
+        dns_checker.mx_hosts = MXHostResolver(DNSChecker.resolver)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def check(name: str):
+            async with semaphore:
+                return await DNSChecker.check_all(name, dkim_selectors=["default"])
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(check(name) for name in names))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "mode": mode,
+        "domains": domains,
+        "elapsed_s": round(elapsed, 3),
+        "dns_queries": server.queries,
+        "queries_per_check": round(server.queries / domains, 2),
+        "queries_per_check_by_type": {
+            rdtype: round(count / domains, 2)
+            for rdtype, count in sorted(server.by_type.items())
+        },
+        "overall_status": dict(Counter(result["overall_status"] for result in results)),
+    }
+
+
+async def main(args) -> None:
+    modes = ["unplanned", "planned"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        print(json.dumps(await run(mode, args.domains, args.concurrency)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--domains", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--mode", choices=["unplanned", "planned", "both"], default="both")
+    asyncio.run(main(parser.parse_args()))
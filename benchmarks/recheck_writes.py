@@ -0,0 +1,196 @@
+"""
+Database writes per 1,000 scheduled re-checks.
+
+Seeds a throwaway SQLite database with checked domains, then stores a round
+of re-check results and counts the
+statements, rows written and values bound for them. ``full`` rewrites
+every result column on every re-check (the behaviour before result
+fingerprinting); ``fingerprint`` only touches the check timestamps when a
+result is unchanged. ``--path batch`` stores results the way the scheduler and
+workers do (``store_results``), ``--path endpoint`` one domain per session the
+way ``POST /domains/{id}/check`` does.
+
+    python -m benchmarks.recheck_writes --domains 1000 --changed 0.05 --path both
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "recheck_writes.db")
+os.environ.setdefault("POSTGRES_USER", "bench")
+os.environ.setdefault("POSTGRES_PASSWORD", "bench")
+os.environ.setdefault("POSTGRES_DB", "bench")
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite+aiosqlite:///{DB_PATH}"
+
+from datetime import datetime  # noqa: E402
+
+from sqlalchemy import event, insert, select, update  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.db.session import AsyncSessionLocal, engine  # noqa: E402
+from app.models.domain import Domain  # noqa: E402
+from app.models.user import Base, User  # noqa: E402
+from app.services.check_history import record_history  # noqa: E402
+from app.services.scheduler import next_check_at, store_results  # noqa: E402
+
+
+def check_result(name: str, dmarc_policy: str = "reject") -> dict:
+    return {
+        "domain_name": name,
+        "check_timestamp": datetime.utcnow(),
+        "dmarc_record": f"v=DMARC1; p={dmarc_policy}",
+        "dmarc_status": True,
+        "spf_record": "v=spf1 include:_spf.google.com ~all",
+        "spf_status": True,
+        "dkim_record": "v=DKIM1; k=rsa; p=" + "A" * 392,
+        "dkim_status": True,
+        "mx_records": [f"mx1.{name}.", f"mx2.{name}."],
+        "mx_status": True,
+        "overall_status": True,
+        "check_summary": {
+            check: {"status": "valid", "message": "ok"}
+            for check in ("dmarc", "spf", "dkim", "mx")
+        },
+        "min_ttl": 3600,
+    }
+
+
+class StatementCounter:
+    def __init__(self):
+        self.statements = Counter()
+        self.rows = Counter()
+        self.values = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        self.statements[verb] += 1
+        param_sets = parameters if executemany else [parameters]
+        if verb in ("INSERT", "UPDATE"):
+            self.rows[verb] += max(cursor.rowcount, 0)
+            self.values += sum(len(p) for p in param_sets)
+
+
+async def seed(domains: int) -> list:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as db:
+        user = User(email="bench@example.com", hashed_password="x")
+        db.add(user)
+        await db.flush()
+        result = await db.execute(
+            insert(Domain).returning(Domain.id, Domain.domain_name),
+            [{"domain_name": f"d{i}.test", "user_id": user.id} for i in range(domains)],
+        )
+        rows = [tuple(row) for row in result.all()]
+        await store_results(db, [(i, check_result(name)) for i, name in rows])
+        await db.commit()
+    return rows
+
+
+async def write_full(db, batch) -> None:
+    now = datetime.utcnow()
+    await record_history(db, [
+        (domain_id, result) for domain_id, result, previous_hash in batch
+        if Domain.result_fingerprint(result) != previous_hash
+    ])
+    await db.execute(update(Domain), [
+        {
+            "id": domain_id,
+            "updated_at": now,
+            "next_check_at": next_check_at(result, now),
+            **Domain.result_columns(result),
+        }
+        for domain_id, result, _ in batch
+    ])
+
+
+async def write_endpoint(mode: str, domain_id: int, result: dict) -> None:
+    async with AsyncSessionLocal() as db:
+        domain = await db.get(Domain, domain_id)
+        if domain.result_hash != Domain.result_fingerprint(result):
+            await record_history(db, [(domain_id, result)])
+        if mode == "full":
+            for column, value in Domain.result_columns(result).items():
+                setattr(domain, column, value)
+            domain.updated_at = datetime.utcnow()
+        else:
+            domain.apply_check_result(result)
+        domain.next_check_at = next_check_at(result)
+        await db.commit()
+
+
+async def run(mode: str, path: str, domains: int, changed: float) -> dict:
+    rows = await seed(domains)
+    async with AsyncSessionLocal() as db:
+        hashes = dict((await db.execute(select(Domain.id, Domain.result_hash))).all())
+
+    rng = random.Random(42)
+    results = [
+        (
+            domain_id,
+            check_result(name, "quarantine" if rng.random() < changed else "reject"),
+            hashes[domain_id],
+        )
+        for domain_id, name in rows
+    ]
+
+    counter = StatementCounter()
+    event.listen(engine.sync_engine, "after_cursor_execute", counter)
+    started = time.perf_counter()
+    if path == "endpoint":
+        for domain_id, result, _ in results:
+            await write_endpoint(mode, domain_id, result)
+    else:
+        batch_size = settings.RECHECK_BATCH_SIZE
+        for start in range(0, len(results), batch_size):
+            batch = results[start:start + batch_size]
+            async with AsyncSessionLocal() as db:
+                if mode == "full":
+                    await write_full(db, batch)
+                else:
+                    await store_results(db, [(domain_id, result) for domain_id, result, _ in batch])
+                await db.commit()
+    elapsed = time.perf_counter() - started
+    event.remove(engine.sync_engine, "after_cursor_execute", counter)
+
+    per_1000 = 1000 / domains
+    return {
+        "mode": mode,
+        "path": path,
+        "domains": domains,
+        "changed_fraction": changed,
+        "elapsed_s": round(elapsed, 4),
+        "statements_per_1000": round(sum(counter.statements.values()) * per_1000, 1),
+        "statements_by_type": dict(counter.statements),
+        "rows_written_per_1000": {
+            verb: round(n * per_1000, 1) for verb, n in counter.rows.items()
+        },
+        "bound_values_written_per_1000": round(counter.values * per_1000, 1),
+    }
+
+
+async def main(args) -> None:
+    modes = ["full", "fingerprint"] if args.mode == "both" else [args.mode]
+    paths = ["batch", "endpoint"] if args.path == "both" else [args.path]
+    for path in paths:
+        for mode in modes:
+            print(json.dumps(await run(mode, path, args.domains, args.changed)))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--domains", type=int, default=1000)
+    parser.add_argument("--changed", type=float, default=0.05,
+                        help="fraction of re-checks whose outcome changed")
+    parser.add_argument("--mode", choices=["full", "fingerprint", "both"], default="both")
+    parser.add_argument("--path", choices=["batch", "endpoint", "both"], default="both")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,101 @@
+"""
+Cost of SPF evaluation when many domains include the same providers.
+
+Every customer domain's record includes one of a few provider trees (three
+levels deep, with ``a`` and ``mx`` mechanisms at the leaves), like real
+customers pointing at ``_spf.google.com`` or ``spf.protection.outlook.com``.
+The stub server counts the DNS queries each mode sends. ``shared`` uses one
+``SPFEvaluator`` for every domain, so each provider node is compiled once;
+``per-domain`` uses a fresh evaluator per domain, re-expanding the trees each
+time. The DNS answer cache is off in both modes so only node memoization
+differs.
+
+    python -m benchmarks.spf_includes --domains 500 --providers 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("POSTGRES_USER", "bench")
+os.environ.setdefault("POSTGRES_PASSWORD", "bench")
+os.environ.setdefault("POSTGRES_DB", "bench")
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+os.environ["DNS_CACHE_ENABLED"] = "false"
+
+from app.services.dns_resolver import AsyncResolver  # noqa: E402
+from app.services.spf import SPFEvaluator  # noqa: E402
+from benchmarks.stub_dns import StubDNSServer  # noqa: E402
+
+
+def provider_records(provider: str) -> dict:
+    """A provider tree: root -> 3 regional includes -> ranges, a and mx."""
+    records = {
+        f"_spf.{provider}": {"TXT": [
+            '"v=spf1 ' + " ".join(f"include:_r{i}.{provider}" for i in range(3)) + ' ~all"'
+        ]},
+        f"mx.{provider}": {"A": ["198.51.100.25"], "AAAA": ["2001:db8:25::1"]},
+        f"out.{provider}": {"A": ["198.51.100.26"]},
+        provider: {"MX": [f"10 mx.{provider}."]},
+    }
+    for i in range(3):
+        records[f"_r{i}.{provider}"] = {"TXT": [
+            f'"v=spf1 ip4:10.{i}.0.0/16 ip6:2001:db8:{i}::/48 '
+            f'a:out.{provider} mx:{provider} ~all"'
+        ]}
+    return records
+
+
+async def run(mode: str, domains: int, providers: int, concurrency: int) -> dict:
+    server = StubDNSServer()
+    provider_names = [f"provider{p}.test" for p in range(providers)]
+    for provider in provider_names:
+        for name, rrsets in provider_records(provider).items():
+            server.add(name, rrsets)
+    names = [f"customer{i}.test" for i in range(domains)]
+    for i, name in enumerate(names):
+        provider = provider_names[i % providers]
+        server.add(name, {"TXT": [f'"v=spf1 include:_spf.{provider} -all"']})
+
+    async with server:
+        resolver = AsyncResolver([server.address])
+        shared = SPFEvaluator(resolver)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def evaluate(name: str):
+            async with semaphore:
+                evaluator = shared if mode == "shared" else SPFEvaluator(resolver)
+                return await evaluator.evaluate(name)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(evaluate(name) for name in names))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "mode": mode,
+        "domains": domains,
+        "providers": providers,
+        "elapsed_s": round(elapsed, 3),
+        "dns_queries": server.queries,
+        "queries_per_domain": round(server.queries / domains, 2),
+        "lookups_per_domain": results[0].lookups,
+        "ip4_ranges_per_domain": len(results[0].ip4),
+        "results": sorted({result.result for result in results}),
+    }
+
+
+async def main(args) -> None:
+    modes = ["per-domain", "shared"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        print(json.dumps(await run(mode, args.domains, args.providers, args.concurrency)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--domains", type=int, default=500)
+    parser.add_argument("--providers", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--mode", choices=["per-domain", "shared", "both"], default="both")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,470 @@
+"""
+Local stub DNS server used by the benchmark scripts.
+
+Records are given as ``{name: {rdtype: [rdata, ...]}}`` in presentation
+format. Names that are not present answer NXDOMAIN, names that exist without
+the requested type answer NOERROR with an SOA in the authority section so
+negative answers can be cached. A ``CNAME`` (absolute target) is followed
+through the stub's own records. UDP answers larger than the client's
+advertised payload (512 bytes without EDNS) are truncated (TC bit set), as a
+real server would, so clients have to ask again over TCP.
+``synthetic_zones`` generates a realistic mix of configured and
+misconfigured domains for throughput benchmarks.
+"""
+import asyncio
+import multiprocessing
+import random
+import socket
+import ssl
+import struct
+import threading
+from typing import Dict, List, Optional
+
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+
+Records = Dict[str, Dict[str, List[str]]]
+
+DEFAULT_TTL = 300
+SOA_TEXT = "ns.stub. hostmaster.stub. 1 3600 600 86400 60"
+# A real RSA-2048 public key, so DKIM checks can parse it
+DKIM_PUBLIC_KEY = (
+    "MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEAoeFFKo8LBsr/TYay5f8e"
+    "FlkYbKrpVAeCPMq5udQiXK8jShXGc/SqymlqTbjXDLrZP8ygY9HGjZATHoJyVOfm"
+    "llu4zd91s7+2Y7u3GagfnBgUdIuhpBy7wynUscqxuANBNXMEKrmv9IyqG3Qt028+"
+    "OseHZLy1xBnpU/97VJhhYdpY2bkoUAiSKcIc59MnY+PgGWAnb56gQfXT40nLvgh2"
+    "VFAwGzKhmg+GeTvXGUfc4NgIIll/F9Lj1E/VmYzf7pbVI9b5J8Yf+7IAf6P5oZqb"
+    "lk1Nw4Gmma94MyM4xqwK6wFp0zxMaTz8x3AgeR8Qo6MjwAYytbO1LY4c4tmjKIiP"
+    "AQIDAQAB"
+)
+
+
+class StubDNSServer:
+    def __init__(
+        self,
+        records: Optional[Records] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        delay: float = 0.0,
+        ttl: int = DEFAULT_TTL,
+        loss: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_delay: float = 0.0,
+        capacity: Optional[int] = None,
+        truncate_rate: float = 0.0,
+        tcp_idle_timeout: Optional[float] = None,
+        handshake_delay: float = 0.0,
+        ssl_context: Optional[ssl.SSLContext] = None,
+    ):
+        self.records: Records = {}
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.delays: Dict[str, float] = {}
+        self.ttl = ttl
+        # Fraction of UDP queries dropped unanswered, and fraction answered
+        # only after an extra slow_delay seconds
+        self.loss = loss
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        # Like a rate-limiting public resolver: queries beyond ``capacity``
+        # in flight at once are answered SERVFAIL
+        self.capacity = capacity
+        # Fraction of UDP answers truncated whatever their size
+        self.truncate_rate = truncate_rate
+        self.active = 0
+        self.servfails = 0
+        # TCP connections idle this long are closed by the server; each new
+        # one is answered only after ``handshake_delay`` (the round trips of
+        # a handshake with a remote server). With an ``ssl_context`` the TCP
+        # listener speaks DNS over TLS instead
+        self.tcp_idle_timeout = tcp_idle_timeout
+        self.handshake_delay = handshake_delay
+        self.ssl_context = ssl_context
+        self.tcp_connections = 0
+        self.tcp_queries = 0
+        self.truncated = 0
+        self.queries = 0
+        self._transport = None
+        self._tcp_server = None
+        self._tcp_handlers = set()
+        for name, rrsets in (records or {}).items():
+            self.add(name, rrsets)
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def add(self, name: str, rrsets: Dict[str, List[str]]) -> None:
+        key = name.lower().rstrip(".") + "."
+        self.records.setdefault(key, {}).update(
+            {rdtype.upper(): values for rdtype, values in rrsets.items()}
+        )
+
+    def _delay_for(self, qname: str) -> float:
+        return self.delays.get(qname, self.delay)
+
+    def build_response(self, wire: bytes) -> bytes:
+        query = dns.message.from_wire(wire)
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.AA
+        question = query.question[0]
+        qname = question.name.to_text().lower()
+        rdtype = dns.rdatatype.to_text(question.rdtype)
+
+        rrsets = self.records.get(qname)
+        # Chase aliases within the stub's own records, like an authoritative
+        # server answering for its zone
+        while rrsets is not None and rdtype != "CNAME" and rdtype not in rrsets \
+                and "CNAME" in rrsets:
+            target = rrsets["CNAME"][0]
+            response.answer.append(
+                dns.rrset.from_text_list(
+                    qname, self.ttl, dns.rdataclass.IN, "CNAME", [target]
+                )
+            )
+            qname = target.lower()
+            rrsets = self.records.get(qname)
+        if rrsets is None:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            self._add_soa(response, question.name)
+        elif rdtype in rrsets:
+            response.answer.append(
+                dns.rrset.from_text_list(
+                    qname, self.ttl, dns.rdataclass.IN, rdtype, rrsets[rdtype]
+                )
+            )
+        else:
+            self._add_soa(response, question.name)
+        return response.to_wire()
+
+    def truncate(self, query_wire: bytes, wire: bytes) -> bytes:
+        """The UDP form of a response: header and question only, TC set,
+        if it doesn't fit in the payload size the query advertised."""
+        query = dns.message.from_wire(query_wire)
+        max_size = max(512, query.payload) if query.edns >= 0 else 512
+        forced = self.truncate_rate and random.random() < self.truncate_rate
+        if len(wire) <= max_size and not forced:
+            return wire
+        self.truncated += 1
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.TC | dns.flags.AA
+        return response.to_wire()
+
+    def _add_soa(self, response: dns.message.Message, qname: dns.name.Name) -> None:
+        zone = qname.split(3)[1] if len(qname) > 3 else qname
+        response.authority.append(
+            dns.rrset.from_text(zone, self.ttl, dns.rdataclass.IN, "SOA", SOA_TEXT)
+        )
+
+    async def _respond(self, wire: bytes) -> Optional[bytes]:
+        self.queries += 1
+        qname = dns.message.from_wire(wire).question[0].name.to_text().lower()
+        delay = self._delay_for(qname)
+        if self.slow_rate and random.random() < self.slow_rate:
+            delay += self.slow_delay
+        overloaded = self.capacity is not None and self.active >= self.capacity
+        self.active += 1
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+        finally:
+            self.active -= 1
+        if overloaded:
+            self.servfails += 1
+            response = dns.message.make_response(dns.message.from_wire(wire))
+            response.set_rcode(dns.rcode.SERVFAIL)
+            return response.to_wire()
+        return self.build_response(wire)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queries": self.queries,
+            "tcp_queries": self.tcp_queries,
+            "tcp_connections": self.tcp_connections,
+            "truncated": self.truncated,
+            "servfails": self.servfails,
+        }
+
+    async def start(self) -> "StubDNSServer":
+        loop = asyncio.get_running_loop()
+        server = self
+
+        class _UDP(asyncio.DatagramProtocol):
+            def connection_made(self, transport):
+                self.transport = transport
+                # Bursts of concurrent checks overflow the default buffer
+                sock = transport.get_extra_info("socket")
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+
+            def datagram_received(self, data, addr):
+                if server.loss and random.random() < server.loss:
+                    server.queries += 1
+                    return
+
+                async def reply():
+                    wire = await server._respond(data)
+                    if wire is not None:
+                        self.transport.sendto(server.truncate(data, wire), addr)
+
+                loop.create_task(reply())
+
+        self._transport, _ = await loop.create_datagram_endpoint(
+            _UDP, local_addr=(self.host, self.port)
+        )
+        self.port = self._transport.get_extra_info("sockname")[1]
+        self._tcp_server = await asyncio.start_server(
+            self._handle_tcp, self.host, self.port, ssl=self.ssl_context
+        )
+        return self
+
+    async def _handle_tcp(self, reader, writer) -> None:
+        lock = asyncio.Lock()
+        self.tcp_connections += 1
+        self._tcp_handlers.add(asyncio.current_task())
+
+        async def reply(data: bytes) -> None:
+            wire = await self._respond(data)
+            if wire is None:
+                return
+            async with lock:
+                writer.write(struct.pack("!H", len(wire)) + wire)
+                await writer.drain()
+
+        tasks = set()
+        try:
+            if self.handshake_delay:
+                await asyncio.sleep(self.handshake_delay)
+            while True:
+                try:
+                    header = await asyncio.wait_for(
+                        reader.readexactly(2), self.tcp_idle_timeout
+                    )
+                except asyncio.TimeoutError:
+                    if tasks:
+                        continue
+                    break
+                length = struct.unpack("!H", header)[0]
+                self.tcp_queries += 1
+                task = asyncio.create_task(reply(await reader.readexactly(length)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._tcp_handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def stop(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+        if self._tcp_server is not None:
+            self._tcp_server.close()
+            handlers = list(self._tcp_handlers)
+            for handler in handlers:
+                handler.cancel()
+            await asyncio.gather(*handlers, return_exceptions=True)
+            await self._tcp_server.wait_closed()
+
+    def start_in_thread(self) -> "StubDNSServer":
+        """Serve from a dedicated thread so blocking clients can't stall it."""
+        ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def serve():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start())
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop_thread(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def __aenter__(self) -> "StubDNSServer":
+        return await self.start()
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+
+def _serve(conn, records: Records, options: dict) -> None:
+    async def serve() -> None:
+        loop = asyncio.get_running_loop()
+        async with StubDNSServer(records, **options) as server:
+            conn.send(server.port)
+            while await loop.run_in_executor(None, conn.recv) == "stats":
+                conn.send(server.stats())
+
+    asyncio.run(serve())
+
+
+class StubDNSProcess:
+    """A ``StubDNSServer`` in a child process, so answering queries doesn't
+    compete for the GIL with the code being measured. Takes the same
+    arguments; ``stats()`` reads the server's counters."""
+
+    def __init__(self, records: Optional[Records] = None, host: str = "127.0.0.1", **options):
+        self.records = records or {}
+        self.host = host
+        self.options = {"host": host, **options}
+        self.port = None
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def start(self) -> "StubDNSProcess":
+        context = multiprocessing.get_context("spawn")
+        self._conn, child = context.Pipe()
+        self._process = context.Process(
+            target=_serve, args=(child, self.records, self.options), daemon=True
+        )
+        self._process.start()
+        self.port = self._conn.recv()
+        return self
+
+    def stats(self) -> Dict[str, int]:
+        self._conn.send("stats")
+        return self._conn.recv()
+
+    def stop(self) -> None:
+        self._conn.send("stop")
+        self._process.join()
+
+    def __enter__(self) -> "StubDNSProcess":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def email_records(domain: str) -> Records:
+    """A fully configured domain: DMARC, SPF, DKIM (default selector) and MX."""
+    return {
+        domain: {
+            "TXT": ['"v=spf1 ip4:192.0.2.0/24 -all"'],
+            "MX": [f"10 mx1.{domain}.", f"20 mx2.{domain}."],
+        },
+        f"_dmarc.{domain}": {"TXT": ['"v=DMARC1; p=reject"']},
+        f"default._domainkey.{domain}": {"TXT": [
+            # TXT strings are limited to 255 bytes, so the key is split
+            " ".join(
+                f'"{DKIM_PUBLIC_KEY[i:i + 200]}"'
+                for i in range(0, len(DKIM_PUBLIC_KEY), 200)
+            ).replace('"', '"v=DKIM1; k=rsa; p=', 1)
+        ]},
+        f"mx1.{domain}": {"A": ["192.0.2.25"]},
+        f"mx2.{domain}": {"A": ["192.0.2.26"]},
+    }
+
+
+# A real RSA-4096 public key: its DKIM record is too long for a UDP answer
+DKIM_4096_KEY = (
+    "MIICIjANBgkqhkiG9w0BAQEFAAOCAg8AMIICCgKCAgEAwTE4HEV8IGJheopER+wy"
+    "0RJRjEAKqzJAFU6oeFXVRVPadCYSOA2lbnnLHNdUsR94fDFQwGzeaDWSOs9ZRtCO"
+    "hLSkfNiEATFURAB05RUmHP36i+XCgZXW6R58LaUJMVra9M9pgApcenf4ReBbPPG7"
+    "7USX568BmyVNp/EhH7mdRXFibO1uaEXKwWysI28JMvGOCa4vp53cBxlZ5GeKQP1b"
+    "ZIZ7wf6CNEWjVXnQUTbJWtB3tzmRRqxwu6ILW3Hi5zNhRuizvvKhwIgO5nqiAJ/4"
+    "aNy33I4u7QlWw6hLbuc/6qQzGWBK16vXGlgpiTWYQGq3rcewbckrF8ege0gAkAvb"
+    "q5Mg08ycQWZw5gCAhNPnw07xpiUhF0NwFfLvNgJIJfK8Zr/f63uRETcW3FsasH2C"
+    "uetwrYMFjV2cIvpg4hnDqzc3K/ouL+ediqdRcWG8KelELOFVF8J0/M8yTmrGIWyX"
+    "9dVbYuh6Af9BpvOxyBxwQAXaBa7B5pe2/dCqxXACClxQt2q5SfzqZI9j7VkpbgOS"
+    "d1BG6XyOW9mtBr4ZjtwZhBWO56BHxnSoW6kgppHB4tNDX+k2iaab6WhT8O5jC4Iq"
+    "bBrsD9ZkjhgUHpcao97iYdTASGCohb3HRJV7ZJiKq2fDnnO0tjINcUR1nORXmkNA"
+    "MN7cKaNFLrVzgXyDIAGXr8cCAwEAAQ=="
+)
+DKIM_SELECTORS = ["google", "selector1", "default", "s1", "k1"]
+# Mail providers shared by many customer domains
+PROVIDERS = {
+    "mailhost-a.test": {
+        "_spf.mailhost-a.test": {"TXT": [
+            '"v=spf1 ip4:198.51.100.0/24 include:_spf2.mailhost-a.test ~all"'
+        ]},
+        "_spf2.mailhost-a.test": {"TXT": ['"v=spf1 ip4:203.0.113.0/24 ~all"']},
+        "aspmx.mailhost-a.test": {"A": ["198.51.100.25"], "AAAA": ["2001:db8:25::1"]},
+        "alt1.mailhost-a.test": {"A": ["198.51.100.26"], "AAAA": ["2001:db8:25::2"]},
+    },
+    "mailhost-b.test": {
+        "spf.mailhost-b.test": {"TXT": [
+            '"v=spf1 ip4:192.0.2.0/25 ip6:2001:db8:b::/48 -all"'
+        ]},
+        "inbound.mailhost-b.test": {"A": ["192.0.2.10"]},
+    },
+}
+PROVIDER_SPF = {"mailhost-a.test": "_spf.mailhost-a.test", "mailhost-b.test": "spf.mailhost-b.test"}
+PROVIDER_MX = {
+    "mailhost-a.test": ["1 aspmx.mailhost-a.test.", "5 alt1.mailhost-a.test."],
+    "mailhost-b.test": ["10 inbound.mailhost-b.test."],
+}
+
+
+def _txt(value: str) -> str:
+    return " ".join(f'"{value[i:i + 255]}"' for i in range(0, len(value), 255))
+
+
+def synthetic_zone(domain: str, rng: random.Random, large_key_rate: float = 0.1) -> Records:
+    """One customer domain, drawn from a mix like a real customer base.
+
+    Most domains use a shared mail provider's SPF include and MX hosts; the
+    rest run their own. Some have no DMARC or DKIM record, a few a null MX.
+    DKIM keys live under one of the common selectors, ``large_key_rate`` of
+    them 4096-bit keys that only fit in a TCP answer.
+    """
+    records: Records = {domain: {}}
+    provider = rng.choice(list(PROVIDERS)) if rng.random() < 0.7 else None
+
+    if rng.random() < 0.85:
+        policy = rng.choice(["reject", "quarantine", "none"])
+        records[f"_dmarc.{domain}"] = {"TXT": [
+            f'"v=DMARC1; p={policy}; rua=mailto:dmarc@{domain}"'
+        ]}
+    if rng.random() < 0.9:
+        if provider:
+            spf = f"v=spf1 include:{PROVIDER_SPF[provider]} ~all"
+        else:
+            spf = "v=spf1 a mx ip4:192.0.2.0/24 -all"
+        records[domain]["TXT"] = [f'"{spf}"', f'"site-verification={rng.getrandbits(64):016x}"']
+    if rng.random() < 0.8:
+        key = DKIM_4096_KEY if rng.random() < large_key_rate else DKIM_PUBLIC_KEY
+        selector = rng.choice(DKIM_SELECTORS)
+        records[f"{selector}._domainkey.{domain}"] = {"TXT": [
+            _txt(f"v=DKIM1; k=rsa; p={key}")
+        ]}
+
+    roll = rng.random()
+    if provider and roll < 0.95:
+        records[domain]["MX"] = PROVIDER_MX[provider]
+    elif roll < 0.95:
+        records[domain]["MX"] = [f"10 mx1.{domain}.", f"20 mx2.{domain}."]
+        records[domain]["A"] = ["192.0.2.80"]
+        records[f"mx1.{domain}"] = {"A": ["192.0.2.25"]}
+        records[f"mx2.{domain}"] = {"A": ["192.0.2.26"], "AAAA": ["2001:db8::26"]}
+    else:
+        records[domain]["MX"] = ["0 ."]
+    return records
+
+
+def synthetic_zones(count: int, seed: int = 0, large_key_rate: float = 0.1) -> Records:
+    """``count`` customer domains (``customer{i}.test``) plus the providers'
+    records, the same for the same ``seed``."""
+    rng = random.Random(seed)
+    records: Records = {}
+    for zones in PROVIDERS.values():
+        records.update(zones)
+    for i in range(count):
+        records.update(synthetic_zone(f"customer{i}.test", rng, large_key_rate))
+    return records
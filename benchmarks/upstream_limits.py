@@ -0,0 +1,105 @@
+"""
+Bulk re-checks against a rate-limiting upstream, with and without AIMD.
+
+A local stub server answers SERVFAIL to queries beyond ``--capacity`` in
+flight at once, like a public resolver shedding load. ``--domains`` full
+checks run through ``DNSChecker.check_many`` with ``--concurrency`` checks
+at a time. ``unlimited`` sends every query as soon as a check asks for it
+(the previous behaviour); ``adaptive`` puts the per-upstream AIMD limiter in
+front. Results with an ``error`` or ``timeout`` status in any check are what
+would have been written to the ``domains`` table as failures.
+
+    python -m benchmarks.upstream_limits --domains 500 --capacity 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+
+os.environ.setdefault("POSTGRES_USER", "bench")
+os.environ.setdefault("POSTGRES_PASSWORD", "bench")
+os.environ.setdefault("POSTGRES_DB", "bench")
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+os.environ["DNS_CACHE_ENABLED"] = "false"
+
+from app.services import dns_checker  # noqa: E402
+from app.services.check_engine import CheckRequest  # noqa: E402
+from app.services.dns_checker import DNSChecker  # noqa: E402
+from app.services.dns_resolver import AIMDLimiter, AsyncResolver  # noqa: E402
+from app.services.mx import MXHostResolver  # noqa: E402
+from app.services.spf import SPFEvaluator  # noqa: E402
+from benchmarks.stub_dns import StubDNSServer, email_records  # noqa: E402
+
+UNLIMITED = 10 ** 6
+
+
+async def run(mode: str, args) -> dict:
+    server = StubDNSServer(delay=args.delay, capacity=args.capacity)
+    names = [f"customer{i}.test" for i in range(args.domains)]
+    for name in names:
+        for owner, rrsets in email_records(name).items():
+            server.add(owner, rrsets)
+
+    async with server:
+        DNSChecker.resolver = AsyncResolver([server.address])
+        dns_checker.spf_evaluator = SPFEvaluator(DNSChecker.resolver)
+        dns_checker.mx_hosts = MXHostResolver(DNSChecker.resolver)
+        upstream = DNSChecker.resolver.upstreams[0]
+        if mode == "unlimited":
+            upstream.limiter = AIMDLimiter(UNLIMITED, UNLIMITED, UNLIMITED)
+        peak_limit = 0
+
+        async def sample() -> None:
+            nonlocal peak_limit
+            while True:
+                peak_limit = max(peak_limit, int(upstream.limiter.limit))
+                await asyncio.sleep(0.01)
+
+        sampler = asyncio.create_task(sample())
+        started = time.perf_counter()
+        failed = Counter()
+        async for _, result, error in DNSChecker.check_many(
+            [CheckRequest(name, dkim_selectors=["default"]) for name in names],
+            args.concurrency,
+        ):
+            statuses = {info["status"] for info in result["check_summary"].values()}
+            failed.update(statuses & {"error", "timeout"})
+            failed["any"] += bool(statuses & {"error", "timeout"})
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+
+    stats = DNSChecker.resolver.stats()[server.address]
+    return {
+        "mode": mode,
+        "domains": args.domains,
+        "elapsed_s": round(elapsed, 2),
+        "checks_failed": failed["any"],
+        "check_errors": failed["error"],
+        "check_timeouts": failed["timeout"],
+        "queries_sent": server.queries,
+        "servfails": server.servfails,
+        "final_limit": stats["limit"] if mode == "adaptive" else None,
+        "peak_limit": peak_limit if mode == "adaptive" else None,
+        "limit_decreases": stats["limit_decreases"],
+    }
+
+
+async def main(args) -> None:
+    modes = ["unlimited", "adaptive"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        print(json.dumps(await run(mode, args)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--domains", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100,
+                        help="checks in flight at once")
+    parser.add_argument("--capacity", type=int, default=40,
+                        help="queries the upstream serves at once before SERVFAIL")
+    parser.add_argument("--delay", type=float, default=0.02)
+    parser.add_argument("--mode", choices=["unlimited", "adaptive", "both"], default="both")
+    asyncio.run(main(parser.parse_args()))
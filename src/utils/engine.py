@@ -0,0 +1,94 @@
+import asyncio
+import atexit
+import threading
+import dns.exception
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+from app.services.dns_checker import DNSChecker
+from app.services.dns_resolver import AsyncResolver
+
+_loop = None
+_loop_lock = threading.Lock()
+# AsyncResolvers for the synchronous resolvers passed in, by nameservers
+_resolvers = {}
+
+# Checks (and check_all fields) whose records are TXT records
+TXT_CHECKS = ('dmarc', 'spf', 'dkim')
+TXT_FIELDS = ('dmarc_record', 'spf_record', 'dkim_record')
+
+
+def decode_txt(record):
+    # The engine returns TXT records in presentation format ('"v=spf1 ..."',
+    # long ones split into several quoted strings); these checkers have always
+    # returned the record's text
+    if record is None:
+        return None
+    try:
+        rdata = dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.TXT, record)
+    except dns.exception.DNSException:
+        return record
+    return b''.join(rdata.strings).decode('utf-8', 'replace')
+
+
+def run(coro):
+    # Every synchronous call runs on one background event loop. The resolver,
+    # its caches and its per-nameserver limits are shared and tied to the loop
+    # they run on, so a fresh asyncio.run() per call (or per thread) can't
+    # safely use them concurrently
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='dns-checks', daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+
+def _nameserver_address(nameserver):
+    # dnspython lists nameservers as given: addresses, or Nameserver objects
+    if isinstance(nameserver, str):
+        return nameserver
+    host, port = nameserver.address, getattr(nameserver, 'port', 53)
+    return f'[{host}]:{port}' if ':' in host else f'{host}:{port}'
+
+
+def _async_resolver(resolver):
+    # One AsyncResolver per set of nameservers, kept across calls along with
+    # its connection pools, health scores and limits
+    key = tuple(_nameserver_address(ns) for ns in resolver.nameservers)
+    with _loop_lock:
+        if key not in _resolvers:
+            _resolvers[key] = AsyncResolver(nameservers=list(key))
+        return _resolvers[key]
+
+
+async def _close_resolvers():
+    for async_resolver in _resolvers.values():
+        async_resolver.close()
+
+
+@atexit.register
+def _shutdown():
+    if _loop is not None and _resolvers:
+        run(_close_resolvers())
+
+
+def run_check(name, domain, resolver=None, selector=None, discover_dkim=False):
+    # Run one check of the shared check engine (app.services.check_engine); a
+    # synchronous resolver passed in only contributes its nameservers
+    async_resolver = _async_resolver(resolver) if resolver is not None else None
+    record, valid, info = run(
+        DNSChecker.run_check(
+            name, domain, selector=selector, resolver=async_resolver, discover_dkim=discover_dkim
+        )
+    )
+    if name in TXT_CHECKS:
+        record = decode_txt(record)
+    return {
+        'exists': record is not None,
+        'valid': valid,
+        'record': record,
+        'status': info['status'],
+        'info': info,
+        'error': None if valid else info['message']
+    }
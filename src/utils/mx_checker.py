@@ -1 +1,10 @@
- 
\ No newline at end of file
+from .engine import run_check
+
+
+def check_mx_record(domain, resolver=None):
+    # Resolves every exchange too (see app.services.mx); host resolutions are
+    # shared with every other domain using the same mail hosts
+    result = run_check('mx', domain, resolver)
+    result['hosts'] = result['info'].get('hosts', [])
+    result['warnings'] = result['info'].get('warnings', [])
+    return result